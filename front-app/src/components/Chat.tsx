@@ -28,6 +28,9 @@ const defaultQuestions = ["Napravi mi pitanja za test iz ove lekcije.",
                           "Napravi mi plan casa za ovu lekciju.",
                         ];
 
+// separates the answer from the metadata that follows it (trailingMetadata in the request)
+const METADATA_SEPARATOR = "\x1e";
+
 export function Chat() {
     const [messages, setMessages] = useState<MessageModel[]>([welcomeMessage]);
     const [isAnswering, setAnswering] = useState(false);
@@ -119,7 +122,8 @@ export function Chat() {
             "accessKey": context?.accessKey ?? "default",
             "condensedHistory": condensedHistory,
             "contextAttributes": {"activity_key": activitiyKey, "course_key": courseKey},
-            "model": model
+            "model": model,
+            "trailingMetadata": true
         };
         const r = await fetch(
             "../api/chat",
@@ -151,7 +155,7 @@ export function Chat() {
         setMessages([...messages, outMessage]);
 
         const r = await postQuestion(textContent);
-        var hasInitialData = false;   
+        var receivedText = "";
         var answerText = "";
 
         const reader = r.body!.getReader()
@@ -161,35 +165,9 @@ export function Chat() {
             if (done)
                 break;
 
-            const chunkText = utf8decoder.decode(value);
-            if (!hasInitialData) {
-                const metadataEndIndex = chunkText.indexOf('\n');
-                if (metadataEndIndex !== -1) {
-                        const jsonText = chunkText.slice(0, metadataEndIndex);
-                        const metadata = JSON.parse(jsonText);
-
-                        let condensedHistory = metadata.condensed_history;
-                        let followupQuestions = metadata.followup_questions;
-
-                        if (condensedHistory !== "")
-                            setCondensedHistory(condensedHistory ? condensedHistory : "");
-
-                        if (followupQuestions) {
-                                setQuestions(followupQuestions); 
-                        }
-                        else{
-                            setQuestions([]);
-                        }
-                
-                        hasInitialData = true;
-                        answerText += chunkText.slice(metadataEndIndex + 1);
-                }
-                else{
-                    answerText += chunkText;
-                }
-            } else {
-                answerText += chunkText;
-            }
+            receivedText += utf8decoder.decode(value, { stream: true });
+            const separatorIndex = receivedText.indexOf(METADATA_SEPARATOR);
+            answerText = separatorIndex === -1 ? receivedText : receivedText.slice(0, separatorIndex);
 
             const answerHtml = marked.parse(answerText)
             const inMessage: MessageModel = {
@@ -202,6 +180,24 @@ export function Chat() {
 
         };
 
+        const separatorIndex = receivedText.indexOf(METADATA_SEPARATOR);
+        if (separatorIndex !== -1) {
+            const metadata = JSON.parse(receivedText.slice(separatorIndex + 1));
+
+            let condensedHistory = metadata.condensed_history;
+            let followupQuestions = metadata.followup_questions;
+
+            if (condensedHistory !== "")
+                setCondensedHistory(condensedHistory ? condensedHistory : "");
+
+            if (followupQuestions) {
+                    setQuestions(followupQuestions); 
+            }
+            else{
+                setQuestions([]);
+            }
+        }
+
         setHistory([...history, { q: textContent, a: answerText }]);
         setAnswering(false);
     }
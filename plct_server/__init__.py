@@ -14,6 +14,8 @@ if not logger.hasHandlers():
 # When the PLCT Server package is used as an extension to the plct CLI, 
 # this function will be called to register the extension's commands
 def register_extension_command(cli_group):
-    from .cli_main import serve, batch_review
+    from .cli_main import serve, batch_review, benchmark, loadtest
     cli_group.add_command(serve)
     cli_group.add_command(batch_review)
+    cli_group.add_command(benchmark)
+    cli_group.add_command(loadtest)
@@ -0,0 +1,186 @@
+import asyncio
+import logging
+import math
+import time
+import weakref
+from typing import AsyncGenerator, AsyncIterator, Callable, Generic, TypeVar
+
+from .query_context import QueryError
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+class OverloadedError(QueryError):
+    """The request was not admitted because of the concurrency or token limits.
+    `retry_after` is a hint (in seconds) for the Retry-After header."""
+
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+class AdmissionLimiter:
+    """Concurrency and tokens-per-minute limits of a provider or a model.
+
+    Requests that can't run immediately wait in a queue of at most `max_waiting`
+    requests for at most `timeout` seconds. If the queue is full or the timeout
+    expires, `OverloadedError` is raised."""
+
+    def __init__(self, name: str, max_concurrency: int | None, tokens_per_minute: int | None,
+                 max_waiting: int, timeout: float):
+        self.name = name
+        self.max_concurrency = max_concurrency
+        self.tokens_per_minute = tokens_per_minute
+        self.max_waiting = max_waiting
+        self.timeout = timeout
+        self.running = 0
+        self.waiting = 0
+        self.rejected = 0
+        self._tokens = float(tokens_per_minute or 0)
+        self._refilled = time.monotonic()
+        self._changed = asyncio.Event()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        if self.tokens_per_minute:
+            self._tokens = min(self.tokens_per_minute,
+                               self._tokens + (now - self._refilled) * self.tokens_per_minute / 60)
+        self._refilled = now
+
+    def _tokens_delay(self, tokens: int) -> float:
+        """Seconds until `tokens` are available."""
+        if not self.tokens_per_minute:
+            return 0.0
+        self._refill()
+        # a request larger than the whole budget waits for the full budget
+        missing = min(tokens, self.tokens_per_minute) - self._tokens
+        return max(missing, 0) * 60 / self.tokens_per_minute
+
+    def _can_run(self, tokens: int) -> bool:
+        if self.max_concurrency and self.running >= self.max_concurrency:
+            return False
+        return self._tokens_delay(tokens) == 0.0
+
+    def _reject(self, reason: str, tokens: int) -> OverloadedError:
+        self.rejected += 1
+        retry_after = max(1, math.ceil(self._tokens_delay(tokens) or self.timeout))
+        logger.warning(f"Request to {self.name} rejected: {reason}")
+        return OverloadedError(f"{self.name} is overloaded: {reason}", retry_after)
+
+    async def _wait(self, tokens: int) -> None:
+        while not self._can_run(tokens):
+            delay = self._tokens_delay(tokens)
+            try:
+                # waits for a finished request, or for the token budget to be refilled
+                await asyncio.wait_for(self._changed.wait(), delay or None)
+            except asyncio.TimeoutError:
+                pass
+
+    async def acquire(self, tokens: int = 0) -> None:
+        if not self._can_run(tokens):
+            if self.waiting >= self.max_waiting:
+                raise self._reject("wait queue is full", tokens)
+            self.waiting += 1
+            try:
+                await asyncio.wait_for(self._wait(tokens), self.timeout)
+            except asyncio.TimeoutError:
+                raise self._reject(f"not admitted in {self.timeout}s", tokens) from None
+            finally:
+                self.waiting -= 1
+        self.running += 1
+        if self.tokens_per_minute:
+            self._tokens -= min(tokens, self.tokens_per_minute)
+
+    def release(self) -> None:
+        self.running -= 1
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+class AdmissionController:
+    """Limiters of all providers and models, created on first use."""
+
+    def __init__(self, max_waiting: int, timeout: float, provider_max_concurrency: dict[str, int]):
+        self.max_waiting = max_waiting
+        self.timeout = timeout
+        self.provider_max_concurrency = provider_max_concurrency
+        self._limiters: dict[str, AdmissionLimiter] = {}
+
+    def _limiter(self, name: str, max_concurrency: int | None, tokens_per_minute: int | None) -> AdmissionLimiter | None:
+        if not max_concurrency and not tokens_per_minute:
+            return None
+        limiter = self._limiters.get(name)
+        if limiter is None:
+            limiter = AdmissionLimiter(name, max_concurrency, tokens_per_minute, self.max_waiting, self.timeout)
+            self._limiters[name] = limiter
+        return limiter
+
+    async def acquire(self, provider: str, model: str, max_concurrency: int | None = None,
+                      tokens_per_minute: int | None = None, tokens: int = 0) -> Callable[[], None]:
+        """Admit a request to `model` of `provider`, using `tokens` of the model's budget.
+        Returns the function that releases the concurrency slots of the request."""
+        limiters = [limiter for limiter in (
+            self._limiter(f"provider {provider}", self.provider_max_concurrency.get(provider), None),
+            self._limiter(f"model {model}", max_concurrency, tokens_per_minute)
+        ) if limiter is not None]
+        acquired: list[AdmissionLimiter] = []
+
+        def release() -> None:
+            while acquired:
+                acquired.pop().release()
+
+        try:
+            for limiter in limiters:
+                await limiter.acquire(tokens)
+                acquired.append(limiter)
+        except BaseException:
+            release()
+            raise
+        return release
+
+    def stats(self) -> dict[str, dict[str, int]]:
+        return {name: {"running": limiter.running, "waiting": limiter.waiting, "rejected": limiter.rejected}
+                for name, limiter in self._limiters.items()}
+
+class AdmittedStream:
+    """Upstream stream that holds its concurrency slots until it is exhausted or closed,
+    or until it is garbage collected if it is never iterated."""
+
+    def __init__(self, stream: AsyncIterator[T], release: Callable[[], None]):
+        self.stream = stream
+        self._release = weakref.finalize(self, release)
+
+    def __aiter__(self) -> AsyncIterator[T]:
+        return self._iterate()
+
+    async def _iterate(self) -> AsyncIterator[T]:
+        try:
+            async for item in self.stream:
+                yield item
+        finally:
+            await self.close()
+
+    async def close(self) -> None:
+        self._release()
+        if hasattr(self.stream, "close"):
+            await self.stream.close()
+
+class ClosingStream(Generic[T]):
+    """Async iterator over `stream` whose `aclose` also closes the `upstream` stream it reads
+    from, even if it was never iterated: closing an async generator that hasn't started
+    doesn't run its cleanup, so the upstream stream would stay open until garbage collected."""
+
+    def __init__(self, stream: AsyncGenerator[T, None], upstream: AsyncGenerator):
+        self.stream = stream
+        self.upstream = upstream
+
+    def __aiter__(self) -> AsyncIterator[T]:
+        return self
+
+    async def __anext__(self) -> T:
+        return await self.stream.__anext__()
+
+    async def aclose(self) -> None:
+        try:
+            await self.stream.aclose()
+        finally:
+            await self.upstream.aclose()
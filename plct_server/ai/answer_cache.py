@@ -0,0 +1,79 @@
+import logging
+import time
+from collections import OrderedDict
+from typing import NamedTuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+class CachedAnswer(NamedTuple):
+    answer: str
+    followup_questions: list[str]
+
+class _Entry(NamedTuple):
+    embedding: np.ndarray
+    answer: CachedAnswer
+    created: float
+
+class AnswerCache:
+    """Answers to first-turn questions, keyed by (dataset version, course_key, activity_key,
+    classification, model) and looked up by the similarity of the query embeddings.
+
+    An answer is returned if the inner product of the embeddings (cosine similarity,
+    as the embeddings are normalized) is at least `min_similarity`. Entries expire
+    after `ttl` seconds and the oldest entries are evicted when there are more than
+    `maxsize` of them. Answers depend on the AI context dataset, so keys include its
+    version, and answers based on another version of the dataset are never returned."""
+
+    def __init__(self, maxsize: int, ttl: float, min_similarity: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.min_similarity = min_similarity
+        self.hits = 0
+        self.misses = 0
+        self._entries: dict[tuple[str, str, str, str, str], list[_Entry]] = {}
+        self._order: OrderedDict[int, tuple[str, str, str, str, str]] = OrderedDict()
+
+    @property
+    def enabled(self) -> bool:
+        return self.maxsize > 0
+
+    def get(self, key: tuple[str, str, str, str, str], embedding: list[float]) -> CachedAnswer | None:
+        entries = self._entries.get(key)
+        if entries:
+            now = time.monotonic()
+            live = [entry for entry in entries if now - entry.created < self.ttl]
+            if len(live) < len(entries):
+                self._remove(key, {id(entry) for entry in entries if now - entry.created >= self.ttl})
+            if live:
+                similarities = np.stack([entry.embedding for entry in live]) @ np.asarray(embedding, dtype=np.float32)
+                best = int(np.argmax(similarities))
+                if similarities[best] >= self.min_similarity:
+                    self.hits += 1
+                    logger.debug(f"Answer cache hit for {key} (similarity {similarities[best]:.4f})")
+                    return live[best].answer
+        self.misses += 1
+        return None
+
+    def put(self, key: tuple[str, str, str, str, str], embedding: list[float], answer: CachedAnswer) -> None:
+        if not self.enabled:
+            return
+        entry = _Entry(np.asarray(embedding, dtype=np.float32), answer, time.monotonic())
+        self._entries.setdefault(key, []).append(entry)
+        self._order[id(entry)] = key
+        while len(self._order) > self.maxsize:
+            entry_id, oldest_key = next(iter(self._order.items()))
+            self._remove(oldest_key, {entry_id})
+
+    def _remove(self, key: tuple[str, str, str, str, str], removed_ids: set[int]) -> None:
+        for entry_id in removed_ids:
+            self._order.pop(entry_id, None)
+        entries = [entry for entry in self._entries[key] if id(entry) not in removed_ids]
+        if entries:
+            self._entries[key] = entries
+        else:
+            del self._entries[key]
+
+    def stats(self) -> dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses, "size": len(self._order)}
@@ -1,46 +1,101 @@
+import importlib.util
 import logging
 
 from typing import Union
-from openai import AsyncAzureOpenAI, AsyncOpenAI, OpenAI
+import httpx
+from openai import AsyncAzureOpenAI, AsyncOpenAI, DefaultAsyncHttpxClient, OpenAI
 from .model_conf import ModelConfig, ModelProvider
 
 logger = logging.getLogger(__name__)
 
 class AiClientFactory:
+    """Creates AI clients and reuses them.
+
+    One client is kept per (provider, endpoint, deployment, api_version), and all clients
+    share one HTTP connection pool, so connections are kept alive between requests.
+    Call `aclose` on shutdown to close the pool."""
+
     def __init__(self, 
                  default_provider: ModelProvider, 
                  openai_api_key: str, 
                  azure_api_key: str,
                  vllm_api_key: str,
                  vllm_url: str = None,
-                 azure_default_ai_endpoint: str = None):
+                 openai_url: str = None,
+                 azure_default_ai_endpoint: str = None,
+                 max_connections: int = 100,
+                 max_keepalive_connections: int = 20,
+                 keepalive_expiry: float = 30.0,
+                 http2: bool = False):
         logger.debug(f"Creating AiClientFactory with provider {default_provider}")
         self.default_provider = default_provider
         self.openai_api_key = openai_api_key
         self.azure_api_key = azure_api_key
         self.vllm_api_key = vllm_api_key or "EMPTY"
         self.vllm_url = vllm_url
+        self.openai_url = openai_url
         self.azure_default_ai_endpoint = azure_default_ai_endpoint
-        
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry)
+        if http2 and importlib.util.find_spec("h2") is None:
+            logger.warning("HTTP/2 requires the h2 package (pip install httpx[http2]), using HTTP/1.1")
+            http2 = False
+        self.http2 = http2
+        self._http_client: httpx.AsyncClient | None = None
+        self._clients: dict[tuple, Union[AsyncOpenAI, AsyncAzureOpenAI]] = {}
+
+    def _get_http_client(self) -> httpx.AsyncClient:
+        # created lazily, so that it is bound to the event loop that serves requests
+        if self._http_client is None or self._http_client.is_closed:
+            logger.debug(f"Creating shared HTTP client with {self.limits}, http2={self.http2}")
+            self._http_client = DefaultAsyncHttpxClient(limits=self.limits, http2=self.http2)
+        return self._http_client
 
     def get_client(self, model_config: ModelConfig) -> Union[AsyncOpenAI, AsyncAzureOpenAI]:
         provider = model_config.provider or self.default_provider
+        if provider == ModelProvider.AZURE:
+            key = (provider, self.azure_default_ai_endpoint,
+                   model_config.azure_deployment_name, model_config.azure_api_version)
+        elif provider == ModelProvider.VLLM:
+            key = (provider, self.vllm_url, None, None)
+        else:
+            key = (provider, None, None, None)
+        client = self._clients.get(key)
+        if client is None:
+            client = self._create_client(provider, model_config)
+            self._clients[key] = client
+        return client
+
+    def _create_client(self, provider: ModelProvider, model_config: ModelConfig) -> Union[AsyncOpenAI, AsyncAzureOpenAI]:
+        http_client = self._get_http_client()
         if provider == ModelProvider.VLLM:
             logger.debug(f"Using local VLLM server for model {model_config.name}")
-            return AsyncOpenAI(api_key=self.vllm_api_key, base_url=self.vllm_url)
+            return AsyncOpenAI(api_key=self.vllm_api_key, base_url=self.vllm_url,
+                               http_client=http_client)
         if provider == ModelProvider.OPENAI:
             logger.debug(f"Using OpenAI API with model {model_config.name}")
-            return AsyncOpenAI(api_key=self.openai_api_key)
+            return AsyncOpenAI(api_key=self.openai_api_key, base_url=self.openai_url,
+                               http_client=http_client)
         if provider == ModelProvider.AZURE:
             logger.debug(f"Using Azure API with model {model_config.name} and endpoint {self.azure_default_ai_endpoint}")
             return AsyncAzureOpenAI(
                 api_key=self.azure_api_key,
                 azure_endpoint=self.azure_default_ai_endpoint,
                 azure_deployment=model_config.azure_deployment_name,
-                api_version=model_config.azure_api_version
+                api_version=model_config.azure_api_version,
+                http_client=http_client
             )
         raise ValueError(f"Unsupported AI provider: {provider}")
 
+    async def aclose(self) -> None:
+        self._clients.clear()
+        if self._http_client is not None:
+            logger.debug("Closing shared HTTP client")
+            await self._http_client.aclose()
+            self._http_client = None
+
     def list_vllm_models(self) -> dict[str, int]:
         """Query the vLLM server for available models using the OpenAI-compatible API.
         
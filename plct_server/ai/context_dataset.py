@@ -3,14 +3,20 @@ import hashlib
 import io
 import json
 import logging
+import mmap
 import os
 from dataclasses import dataclass
 import re
+import shutil
+import numpy as np
+import tiktoken
 from openai import OpenAI, AzureOpenAI
 from pydantic import BaseModel
 import zstandard as zstd
 
 from ..content.fileset import FileSet, LocalFileSet
+from .cache import LruCache
+from .lexical_index import LexicalIndex
 from ..ioutils import read_json, read_str, write_str
 
 logger = logging.getLogger(__name__)
@@ -33,6 +39,52 @@ class ChunkMetadata(BaseModel):
     lesson_title: str
     activity_title: str
 
+VECTOR_INDEX_DIR = "vector-index"
+CHUNK_PACK_PATH = "chunks.pack"
+CHUNK_PACK_INDEX_PATH = "chunks-pack-index.json.zst"
+CHUNK_RANGE_MAX_GAP = 64 * 1024
+TOKEN_COUNTS_PATH = "token-counts.json.zst"
+LEXICAL_INDEX_PATH = "lexical-index.npz"
+LEXICAL_INDEX_META_PATH = "lexical-index-meta.json.zst"
+
+def chunk_set_hash(ids: list[str], metadatas: list[dict]) -> str:
+    """Hash of the chunk set of an embedding type, used to version derived artifacts.
+
+    Chunk metadata is included because an existing chunk may be moved to another activity
+    without changing its text hash."""
+    h = hashlib.sha256()
+    for chunk_id, metadata in sorted(zip(ids, metadatas), key=lambda item: item[0]):
+        h.update(chunk_id.encode('utf-8'))
+        h.update(json.dumps(metadata, sort_keys=True).encode('utf-8'))
+    return h.hexdigest()
+
+def vector_index_rel_path(embedding_type: str) -> str:
+    return f"{VECTOR_INDEX_DIR}/chroma-{embedding_type}"
+
+def sort_emb_data(emb_data: dict) -> dict:
+    """Order embeddings by course and activity, so that rows of each course and
+    each activity are contiguous in the embedding matrix."""
+    order = sorted(range(len(emb_data["ids"])),
+                   key=lambda i: (emb_data["metadatas"][i]["course_key"],
+                                  emb_data["metadatas"][i]["activity_key"],
+                                  emb_data["ids"][i]))
+    return {key: [values[i] for i in order] for key, values in emb_data.items()}
+
+def pack_metadatas(metadatas: list[dict]) -> tuple[list[dict], list[int]]:
+    """Deduplicate chunk metadata, which is shared by all chunks of an activity."""
+    table: list[dict] = []
+    table_idx: dict[str, int] = {}
+    rows: list[int] = []
+    for metadata in metadatas:
+        key = json.dumps(metadata, sort_keys=True)
+        idx = table_idx.get(key)
+        if idx is None:
+            idx = len(table)
+            table_idx[key] = idx
+            table.append(metadata)
+        rows.append(idx)
+    return table, rows
+
 class ContextDatasetBuilder:
     base_dir: str
     active_chunks = set()
@@ -110,12 +162,24 @@ class ContextDatasetBuilder:
             course_summary_json = course_summary.model_dump_json(indent=2)
             write_str(json_file, course_summary_json)
 
-    def update_index(self, delete_inactive_chunks: bool):
+    def update_index(self, delete_inactive_chunks: bool, build_vector_index: bool = False,
+                     emb_dtype: str = "float32", legacy_json: bool = True,
+                     token_encoding: str = "o200k_base", build_lexical_index: bool = True):
+        """Write `index.json` and the embedding files of all active chunks.
+
+        Embeddings are written as a `.npy` matrix of `emb_dtype` ("float32" or "float16")
+        with ids and metadata in a `-meta.json.zst` sidecar. With `legacy_json`, the
+        `.json.zst` format read by older PLCT Server versions is written as well.
+        Token counts of chunks, summaries and TOCs are computed with the `token_encoding`
+        tiktoken encoding. With `build_lexical_index`, a BM25 index of chunk texts is written
+        for hybrid retrieval."""
         course_keys = []
+        course_summaries = []
         for course_key, course_summary in self.course_dict.items():
             path = os.path.join(self.base_dir, course_key, "summary.json")
             course_summary = CourseSummary.model_validate_json(read_str(path))
             course_keys.append(course_summary.course_key)
+            course_summaries.append(course_summary)
 
         chunk_embedding_pattern = os.path.join(self.base_dir, 
                 f'chunks/*/*-*.json')
@@ -150,39 +214,274 @@ class ContextDatasetBuilder:
             metadata = read_json(metadata_path)
             emb_data["metadatas"].append(metadata)
 
+        chunk_dict = {embedding_type: sort_emb_data(emb_data)
+                      for embedding_type, emb_data in chunk_dict.items()}
+
         index = {
             "courses": course_keys,
-            "emb_types": list(chunk_dict.keys())
+            "emb_types": list(chunk_dict.keys()),
+            "chunk_set_hashes": {
+                embedding_type: chunk_set_hash(emb_data["ids"], emb_data["metadatas"])
+                for embedding_type, emb_data in chunk_dict.items()
+            }
         }
+        index["chunk_pack"] = self.write_chunk_pack(chunk_dict)
+        token_counts_path = self.write_token_counts(chunk_dict, course_summaries, token_encoding)
+        if token_counts_path is not None:
+            index["token_counts"] = token_counts_path
+        if build_lexical_index:
+            index["lexical_index"] = self.write_lexical_index(chunk_dict)
+        if build_vector_index:
+            index["vector_indexes"] = {}
+            for embedding_type, emb_data in chunk_dict.items():
+                rel_path = self.build_vector_index(embedding_type, emb_data,
+                                                   index["chunk_set_hashes"][embedding_type])
+                index["vector_indexes"][embedding_type] = rel_path
 
         index_path = os.path.join(self.base_dir, "index.json")
         write_str(index_path, json.dumps(index, indent=2))
         for embedding_type, emb_data in chunk_dict.items():
+            logger.info(embedding_type)
+            self.write_binary_embeddings(embedding_type, emb_data, emb_dtype)
+            if not legacy_json:
+                continue
             emb_path = os.path.join(self.base_dir, f"emb-{embedding_type}.json.zst")
             emb_str = json.dumps(emb_data, indent=2,
                                     separators=(',', ': '))
-            logger.info(embedding_type)
             emb_str = re.sub(r'(?<=\d,)\s+|(?<=\d)\s+|(?<=\[)\s+(?=[\d-])', '', emb_str)
             with zstd.open(emb_path, 'wt', encoding='utf-8') as f:
                 f.write(emb_str)
 
+    def write_chunk_pack(self, chunk_dict: dict[str, dict]) -> dict:
+        """Write texts of all active chunks into a single file, with an index of byte ranges.
+
+        Chunks are written in the embedding order (by course and activity), so chunks
+        retrieved for one activity are close to each other in the pack."""
+        chunk_ids = list(dict.fromkeys(
+            chunk_id for emb_data in chunk_dict.values() for chunk_id in emb_data["ids"]))
+        pack_index = {}
+        pack_hash = hashlib.sha256()
+        offset = 0
+        with open(os.path.join(self.base_dir, CHUNK_PACK_PATH), 'wb') as f:
+            for chunk_id in chunk_ids:
+                text_path = os.path.join(self.base_dir, "chunks", chunk_id[:2], f"{chunk_id}.txt")
+                b = read_str(text_path).encode('utf-8')
+                f.write(b)
+                pack_hash.update(b)
+                pack_index[chunk_id] = [offset, len(b)]
+                offset += len(b)
+        with zstd.open(os.path.join(self.base_dir, CHUNK_PACK_INDEX_PATH), 'wt', encoding='utf-8') as f:
+            f.write(json.dumps(pack_index, separators=(',', ':')))
+        return {
+            "path": CHUNK_PACK_PATH,
+            "index_path": CHUNK_PACK_INDEX_PATH,
+            "version": pack_hash.hexdigest()
+        }
+
+    def write_token_counts(self, chunk_dict: dict[str, dict], course_summaries: list[CourseSummary],
+                           token_encoding: str) -> str | None:
+        """Write token counts of all static texts, so the AI engine doesn't need to tokenize them.
+
+        Texts are keyed by their path relative to the dataset base folder. tiktoken downloads
+        the encoding unless it is in the tiktoken cache (`TIKTOKEN_CACHE_DIR`). If the encoding
+        can't be loaded, no token counts are written (and None is returned), so the AI engine
+        counts tokens itself."""
+        try:
+            encoding = tiktoken.get_encoding(token_encoding)
+        except Exception as e:
+            logger.warning(f"Failed to load token encoding '{token_encoding}', token counts are not written: {e}")
+            return None
+        chunk_ids = dict.fromkeys(
+            chunk_id for emb_data in chunk_dict.values() for chunk_id in emb_data["ids"])
+        chunk_counts = {}
+        for chunk_id in chunk_ids:
+            text_path = os.path.join(self.base_dir, "chunks", chunk_id[:2], f"{chunk_id}.txt")
+            chunk_counts[chunk_id] = len(encoding.encode(read_str(text_path), disallowed_special=()))
+        text_counts = {}
+        for course_summary in course_summaries:
+            rel_paths = [course_summary.summary_text_path, course_summary.toc_text_path]
+            rel_paths += [activity.summary_text_path for activity in course_summary.activities.values()]
+            for rel_path in rel_paths:
+                text_path = os.path.join(self.base_dir, course_summary.course_key, rel_path)
+                text_counts[f"{course_summary.course_key}/{rel_path}"] = len(encoding.encode(read_str(text_path), disallowed_special=()))
+        token_counts = {
+            "encoding": token_encoding,
+            "chunks": chunk_counts,
+            "texts": text_counts
+        }
+        with zstd.open(os.path.join(self.base_dir, TOKEN_COUNTS_PATH), 'wt', encoding='utf-8') as f:
+            f.write(json.dumps(token_counts, separators=(',', ':')))
+        return TOKEN_COUNTS_PATH
+
+    def write_lexical_index(self, chunk_dict: dict[str, dict]) -> dict:
+        """Write the BM25 index of all active chunks. Lesson and activity titles are indexed
+        with the chunk text, so chunks can be found by exact exercise names."""
+        chunks = {}
+        for emb_data in chunk_dict.values():
+            for chunk_id, metadata in zip(emb_data["ids"], emb_data["metadatas"]):
+                chunks.setdefault(chunk_id, metadata)
+        ids = sorted(chunks, key=lambda chunk_id: (chunks[chunk_id]["course_key"],
+                                                   chunks[chunk_id]["activity_key"], chunk_id))
+        metadatas = [chunks[chunk_id] for chunk_id in ids]
+        texts = []
+        for chunk_id, metadata in zip(ids, metadatas):
+            text_path = os.path.join(self.base_dir, "chunks", chunk_id[:2], f"{chunk_id}.txt")
+            texts.append("\n".join([metadata.get("lesson_title", ""), metadata.get("activity_title", ""),
+                                    read_str(text_path)]))
+        lexical_index = LexicalIndex.build(texts, ids, metadatas)
+        np.savez_compressed(os.path.join(self.base_dir, LEXICAL_INDEX_PATH),
+                            offsets=lexical_index.offsets, docs=lexical_index.docs,
+                            tfs=lexical_index.tfs, doc_lengths=lexical_index.doc_lengths)
+        metadata_table, metadata_rows = pack_metadatas(metadatas)
+        meta = {
+            "vocabulary": lexical_index.vocabulary,
+            "ids": ids,
+            "metadata_table": metadata_table,
+            "metadata_rows": metadata_rows
+        }
+        with zstd.open(os.path.join(self.base_dir, LEXICAL_INDEX_META_PATH), 'wt', encoding='utf-8') as f:
+            f.write(json.dumps(meta, separators=(',', ':')))
+        logger.info(f"Lexical index: {len(ids)} chunks, {len(lexical_index.vocabulary)} terms")
+        return {
+            "path": LEXICAL_INDEX_PATH,
+            "meta_path": LEXICAL_INDEX_META_PATH
+        }
+
+    def write_binary_embeddings(self, embedding_type: str, emb_data: dict, emb_dtype: str):
+        matrix = np.asarray(emb_data["embeddings"], dtype=emb_dtype)
+        np.save(os.path.join(self.base_dir, f"emb-{embedding_type}.npy"), matrix)
+        metadata_table, metadata_rows = pack_metadatas(emb_data["metadatas"])
+        meta = {
+            "ids": emb_data["ids"],
+            "metadata_table": metadata_table,
+            "metadata_rows": metadata_rows
+        }
+        meta_path = os.path.join(self.base_dir, f"emb-{embedding_type}-meta.json.zst")
+        with zstd.open(meta_path, 'wt', encoding='utf-8') as f:
+            f.write(json.dumps(meta, separators=(',', ':')))
+
+    def build_vector_index(self, embedding_type: str, emb_data: dict, version: str) -> str:
+        """Build a persistent Chroma index that the AI engine can open without re-indexing.
+
+        The index is rebuilt from scratch and tagged with `version` (the chunk set hash),
+        so the engine can detect a stale index and fall back to in-memory indexing."""
+        import chromadb
+        from chromadb.config import Settings
+
+        rel_path = vector_index_rel_path(embedding_type)
+        index_dir = os.path.join(self.base_dir, rel_path)
+        if os.path.exists(index_dir):
+            shutil.rmtree(index_dir)
+        os.makedirs(index_dir)
+        logger.info(f"Building vector index {rel_path}")
+        ch_cli = chromadb.PersistentClient(path=index_dir, settings=Settings(anonymized_telemetry=False))
+        collection = ch_cli.create_collection(
+            name=embedding_type,
+            metadata={"hnsw:space": "ip", "chunk_set_hash": version})
+        max_batch_size = ch_cli.get_max_batch_size()
+        total_size = len(emb_data["ids"])
+        for start_idx in range(0, total_size, max_batch_size):
+            end_idx = min(start_idx + max_batch_size, total_size)
+            collection.add(
+                embeddings=emb_data["embeddings"][start_idx:end_idx],
+                ids=emb_data["ids"][start_idx:end_idx],
+                metadatas=emb_data["metadatas"][start_idx:end_idx])
+        return rel_path
+
 
 class ContextDataset:
+    """AI context dataset, read from a local folder or an HTTP(S) URL.
+
+    If `cache_dir` is given, large files of a remote dataset are downloaded there
+    once, so they can be memory-mapped and shared between worker processes.
+
+    `version` is a hash of the index and the course summaries, which changes whenever
+    the dataset is rebuilt with different content."""
     fs: FileSet
+    cache_dir: str | None
     course_dict: dict[str, CourseSummary]
     loaded_index: dict
+    version: str
 
-    def __init__(self, base_url: str):
+    def __init__(self, base_url: str, cache_dir: str = None, chunk_cache_size: int = 2048):
         self.fs = FileSet.from_base_url(base_url)
+        self.cache_dir = cache_dir
         self.course_dict = {}
         self.loaded_index = self.fs.read_json("index.json")
+        version_hash = hashlib.sha256(json.dumps(self.loaded_index, sort_keys=True).encode("utf-8"))
         for course_key in self.loaded_index["courses"]:
             summary_str = self.fs.read_str(f"{course_key}/summary.json")
+            version_hash.update(summary_str.encode("utf-8"))
             course_summary = CourseSummary.model_validate_json(summary_str)
             self.course_dict[course_summary.course_key] = course_summary
+        self.version = version_hash.hexdigest()[:16]
+        self.chunk_cache = LruCache(chunk_cache_size)
+        self._load_chunk_pack()
+        self._load_token_counts()
+        self._load_lexical_index()
 
-    def get_embeddings_data(self, embedding_model, embedding_size) -> tuple[list[list[float]], list[str], list[dict]]:
+    def _load_token_counts(self) -> None:
+        self.token_counts: dict = {"encoding": None, "chunks": {}, "texts": {}}
+        token_counts_path = self.loaded_index.get("token_counts")
+        if token_counts_path is None:
+            return
+        b = self.fs.read_bytes(token_counts_path)
+        if b is None:
+            logger.warning(f"Token counts file {token_counts_path} not found")
+            return
+        with zstd.open(io.BytesIO(b), 'rt', encoding="utf-8") as f:
+            self.token_counts = json.load(f)
+
+    def _load_lexical_index(self) -> None:
+        self.lexical_index: LexicalIndex | None = None
+        lexical_index = self.loaded_index.get("lexical_index")
+        if lexical_index is None:
+            logger.debug("Lexical index not available")
+            return
+        b = self.fs.read_bytes(lexical_index["path"])
+        meta_b = self.fs.read_bytes(lexical_index["meta_path"])
+        if b is None or meta_b is None:
+            logger.warning(f"Lexical index {lexical_index['path']} not found")
+            return
+        with zstd.open(io.BytesIO(meta_b), 'rt', encoding="utf-8") as f:
+            meta = json.load(f)
+        arrays = np.load(io.BytesIO(b))
+        metadata_table = meta["metadata_table"]
+        self.lexical_index = LexicalIndex(
+            meta["vocabulary"], arrays["offsets"], arrays["docs"], arrays["tfs"], arrays["doc_lengths"],
+            meta["ids"], [metadata_table[idx] for idx in meta["metadata_rows"]])
+        logger.debug(f"Lexical index loaded, {len(meta['ids'])} chunks, {len(meta['vocabulary'])} terms")
+
+    def _load_chunk_pack(self) -> None:
+        self.chunk_pack_index: dict[str, list[int]] | None = None
+        self.chunk_pack_mmap: mmap.mmap | None = None
+        chunk_pack = self.loaded_index.get("chunk_pack")
+        if chunk_pack is None:
+            logger.debug("Chunk pack not available, reading chunk texts from separate files")
+            return
+        b = self.fs.read_bytes(chunk_pack["index_path"])
+        if b is None:
+            logger.warning(f"Chunk pack index {chunk_pack['index_path']} not found")
+            return
+        with zstd.open(io.BytesIO(b), 'rt', encoding="utf-8") as f:
+            self.chunk_pack_index = json.load(f)
+        local_path = self._local_file(chunk_pack["path"], chunk_pack["version"])
+        if local_path is not None:
+            with open(local_path, 'rb') as f:
+                self.chunk_pack_mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        logger.debug(f"Chunk pack loaded, {len(self.chunk_pack_index)} chunks, "
+                     f"{'memory-mapped' if self.chunk_pack_mmap is not None else 'ranged reads'}")
+
+    def get_embeddings_data(self, embedding_model, embedding_size, mmap: bool = False) -> tuple[np.ndarray | list[list[float]], list[str], list[dict]]:
+        """Embeddings, ids and metadata of all chunks, read from the binary format if
+        available and from the legacy JSON format otherwise.
+
+        With `mmap`, the binary embedding matrix is memory-mapped read-only if it is available
+        as a local file, so all processes on a node share one copy in the OS page cache."""
         embedding_type = f"{embedding_model}-{embedding_size}"
+        binary_data = self._read_binary_embeddings(embedding_type, mmap)
+        if binary_data is not None:
+            return binary_data
         emb_path = f"emb-{embedding_type}.json.zst"
         b = self.fs.read_bytes(emb_path)
         if b is None:
@@ -195,6 +494,71 @@ class ContextDataset:
         ids= emb_data["ids"]
         metadatas= emb_data["metadatas"]
         return embeddings, ids, metadatas
+
+    def _read_binary_embeddings(self, embedding_type: str, mmap: bool) -> tuple[np.ndarray, list[str], list[dict]] | None:
+        meta_b = self.fs.read_bytes(f"emb-{embedding_type}-meta.json.zst")
+        if meta_b is None:
+            return None
+        with zstd.open(io.BytesIO(meta_b), 'rt', encoding="utf-8") as f:
+            meta = json.load(f)
+        emb_path = f"emb-{embedding_type}.npy"
+        local_path = None
+        if mmap:
+            version = self.loaded_index.get("chunk_set_hashes", {}).get(embedding_type)
+            local_path = self._local_file(emb_path, version)
+        if local_path is not None:
+            logger.debug(f"Memory-mapping {local_path}")
+            embeddings = np.load(local_path, mmap_mode="r")
+        else:
+            b = self.fs.read_bytes(emb_path)
+            if b is None:
+                raise ValueError(f"Embedding file {emb_path} not found")
+            embeddings = np.load(io.BytesIO(b))
+        metadata_table = meta["metadata_table"]
+        metadatas = [metadata_table[idx] for idx in meta["metadata_rows"]]
+        return embeddings, meta["ids"], metadatas
+
+    def _local_file(self, path: str, version: str | None) -> str | None:
+        """Local path of a dataset file, downloading a remote file into `cache_dir` if needed.
+
+        Downloaded files are named by `version`, so a changed dataset is downloaded again.
+        The file is moved into place atomically, so concurrent workers never see a partial file."""
+        if isinstance(self.fs, LocalFileSet):
+            local_path = self.fs.local_path(path)
+            return local_path if os.path.isfile(local_path) else None
+        if self.cache_dir is None or version is None:
+            return None
+        name, ext = os.path.splitext(path)
+        cached_path = os.path.join(self.cache_dir, f"{name}-{version[:16]}{ext}")
+        if os.path.isfile(cached_path):
+            return cached_path
+        b = self.fs.read_bytes(path)
+        if b is None:
+            return None
+        os.makedirs(self.cache_dir, exist_ok=True)
+        tmp_path = f"{cached_path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(b)
+        os.replace(tmp_path, cached_path)
+        logger.info(f"Cached {path} as {cached_path}")
+        return cached_path
+
+    def get_chunk_set_hash(self, embedding_model, embedding_size) -> str | None:
+        embedding_type = f"{embedding_model}-{embedding_size}"
+        return self.loaded_index.get("chunk_set_hashes", {}).get(embedding_type)
+
+    def get_vector_index_dir(self, embedding_model, embedding_size) -> str | None:
+        """Local directory of the prebuilt vector index, or None if it is not available.
+
+        A prebuilt index can be opened only if the dataset is on the local filesystem."""
+        embedding_type = f"{embedding_model}-{embedding_size}"
+        rel_path = self.loaded_index.get("vector_indexes", {}).get(embedding_type)
+        if rel_path is None or not isinstance(self.fs, LocalFileSet):
+            return None
+        index_dir = self.fs.local_path(rel_path)
+        if not os.path.isdir(index_dir):
+            return None
+        return index_dir
     
     def get_summary_texts(self, course_key: str, activity_key:str) -> tuple[str,str]:
         course_summary = self.course_dict.get(course_key)
@@ -218,7 +582,78 @@ class ContextDataset:
         course_toc_txt = self.fs.read_str(course_toc_path)
         return course_toc_txt
 
+    def get_token_count_encoding(self) -> str | None:
+        """Name of the tiktoken encoding used for precomputed token counts."""
+        return self.token_counts["encoding"]
+
+    def get_chunk_token_count(self, chunk_hash: str) -> int | None:
+        return self.token_counts["chunks"].get(chunk_hash)
+
+    def get_summary_token_counts(self, course_key: str, activity_key: str) -> tuple[int | None, int | None]:
+        course_summary = self.course_dict.get(course_key)
+        if course_summary is None:
+            return None, None
+        activity_summary = course_summary.activities.get(activity_key)
+        if activity_summary is None:
+            return None, None
+        texts = self.token_counts["texts"]
+        return (texts.get(f"{course_key}/{course_summary.summary_text_path}"),
+                texts.get(f"{course_key}/{activity_summary.summary_text_path}"))
+
+    def get_toc_token_count(self, course_key: str) -> int | None:
+        course_summary = self.course_dict.get(course_key)
+        if course_summary is None:
+            return None
+        return self.token_counts["texts"].get(f"{course_key}/{course_summary.toc_text_path}")
+
     def get_chunk_text(self, chunk_hash: str) -> str:
+        return self.get_chunk_texts([chunk_hash])[0]
+
+    def get_chunk_texts(self, chunk_hashes: list[str]) -> list[str]:
+        """Texts of the given chunks, served from the LRU cache, the chunk pack, or
+        separate chunk files (in that order of preference).
+
+        Chunks missing in the cache are read from a remote pack with as few ranged
+        requests as possible, merging byte ranges that are close to each other."""
+        texts = {chunk_hash: self.chunk_cache.get(chunk_hash) for chunk_hash in chunk_hashes}
+        missing = [chunk_hash for chunk_hash, text in texts.items() if text is None]
+        if missing:
+            texts.update(self._read_chunk_texts(missing))
+            for chunk_hash in missing:
+                if texts[chunk_hash] is not None:
+                    self.chunk_cache.put(chunk_hash, texts[chunk_hash])
+        return [texts[chunk_hash] for chunk_hash in chunk_hashes]
+
+    def _read_chunk_texts(self, chunk_hashes: list[str]) -> dict[str, str]:
+        texts = {}
+        ranges = []
+        for chunk_hash in chunk_hashes:
+            chunk_range = self.chunk_pack_index.get(chunk_hash) if self.chunk_pack_index else None
+            if chunk_range is None:
+                texts[chunk_hash] = self._read_chunk_file(chunk_hash)
+            elif self.chunk_pack_mmap is not None:
+                offset, length = chunk_range
+                texts[chunk_hash] = self.chunk_pack_mmap[offset:offset + length].decode('utf-8')
+            else:
+                ranges.append((chunk_range[0], chunk_range[1], chunk_hash))
+        ranges.sort()
+        pack_path = self.loaded_index["chunk_pack"]["path"] if ranges else None
+        while ranges:
+            start = ranges[0][0]
+            end = start + ranges[0][1]
+            group = [ranges.pop(0)]
+            while ranges and ranges[0][0] - end <= CHUNK_RANGE_MAX_GAP:
+                end = max(end, ranges[0][0] + ranges[0][1])
+                group.append(ranges.pop(0))
+            b = self.fs.read_bytes_range(pack_path, start, end - start)
+            for offset, length, chunk_hash in group:
+                if b is None:
+                    texts[chunk_hash] = self._read_chunk_file(chunk_hash)
+                else:
+                    texts[chunk_hash] = b[offset - start:offset - start + length].decode('utf-8')
+        return texts
+
+    def _read_chunk_file(self, chunk_hash: str) -> str:
         hash_prefix = chunk_hash[:2]
         chunk_path = f'chunks/{hash_prefix}/{chunk_hash}.txt'
         chunk_str=self.fs.read_str(chunk_path)
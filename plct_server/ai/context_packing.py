@@ -0,0 +1,39 @@
+import numpy as np
+
+def mmr_order(embeddings: np.ndarray, relevance: np.ndarray, mmr_lambda: float,
+              max_similarity: float | None = None) -> list[int]:
+    """Candidates in the order of maximal marginal relevance.
+
+    Each next candidate maximizes `mmr_lambda * relevance - (1 - mmr_lambda) * similarity`,
+    where similarity is the highest inner product with an already selected candidate.
+    Candidates whose similarity to a selected candidate reaches `max_similarity` are
+    dropped as duplicates."""
+    n = len(relevance)
+    relevance = np.asarray(relevance, dtype=np.float32)
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    similarity = np.zeros(n, dtype=np.float32)
+    available = np.ones(n, dtype=bool)
+    order = []
+    while available.any():
+        scores = mmr_lambda * relevance - (1 - mmr_lambda) * similarity
+        scores[~available] = -np.inf
+        best = int(np.argmax(scores))
+        order.append(best)
+        available[best] = False
+        best_similarity = embeddings @ embeddings[best]
+        np.maximum(similarity, best_similarity, out=similarity)
+        if max_similarity is not None:
+            available &= best_similarity < max_similarity
+    return order
+
+def pack(token_counts: list[int], budget: int, separator_tokens: int = 0) -> list[int]:
+    """Indices of the chunks, taken greedily in the given order, that fit into `budget` tokens.
+    Chunks are joined by a separator of `separator_tokens` tokens."""
+    packed = []
+    used = 0
+    for i, tokens in enumerate(token_counts):
+        cost = tokens + (separator_tokens if packed else 0)
+        if used + cost <= budget:
+            packed.append(i)
+            used += cost
+    return packed
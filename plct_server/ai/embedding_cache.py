@@ -0,0 +1,127 @@
+import asyncio
+import hashlib
+import logging
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+
+import numpy as np
+
+from .cache import LruCache
+
+logger = logging.getLogger(__name__)
+
+class EmbeddingCache:
+    """Query embeddings keyed by (model, dimensions, normalized text).
+
+    The first tier is an in-memory LRU cache. The optional second tier is a SQLite
+    database, which survives restarts and is shared by all worker processes that
+    use the same file. The disk tier keeps at most `disk_size` embeddings, the
+    oldest ones are deleted first. It is read and written in worker threads, so a
+    slow or locked database doesn't block the event loop."""
+
+    PRUNE_INTERVAL = 256  # number of writes between checks of the disk tier size
+
+    def __init__(self, maxsize: int, db_path: str | None = None, disk_size: int = 100_000):
+        self._memory: LruCache[tuple[str, int, str], list[float]] = LruCache(maxsize)
+        self.disk_size = disk_size
+        self.disk_hits = 0
+        self.miss_seconds = 0.0  # total time spent creating embeddings that were not cached
+        self._writes = 0
+        self._db = None
+        self._db_lock = threading.Lock()
+        if db_path:
+            self._db = self._open_db(db_path)
+
+    @staticmethod
+    def _open_db(db_path: str) -> sqlite3.Connection:
+        db = sqlite3.connect(db_path, check_same_thread=False, timeout=5.0)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")
+        db.execute("""CREATE TABLE IF NOT EXISTS embeddings (
+                          key TEXT PRIMARY KEY, embedding BLOB NOT NULL, created REAL NOT NULL)""")
+        db.execute("CREATE INDEX IF NOT EXISTS embeddings_created ON embeddings (created)")
+        db.commit()
+        logger.info(f"Opened embedding cache database {db_path}")
+        return db
+
+    @staticmethod
+    def normalize(text: str) -> str:
+        return re.sub(r"\s+", " ", unicodedata.normalize("NFC", text)).strip()
+
+    @staticmethod
+    def _db_key(key: tuple[str, int, str]) -> str:
+        model, dimensions, text = key
+        return hashlib.sha256(f"{model}\x00{dimensions}\x00{text}".encode("utf-8")).hexdigest()
+
+    async def get(self, model: str, dimensions: int, text: str) -> list[float] | None:
+        key = (model, dimensions, self.normalize(text))
+        embedding = self._memory.get(key)
+        if embedding is not None or self._db is None:
+            return embedding
+        try:
+            row = await asyncio.to_thread(self._read_db, key)
+        except sqlite3.Error as e:
+            logger.warning(f"Embedding cache database read failed: {e}")
+            return None
+        if row is None:
+            return None
+        embedding = np.frombuffer(row[0], dtype=np.float32).tolist()
+        self.disk_hits += 1
+        self._memory.put(key, embedding)
+        return embedding
+
+    async def put(self, model: str, dimensions: int, text: str, embedding: list[float],
+                  elapsed: float = 0.0) -> None:
+        """Store an embedding that was just created; `elapsed` is the time it took."""
+        key = (model, dimensions, self.normalize(text))
+        self.miss_seconds += elapsed
+        self._memory.put(key, embedding)
+        if self._db is None:
+            return
+        try:
+            await asyncio.to_thread(self._write_db, key, np.asarray(embedding, dtype=np.float32).tobytes())
+        except sqlite3.Error as e:
+            logger.warning(f"Embedding cache database write failed: {e}")
+
+    def _read_db(self, key: tuple[str, int, str]) -> tuple | None:
+        with self._db_lock:
+            if self._db is None:
+                return None
+            return self._db.execute("SELECT embedding FROM embeddings WHERE key = ?",
+                                    (self._db_key(key),)).fetchone()
+
+    def _write_db(self, key: tuple[str, int, str], embedding: bytes) -> None:
+        with self._db_lock:
+            if self._db is None:
+                return
+            self._db.execute("INSERT OR REPLACE INTO embeddings (key, embedding, created) VALUES (?, ?, ?)",
+                             (self._db_key(key), embedding, time.time()))
+            self._writes += 1
+            if self._writes % self.PRUNE_INTERVAL == 0:
+                self._prune()
+            self._db.commit()
+
+    def _prune(self) -> None:
+        self._db.execute("""DELETE FROM embeddings WHERE key IN (
+                                SELECT key FROM embeddings ORDER BY created DESC LIMIT -1 OFFSET ?)""",
+                         (self.disk_size,))
+
+    def stats(self) -> dict[str, int | float]:
+        misses = self._memory.misses - self.disk_hits
+        return {
+            "memory_hits": self._memory.hits,
+            "disk_hits": self.disk_hits,
+            "misses": misses,
+            "size": len(self._memory),
+            # estimate of the time saved, assuming hits would take as long as misses on average
+            "saved_seconds": (self._memory.hits + self.disk_hits) * self.miss_seconds / misses if misses else 0.0,
+        }
+
+    def close(self) -> None:
+        if self._db is not None:
+            with self._db_lock:
+                self._db.close()
+            self._db = None
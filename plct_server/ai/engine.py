@@ -1,31 +1,47 @@
+import asyncio
+import difflib
 import logging
-import chromadb
-import tiktoken
-from chromadb.config import Settings
+import math
+import re
+import time
 
-from tiktoken import Encoding
-from typing import Any, AsyncIterator, Coroutine, Union
-from openai import AsyncAzureOpenAI, AsyncOpenAI
+from typing import Any, AsyncIterator, Awaitable, Callable, Coroutine, TypeVar, Union
+from openai import APIConnectionError, AsyncAzureOpenAI, AsyncOpenAI, InternalServerError, OpenAIError
 from openai.types.chat import ChatCompletion
+import numpy as np
 
 from plct_server.ai.client import AiClientFactory
 
 from .model_conf import ModelConfig, ModelProvider, MODEL_CONFIGS_LIST
 from .context_dataset import ContextDataset
-from .query_context import QueryContext, QueryError
+from .admission import AdmissionController, AdmittedStream, ClosingStream
+from .answer_cache import AnswerCache, CachedAnswer
+from .context_packing import mmr_order, pack
+from .embedding_cache import EmbeddingCache
+from .engine_options import AiEngineOptions
+from .prompt_cache import PromptSegment, PromptSegmentCache
+from .single_flight import SharedStream, SingleFlight, wait_shared
+from .tokenizer_registry import Tokenizer, TokenizerRegistry
+from .lexical_index import LexicalIndex
+from .vector_store import VectorMatch, VectorStore, fuse_matches
+from .query_context import QueryContext, QueryError, QueryTooLargeError, timed_call, timed_stage
+from ..metrics import TIME_TO_FIRST_TOKEN_SECONDS, TOKENS
 from .structured_outputs.query_classification import TOOLS_CHOICE_DEF, TOOLS_DEF, Classification, QueryLanguage, StructuredOutputResponse, get_answer_language, parse_query_classification
 
 from .prompt_templates import *
 
 logger = logging.getLogger(__name__)
 
+T = TypeVar("T")
+
 ai_engine: "AiEngine" = None
 
-def init(*, ai_ctx_url: str, client_factory: AiClientFactory) -> None:
+def init(*, ai_ctx_url: str, client_factory: AiClientFactory, options: AiEngineOptions = None) -> None:
     global ai_engine
     if ai_engine is None:
         ai_engine = AiEngine(ai_ctx_url=ai_ctx_url, 
-                             client_factory=client_factory)
+                             client_factory=client_factory,
+                             options=options)
     else:
         raise ValueError(f"{__name__} already initialized")
     
@@ -36,6 +52,10 @@ def get_ai_engine() -> "AiEngine":
         raise ValueError(f"{__name__} not initialized, call {__name__}.init first")
     return ai_engine
 
+async def shutdown() -> None:
+    if ai_engine is not None:
+        await ai_engine.aclose()
+
 def create_message(system : str, history: list[dict[str, str]], query) -> list[dict[str, str]]:
     messages = [{"role": "system", "content": system}]
     for item in history:
@@ -47,8 +67,27 @@ def create_message(system : str, history: list[dict[str, str]], query) -> list[d
 CHAT_MODEL = "gpt-4o-mini"
 EMBEDDING_MODEL = "text-embedding-3-large"
 EMBEDDING_SIZE = 1536
-CDB_COLLECTION_NAME = f"{EMBEDDING_MODEL}-{EMBEDDING_SIZE}"
+ANSWER_MAX_TOKENS = 2000
 PETLJA_DOCS_COURSE_KEY = "petlja-docs"
+CONDENSED_HISTORY_PLACEHOLDER = "\x00condensed_history\x00"
+
+
+SUMMARY_SEGMENT_TEMPLATES: dict[Classification, str] = {
+    Classification.COURSE: "summary_course",
+    Classification.CURRENT_LECTURE: "summary_lesson",
+    Classification.PLATFORM: "summary_platform",
+    Classification.UNSURE: "summary_unsure",
+}
+PROMPT_SEGMENT_TEMPLATE_FIELDS: dict[str, tuple[str, list[str]]] = {
+    "preprocess": (preprocess_system_message_template, ["course_summary", "lesson_summary"]),
+    "preprocess_with_history": (preprocess_system_message_template_with_history,
+                                ["course_summary", "lesson_summary", "condensed_history"]),
+    "summary_course": (system_message_summary_template_course, ["course_summary", "toc"]),
+    "summary_lesson": (system_message_summary_template_lesson, ["lesson_summary"]),
+    "summary_platform": (system_message_summary_template_platform, []),
+    "summary_unsure": (system_message_summary_template_unsure, ["course_summary", "lesson_summary"]),
+}
+PROMPT_SEGMENT_TEMPLATES = list(PROMPT_SEGMENT_TEMPLATE_FIELDS)
 
 
 class AiEngine:
@@ -56,14 +95,39 @@ class AiEngine:
 
     _model_config_dict: dict[str, ModelConfig] = dict()
     
-    def __init__(self, *, ai_ctx_url: str, client_factory: AiClientFactory):
+    def __init__(self, *, ai_ctx_url: str, client_factory: AiClientFactory, options: AiEngineOptions = None):
         logger.debug(f"ai_ctx_url: {ai_ctx_url}")
         self.client_factory = client_factory
-        self.ctx_data = ContextDataset(ai_ctx_url)
-        self.ch_cli = chromadb.Client(Settings(anonymized_telemetry=False))
-        self.encoding : Encoding = tiktoken.encoding_for_model(EMBEDDING_MODEL) 
+        self.options = options or AiEngineOptions()
+        self.ai_ctx_url = ai_ctx_url
+        self.tokenizers = TokenizerRegistry(self.options.tokenizer_cache_dir)
+        self.prompt_cache = PromptSegmentCache(self.options.prompt_cache_size)
+        self.embedding_cache = EmbeddingCache(self.options.embedding_cache_size,
+                                              db_path=self.options.embedding_cache_path,
+                                              disk_size=self.options.embedding_cache_disk_size)
+        self.admission = AdmissionController(self.options.admission_max_waiting, self.options.admission_timeout,
+                                             self.options.provider_max_concurrency)
+        self._single_flight = SingleFlight()
+        self._answer_flights: dict[tuple, asyncio.Future] = {}
+        self._answer_flight_waiters: dict[asyncio.Future, int] = {}
+        self.answer_cache = AnswerCache(self.options.answer_cache_size, self.options.answer_cache_ttl,
+                                        self.options.answer_cache_min_similarity)
+        self._template_tokens_cache: dict[tuple, int] = {}
         self._load_model_configs()
+        self.tokenizers.preload(self._model_config_dict.values())
+        self._load_context_dataset()
+
+    def _load_context_dataset(self):
+        self.ctx_data = ContextDataset(self.ai_ctx_url, cache_dir=self.options.ai_ctx_cache_dir,
+                                       chunk_cache_size=self.options.chunk_cache_size)
         self._load_embeddings()
+        logger.debug(f"Precomputed token counts encoding: {self.ctx_data.get_token_count_encoding()}")
+        if self.options.prewarm_prompt_cache:
+            self._prewarm_prompt_cache()
+
+    async def aclose(self):
+        await self.client_factory.aclose()
+        self.embedding_cache.close()
 
     def add_model_config(self, model_config: ModelConfig) -> None:
         if model_config.display_name is None:
@@ -71,6 +135,12 @@ class AiEngine:
         self._model_config_dict[model_config.name] = model_config
         model_config.order = len(self._model_config_dict)
 
+    def get_cache_stats(self) -> dict[str, dict]:
+        return {"embedding": self.embedding_cache.stats(), "answer": self.answer_cache.stats(),
+                "prompt": self.prompt_cache.stats(), "chunk": self.ctx_data.chunk_cache.stats(),
+                "coalescing": {"coalesced": self._single_flight.coalesced},
+                "admission": self.admission.stats()}
+
     def get_chat_models(self) -> list[ModelConfig]:
         chat_models = [m for m in self._model_config_dict.values() if m.type == "chat"]
         chat_models.sort(key=lambda m: m.order)
@@ -94,7 +164,8 @@ class AiEngine:
                 name=model_name,
                 provider=ModelProvider.VLLM,
                 type="chat",
-                context_size=context_size
+                context_size=context_size,
+                tokenizer=f"hf:{model_name}"
             ))
             logger.info(f"Auto-added vLLM model '{model_name}' (context_size={context_size})")
 
@@ -107,31 +178,9 @@ class AiEngine:
 
 
     def _load_embeddings(self):
-        collection = self.ch_cli.create_collection(
-            name=f"{CDB_COLLECTION_NAME}",
-            metadata={"hnsw:space": "ip"})
-
-        logger.debug(f"Loading embeddings {EMBEDDING_MODEL}-{EMBEDDING_SIZE}")
-        embeddings, ids, metadata = self.ctx_data.get_embeddings_data(EMBEDDING_MODEL, EMBEDDING_SIZE)
-
-        max_batch_size = self.ch_cli.get_max_batch_size()
-        total_size = len(embeddings)
-        logger.debug(f"Indexing embeddings {EMBEDDING_MODEL}-{EMBEDDING_SIZE} in batches of {max_batch_size}")
-        for start_idx in range(0, total_size, max_batch_size):
-            end_idx = min(start_idx + max_batch_size, total_size)
-            
-            batch_embeddings = embeddings[start_idx:end_idx]
-            batch_ids = ids[start_idx:end_idx]
-            batch_metadata = metadata[start_idx:end_idx]
-            
-            logger.debug(f"Finished loading embeddings in batch ({start_idx}-{end_idx})")
-            collection.add(
-                embeddings=batch_embeddings,
-                ids=batch_ids,
-                metadatas=batch_metadata
-            )
-
-        logger.debug(f"Embeddings loaded and indexed {EMBEDDING_MODEL}-{EMBEDDING_SIZE}")
+        logger.debug(f"Loading embeddings {EMBEDDING_MODEL}-{EMBEDDING_SIZE} into {self.options.vector_store} vector store")
+        self.vector_store = VectorStore.create(
+            self.options.vector_store, self.ctx_data, EMBEDDING_MODEL, EMBEDDING_SIZE)
     
     def _get_async_openai_client(self, requested_model: str | None) -> Union[AsyncOpenAI, AsyncAzureOpenAI]:
         logger.debug(f"Creating AI client")
@@ -139,22 +188,20 @@ class AiEngine:
         return self.client_factory.get_client(model_config)
 
     async def _handle_query_submission(self, message: list[dict[str, str]], max_tokens: int, stream : bool,
-                                        model_name : str = None) -> Union[str, Coroutine[Any, Any, ChatCompletion]]:
+                                        model_name : str = None, message_tokens: int = None) -> Union[str, Coroutine[Any, Any, ChatCompletion]]:
+        """Submit the message to the chat model. `message_tokens` may be given if it is
+        already known (e.g. assembled from precomputed token counts); otherwise the message is tokenized."""
         model = model_name or CHAT_MODEL
         client = self._get_async_openai_client(
             requested_model = model
         )
         config = self.get_model_config(model)
 
-        def encode_message_content(message: list[dict[str, str]]) -> int:
-            total_length = 0
-            for msg in message:
-                total_length += len(self.encoding.encode(msg["content"]))
-            return total_length
-        
         token_limit = config.context_size
 
-        message_tokens = encode_message_content(message)
+        if message_tokens is None:
+            message_tokens = await self._count_tokens_async(
+                [msg["content"] for msg in message], self.tokenizers.get(config))
         if message_tokens > token_limit - max_tokens:
             raise QueryError((
                 f"Context too large for model. Tokens used: {message_tokens}",
@@ -164,41 +211,196 @@ class AiEngine:
         else:
             logger.info(f"Tokens used in message: {message_tokens}")
 
-        completion = await client.chat.completions.create(
-            model=config.name,
-            messages=message,
-            stream=stream,
-            max_completion_tokens=max_tokens,
-            temperature=0,
-            extra_body= config.extra_body
-        )
+        # a streamed completion holds its admission until the stream is consumed
+        release = await self._admit(config, message_tokens + max_tokens)
+        try:
+            completion = await client.chat.completions.create(
+                model=config.name,
+                messages=message,
+                stream=stream,
+                max_completion_tokens=max_tokens,
+                temperature=0,
+                extra_body= config.extra_body
+            )
+        except BaseException:
+            release()
+            raise
 
+        TOKENS.inc(message_tokens, model=config.name, direction="in")
         if stream:
-            return completion
+            return AdmittedStream(completion, release)
         else:
-            return completion.choices[0].message.content
+            release()
+            content = completion.choices[0].message.content
+            if completion.usage is not None:
+                TOKENS.inc(completion.usage.completion_tokens, model=config.name, direction="out")
+            return content
+
+    async def _admit(self, config: ModelConfig, tokens: int) -> Callable[[], None]:
+        """Wait until a request to the model is admitted, see `AdmissionController`."""
+        provider = config.provider or self.client_factory.default_provider
+        return await self.admission.acquire(provider.value, config.name, config.max_concurrency,
+                                            config.tokens_per_minute, tokens)
+
+    def _model_chain(self, model_name: str | None) -> list[str]:
+        """The model followed by its configured fallback models that are available."""
+        model = model_name or CHAT_MODEL
+        return [model] + [fallback for fallback in self.options.model_fallbacks.get(model, [])
+                          if fallback in self._model_config_dict]
+
+    async def _with_fallback(self, model_name: str | None, call: Callable[[str], Awaitable[T]]) -> T:
+        """Call `call` with the model, and with the next fallback model whenever the call fails."""
+        chain = self._model_chain(model_name)
+        for i, model in enumerate(chain):
+            try:
+                return await call(model)
+            except (QueryError, OpenAIError) as e:
+                if i == len(chain) - 1:
+                    raise
+                logger.warning(f"Request to model '{model}' failed, falling back to '{chain[i + 1]}': {e}")
+
+    async def _open_answer_stream(self, messages: list[dict[str, str]], max_tokens: int, model_name: str,
+                                  message_tokens: int | None) -> tuple[str, AsyncIterator[str]]:
+        """Submit the messages and wait for the first content chunk of the answer.
+        Returns the first chunk and the iterator of the remaining chunks."""
+        response = await self._handle_query_submission(
+            message=messages,
+            max_tokens=max_tokens,
+            stream=True,
+            model_name=model_name,
+            message_tokens=message_tokens)
+
+        async def content_chunks():
+            try:
+                async for chunk in response:
+                    if len(chunk.choices) > 0:
+                        delta = chunk.choices[0].delta
+                        if delta.content:
+                            yield delta.content
+            finally:
+                await response.close()
+
+        chunks = content_chunks()
+        try:
+            first_chunk = await anext(chunks, "")
+        except BaseException:
+            await chunks.aclose()
+            raise
+        return first_chunk, chunks
+
+    async def _stream_answer(self, messages: list[dict[str, str]], max_tokens: int, model_name: str | None,
+                             message_tokens: int) -> tuple[str, str, AsyncIterator[str]]:
+        """Open the answer stream with the first model of the fallback chain that answers.
+
+        A failed model is replaced by the next one. With `hedge_first_token_timeout`, the
+        next model is also started when the first token doesn't arrive in time; the stream
+        that delivers its first token first wins and the others are cancelled.
+        Returns the model that answers, the first chunk and the remaining chunks."""
+        chain = self._model_chain(model_name)
+        tokenizer_name = self._get_tokenizer(chain[0]).name
+        hedge_timeout = self.options.hedge_first_token_timeout
+        attempts: dict[asyncio.Task, str] = {}
+        started = 0
+
+        def start_next() -> None:
+            nonlocal started
+            model = chain[started]
+            started += 1
+            # the message is recounted for a model with another tokenizer
+            tokens = message_tokens if self._get_tokenizer(model).name == tokenizer_name else None
+            attempts[asyncio.create_task(self._open_answer_stream(messages, max_tokens, model, tokens))] = model
+
+        start_next()
+        winner = None
+        try:
+            while attempts and winner is None:
+                can_hedge = hedge_timeout is not None and started < len(chain)
+                done, _ = await asyncio.wait(attempts, timeout=hedge_timeout if can_hedge else None,
+                                             return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    logger.info(f"No first token from '{attempts[next(iter(attempts))]}' in {hedge_timeout}s, "
+                                f"hedging with '{chain[started]}'")
+                    start_next()
+                    continue
+                for task in done:
+                    model = attempts.pop(task)
+                    if task.exception() is None and winner is None:
+                        winner = (model, *task.result())
+                    elif task.exception() is None:
+                        await task.result()[1].aclose()
+                    else:
+                        error = task.exception()
+                        logger.warning(f"Answer stream of model '{model}' failed: {error}")
+                        if not attempts and started == len(chain):
+                            raise error
+                        if started < len(chain):
+                            start_next()
+        finally:
+            for task in attempts:
+                task.cancel()
+            if attempts:
+                await asyncio.gather(*attempts, return_exceptions=True)
+                for task in attempts:
+                    if not task.cancelled() and task.exception() is None:
+                        await task.result()[1].aclose()
+        if winner[0] != chain[0]:
+            logger.info(f"Answer streamed by fallback model '{winner[0]}'")
+        return winner
         
 
     async def _create_embedding(self, input: str, encoding_format: str, dimensions: int) -> str:
+        embedding = await self.embedding_cache.get(EMBEDDING_MODEL, dimensions, input)
+        if embedding is not None:
+            logger.debug("Query embedding found in cache")
+            return embedding
+        if self.options.coalesce_requests:
+            return await self._single_flight.do(
+                ("embedding", dimensions, EmbeddingCache.normalize(input)),
+                lambda: self._request_embedding(input, encoding_format, dimensions))
+        return await self._request_embedding(input, encoding_format, dimensions)
+
+    async def _request_embedding(self, input: str, encoding_format: str, dimensions: int) -> list[float]:
         client = self._get_async_openai_client(
             requested_model= EMBEDDING_MODEL
         )
         config = self.get_model_config(EMBEDDING_MODEL)
         token_limit = config.context_size
 
-        if len(self.encoding.encode(input)) > token_limit:
+        input_tokens = await self._count_tokens_async([input], self.tokenizers.get(config))
+        if input_tokens > token_limit:
             raise QueryError((
-                f"Embedding input too large for model. Tokens used: {len(self.encoding.encode(input))}",
+                f"Embedding input too large for model. Tokens used: {input_tokens}",
                 f"Model token limit: {token_limit}"))
     
-        response = await client.embeddings.create(
-            model=config.name,
-            input=input,
-            encoding_format=encoding_format,
-            dimensions=dimensions
-        )
-        return response.data[0].embedding
+        release = await self._admit(config, input_tokens)
+        try:
+            start = time.perf_counter()
+            response = await client.embeddings.create(
+                model=config.name,
+                input=input,
+                encoding_format=encoding_format,
+                dimensions=dimensions
+            )
+        finally:
+            release()
+        embedding = response.data[0].embedding
+        await self.embedding_cache.put(EMBEDDING_MODEL, dimensions, input, embedding,
+                                       elapsed=time.perf_counter() - start)
+        return embedding
     
+    def _should_reembed(self, query: str, restated_question: str) -> bool:
+        """Whether the restated question differs materially from the query that was embedded."""
+        if not restated_question or self.options.reembed_policy == "never":
+            return False
+        if self.options.reembed_policy != "if_different":
+            raise ValueError(f"Unsupported reembed policy: {self.options.reembed_policy}")
+
+        def normalize(text: str) -> str:
+            return re.sub(r"\s+", " ", text).strip().lower()
+
+        similarity = difflib.SequenceMatcher(None, normalize(query), normalize(restated_question)).ratio()
+        return similarity < self.options.reembed_min_similarity
+
     def _generate_chroma_filter(self, structured_output: StructuredOutputResponse, course_key: str, activity_key: str) -> tuple[Classification, dict[str, str], int]:
         if structured_output.classification == Classification.COURSE:
             where = {"course_key": course_key}
@@ -214,33 +416,126 @@ class AiEngine:
             n_results = 0
         return where, n_results
         
-    def _get_rag_segment(self, structured_output: StructuredOutputResponse, query_embedding: str,
-                          course_key: str, activity_key: str) -> tuple[str, list[dict[str, str]]]:
+    def _get_lexical_index(self) -> LexicalIndex | None:
+        """Lexical index used for retrieval, None if retrieval is vector only."""
+        if self.options.retrieval == "vector":
+            return None
+        return self.ctx_data.lexical_index
+
+    async def _embed_query(self, text: str, stage: str, query_context: QueryContext = None) -> list[float] | None:
+        """Embedding of the query, or None if chunks are retrieved by the lexical index only.
+
+        In hybrid retrieval, a query embedding that takes longer than `embedding_timeout`
+        or fails transiently (connection or server error) is also None, so chunks are
+        retrieved lexically. Other errors, such as authentication errors, are raised."""
+        lexical_index = self._get_lexical_index()
+        if self.options.retrieval == "lexical" and lexical_index is not None:
+            return None
+        embedding = timed_call(stage, self._create_embedding(
+            input=text,
+            encoding_format="float",
+            dimensions=EMBEDDING_SIZE
+        ), query_context)
+        if lexical_index is None:
+            return await embedding
+        try:
+            return await asyncio.wait_for(embedding, self.options.embedding_timeout)
+        except (asyncio.TimeoutError, APIConnectionError, InternalServerError) as e:
+            logger.warning(f"Query embedding failed ({type(e).__name__}), retrieving chunks lexically")
+            return None
+
+    def _retrieve(self, query_embedding: list[float] | None, query_text: str, where: dict, n_results: int,
+                  query_context: QueryContext = None) -> list[VectorMatch]:
+        """Chunks retrieved by the vector store, the lexical index or both (fused by rank)."""
+        lexical_index = self._get_lexical_index()
+        if lexical_index is None:
+            if query_embedding is None:
+                raise QueryError("Query embedding is not available")
+            with timed_stage("vector_query", query_context):
+                return self.vector_store.query(query_embedding=query_embedding, where=where, n_results=n_results)
+
+        n_candidates = n_results * self.options.hybrid_candidates if query_embedding is not None else n_results
+        vector_matches = []
+        if query_embedding is not None:
+            with timed_stage("vector_query", query_context):
+                vector_matches = self.vector_store.query(
+                    query_embedding=query_embedding, where=where, n_results=n_candidates)
+        with timed_stage("lexical_query", query_context):
+            lexical_matches = lexical_index.query(query_text, where, n_candidates)
+        return fuse_matches(vector_matches, lexical_matches, n_results, self.options.rrf_k)
+
+    def _context_budget(self, model_name: str | None) -> int:
+        """Prompt tokens available when packing chunks, for the model and its fallback models."""
+        context_size = min(self.get_model_config(model).context_size for model in self._model_chain(model_name))
+        return int(context_size * self.options.context_budget_fraction) - ANSWER_MAX_TOKENS
+
+    async def _pack_chunks(self, matches: list[VectorMatch], query_embedding: list[float] | None, token_budget: int,
+                     tokenizer: Tokenizer, query_context: QueryContext = None) -> list[VectorMatch]:
+        """Candidate chunks that fit into a RAG segment of `token_budget` tokens.
+
+        Candidates are ordered by maximal marginal relevance, so that near-duplicates
+        don't take up the budget, and packed greedily."""
+        if self.options.context_max_distance is not None:
+            # chunks found only by lexical retrieval have no distance and are kept
+            matches = [match for match in matches if not match.distance > self.options.context_max_distance]
+        if not matches:
+            return []
+        if self.options.context_mmr_lambda < 1 or self.options.context_max_similarity is not None:
+            embeddings = self.vector_store.get_embeddings([match.id for match in matches])
+            if query_embedding is not None and self._get_lexical_index() is None:
+                relevance = embeddings @ np.asarray(query_embedding, dtype=np.float32)
+            else:
+                # fused or lexical matches are relevant in the order of their rank
+                relevance = 1 - np.arange(len(matches), dtype=np.float32) / len(matches)
+            order = mmr_order(embeddings, relevance, self.options.context_mmr_lambda,
+                              self.options.context_max_similarity)
+            matches = [matches[i] for i in order]
+
+        chunk_tokens = [self.ctx_data.get_chunk_token_count(match.id) for match in matches]
+        if not self._uses_dataset_token_counts(tokenizer) or None in chunk_tokens:
+            with timed_stage("chunk_fetch", query_context):
+                chunk_strs = await self._get_chunk_texts([match.id for match in matches])
+            chunk_tokens = [tokenizer.count(chunk_str) for chunk_str in chunk_strs]
+        budget = token_budget - self._template_tokens(tokenizer, system_message_rag_template, ["chunks"])
+        packed = pack(chunk_tokens, budget, self._template_tokens(tokenizer, '\n\n'))
+        if len(packed) < len(matches):
+            logger.debug(f"Packed {len(packed)} of {len(matches)} chunks into {token_budget} tokens")
+        return [matches[i] for i in packed]
+
+    async def _get_chunk_texts(self, chunk_ids: list[str]) -> list[str]:
+        """Chunk texts, read in a worker thread, since reading from a remote dataset
+        makes blocking HTTP requests."""
+        return await asyncio.to_thread(self.ctx_data.get_chunk_texts, chunk_ids)
+
+    async def _get_rag_segment(self, structured_output: StructuredOutputResponse, query_embedding: list[float] | None,
+                          course_key: str, activity_key: str, tokenizer: Tokenizer,
+                          query_context: QueryContext = None, query_text: str = "",
+                          token_budget: int | None = None) -> tuple[PromptSegment, list[dict[str, str]]]:
+        """RAG segment with the chunks retrieved for the query. With `token_budget`, chunks are
+        packed into the budget from `context_candidates` candidates instead of using a fixed number."""
         
         if structured_output.classification == Classification.UNSURE:
-            return "", []
+            return PromptSegment("", 0), []
         
-        collection = self.ch_cli.get_collection(CDB_COLLECTION_NAME)
         where, n_results = self._generate_chroma_filter(structured_output, course_key, activity_key)
+        if token_budget is not None:
+            n_results = self.options.context_candidates
 
-        result = collection.query(
-            query_embeddings=[query_embedding],
-            where=where,
-            n_results=n_results
-        )
-
+        matches = self._retrieve(query_embedding, query_text, where, n_results, query_context)
+        if token_budget is not None:
+            with timed_stage("context_packing", query_context):
+                matches = await self._pack_chunks(matches, query_embedding, token_budget, tokenizer, query_context)
 
-        chunk_strs : list[str, str] = []
         chunk_metadata : list[dict[str, str]] = []
-        chunk_hash : str
-        dist : float
-        metadata : dict[str, str]
 
-        for chunk_hash, dist, metadata in zip(result["ids"][0], result["distances"][0], result["metadatas"][0]):
-            metadata["distance"] = str(dist)
+        for match in matches:
+            metadata = match.metadata
+            if not math.isnan(match.distance):
+                metadata["distance"] = str(match.distance)
+            metadata["chunk_id"] = match.id
             chunk_metadata.append(metadata)
-            chunk_str = self.ctx_data.get_chunk_text(chunk_hash)
-            chunk_strs.append(chunk_str)
+        with timed_stage("chunk_fetch", query_context):
+            chunk_strs = await self._get_chunk_texts([match.id for match in matches])
 
 
         logger.debug(f"chunk_metadata: {chunk_metadata}")
@@ -249,55 +544,193 @@ class AiEngine:
             chunks='\n\n'.join(chunk_strs)
         )
 
-        return rag_segment, chunk_metadata
+        chunk_tokens = [self.ctx_data.get_chunk_token_count(match.id) for match in matches]
+        if self._uses_dataset_token_counts(tokenizer) and None not in chunk_tokens:
+            separator_tokens = self._template_tokens(tokenizer, '\n\n') * max(len(chunk_tokens) - 1, 0)
+            rag_tokens = (self._template_tokens(tokenizer, system_message_rag_template, ["chunks"])
+                          + sum(chunk_tokens) + separator_tokens)
+        else:
+            rag_tokens = self._count_tokens([rag_segment], tokenizer)
+
+        return PromptSegment(rag_segment, rag_tokens), chunk_metadata
+
+    def _get_prompt_segment(self, template: str, course_key: str, activity_key: str,
+                            tokenizer: Tokenizer) -> PromptSegment:
+        """Rendered prompt segment that depends only on the course and the activity."""
+        def render() -> tuple[str, int | None]:
+            template_str, field_names = PROMPT_SEGMENT_TEMPLATE_FIELDS[template]
+            course_summary, lesson_summary = self.ctx_data.get_summary_texts(course_key, activity_key)
+            course_summary_tokens, lesson_summary_tokens = self.ctx_data.get_summary_token_counts(
+                course_key, activity_key)
+            fields = {
+                "course_summary": (course_summary, course_summary_tokens),
+                "lesson_summary": (lesson_summary, lesson_summary_tokens),
+                "condensed_history": (CONDENSED_HISTORY_PLACEHOLDER, None)
+            }
+            if "toc" in field_names:
+                fields["toc"] = (self.ctx_data.get_toc_text(course_key),
+                                 self.ctx_data.get_toc_token_count(course_key))
+            text = template_str.format(**{name: fields[name][0] for name in field_names})
+            field_tokens = [fields[name][1] for name in field_names]
+            if not self._uses_dataset_token_counts(tokenizer) or None in field_tokens:
+                return text, None
+            return text, self._template_tokens(tokenizer, template_str, field_names) + sum(field_tokens)
+
+        return self.prompt_cache.get(course_key, activity_key, template, render, tokenizer)
+
+    def _get_tokenizer(self, model_name: str = None) -> Tokenizer:
+        return self.tokenizers.get(self.get_model_config(model_name or CHAT_MODEL))
+
+    def _uses_dataset_token_counts(self, tokenizer: Tokenizer) -> bool:
+        """Whether the precomputed token counts of the dataset are valid for the tokenizer."""
+        return tokenizer.name == self.ctx_data.get_token_count_encoding()
+
+    def _template_tokens(self, tokenizer: Tokenizer, template_str: str, field_names: list[str] = ()) -> int:
+        """Token count of a template without its fields."""
+        key = (tokenizer.name, template_str, tuple(field_names))
+        tokens = self._template_tokens_cache.get(key)
+        if tokens is None:
+            tokens = tokenizer.count(template_str.format(**{name: "" for name in field_names}))
+            self._template_tokens_cache[key] = tokens
+        return tokens
+
+    def _count_tokens(self, texts: list[str], tokenizer: Tokenizer) -> int:
+        return sum(tokenizer.count(text) for text in texts)
+
+    async def _count_tokens_async(self, texts: list[str], tokenizer: Tokenizer) -> int:
+        """Count tokens, in a worker thread for large inputs, so that other requests
+        are not blocked while a large history is being tokenized."""
+        if sum(len(text) for text in texts) >= self.options.tokenize_in_thread_min_chars:
+            return await asyncio.to_thread(self._count_tokens, texts, tokenizer)
+        return self._count_tokens(texts, tokenizer)
+
+    def _prewarm_prompt_cache(self):
+        logger.info("Prewarming prompt segment cache")
+        tokenizer = self._get_tokenizer()
+        for course_key, course_summary in self.ctx_data.course_dict.items():
+            for activity_key in course_summary.activities:
+                for template in PROMPT_SEGMENT_TEMPLATES:
+                    self._get_prompt_segment(template, course_key, activity_key, tokenizer)
 
     async def preprocess_query(self,query: str, history: list[dict[str, str]], course_key: str, 
                                activity_key: str, condensed_history: str, model_name : str = None) -> StructuredOutputResponse:
-        
+        def classify() -> Awaitable[StructuredOutputResponse]:
+            return self._with_fallback(model_name, lambda model: self._classify_query(
+                query, history, course_key, activity_key, condensed_history, model))
+
+        if not self.options.coalesce_requests:
+            return await classify()
+        key = ("preprocess", model_name or CHAT_MODEL, course_key, activity_key, condensed_history, query,
+               tuple(tuple(item) for item in history))
+        return await self._single_flight.do(key, classify)
+
+    async def _classify_query(self,query: str, history: list[dict[str, str]], course_key: str, 
+                              activity_key: str, condensed_history: str, model_name : str = None) -> StructuredOutputResponse:
         model = model_name or CHAT_MODEL
         client = self._get_async_openai_client(
             requested_model = model
         )
         config = self.get_model_config(model)
 
-        course_summary, lesson_summary = self.ctx_data.get_summary_texts(
-            course_key, activity_key)
-        
-        if condensed_history:
-            system_message = preprocess_system_message_template_with_history.format(
-                course_summary=course_summary,
-                lesson_summary=lesson_summary,
-                condensed_history = condensed_history
-            )    
-        else:
-          system_message = preprocess_system_message_template.format(
-                course_summary=course_summary,
-                lesson_summary=lesson_summary,
-            ) 
+        tokenizer = self.tokenizers.get(config)
+        segment = self._get_prompt_segment(
+            "preprocess_with_history" if condensed_history else "preprocess", course_key, activity_key, tokenizer)
+        system_message = segment.text.replace(CONDENSED_HISTORY_PLACEHOLDER, condensed_history, 1)
 
         messages = create_message(system_message, history, query)  
         tools = TOOLS_DEF
         tools_choice = TOOLS_CHOICE_DEF
-        response = await client.chat.completions.create(
-            model=config.name,
-            messages= messages,
-            max_tokens= 1000,
-            tools=tools,
-            tool_choice = tools_choice
-        )
+        max_tokens = 1000
+        tokens = max_tokens
+        if config.tokens_per_minute:
+            # history and query are tokenized only if the model has a token budget
+            tokens += segment.tokens + await self._count_tokens_async(
+                [condensed_history, query] + [item[0] + item[1] for item in history], tokenizer)
+        release = await self._admit(config, tokens)
+        try:
+            response = await client.chat.completions.create(
+                model=config.name,
+                messages= messages,
+                max_tokens= max_tokens,
+                tools=tools,
+                tool_choice = tools_choice
+            )
+        finally:
+            release()
         return parse_query_classification(response , query)
     
     
+    async def compact_history(self, history: list[tuple[str,str]], query: str, condensed_history: str,
+                              model_name: str = None, query_context: QueryContext = None) -> list[tuple[str,str]]:
+        """The latest turns of the history that fit into the history budget of the model together
+        with the query and the condensed history. Older turns are dropped.
+
+        Raises QueryTooLargeError if the query and the condensed history alone don't fit, so
+        that no upstream work is done for a request that can't be answered."""
+        with timed_stage("history_compaction", query_context):
+            budget = int(min(self.get_model_config(model).context_size for model in self._model_chain(model_name))
+                         * self.options.history_budget_fraction)
+            chars = len(query) + len(condensed_history) + sum(len(q) + len(a) for q, a in history)
+            # a token is at least one byte and a character at most four bytes, so this surely fits
+            if chars * 4 <= budget:
+                return history
+            tokenizer = self._get_tokenizer(model_name)
+            if chars >= self.options.tokenize_in_thread_min_chars:
+                compacted = await asyncio.to_thread(self._fit_history, history, query, condensed_history,
+                                                    budget, tokenizer)
+            else:
+                compacted = self._fit_history(history, query, condensed_history, budget, tokenizer)
+        if len(compacted) < len(history):
+            logger.info(f"Dropped {len(history) - len(compacted)} oldest of {len(history)} history turns "
+                        f"to fit into {budget} tokens")
+        return compacted
+
+    def _fit_history(self, history: list[tuple[str,str]], query: str, condensed_history: str,
+                     budget: int, tokenizer: Tokenizer) -> list[tuple[str,str]]:
+        """The latest history turns that fit into `budget` tokens.
+
+        With a condensed history, the latest turn is always kept, since the condensed history doesn't
+        cover it, and its answer is truncated if the turn doesn't fit."""
+        used = self._count_tokens([query, condensed_history], tokenizer)
+        if used > budget:
+            raise QueryTooLargeError(f"Query too large for model. Tokens used: {used}, history budget: {budget}")
+        for kept, (q, a) in enumerate(reversed(history)):
+            turn_tokens = tokenizer.count(q + a)
+            if used + turn_tokens > budget:
+                if kept == 0 and condensed_history:
+                    return [self._truncate_turn(q, a, budget - used, tokenizer)]
+                return history[len(history) - kept:]
+            used += turn_tokens
+        return history
+
+    def _truncate_turn(self, question: str, answer: str, budget: int,
+                       tokenizer: Tokenizer) -> tuple[str,str]:
+        """The turn with its answer cut to the longest prefix that fits into `budget` tokens."""
+        if tokenizer.count(question) > budget:
+            raise QueryTooLargeError(f"Latest history turn too large for model. History budget: {budget}")
+        low, high = 0, len(answer)
+        while low < high:
+            middle = (low + high + 1) // 2
+            if tokenizer.count(question + answer[:middle]) <= budget:
+                low = middle
+            else:
+                high = middle - 1
+        return question, answer[:low]
+
     async def make_system_message(self, history: list[tuple[str,str]], query: str,
-                                   course_key: str, activity_key: str, condensed_history: str, query_context : QueryContext = None) -> tuple[str, list[str]]:
-            
+                                   course_key: str, activity_key: str, condensed_history: str, query_context : QueryContext = None,
+                                   model_name: str = None) -> tuple[str, list[str]]:
+        """System message for the query. Token counts recorded in `query_context` are
+        counted with the tokenizer of `model_name`, the model that will answer the query."""
+        tokenizer = self._get_tokenizer(model_name)
+
         if condensed_history:
             condensed_history_segment = system_message_condensed_history_template.format(condensed_history=condensed_history)
-            history = [history.pop()]
+            history = [history.pop()] if history else []
         else:
             condensed_history_segment = ""
 
-        structured_output = await self.preprocess_query(
+        preprocess = self.preprocess_query(
             query=query,
             history=history,
             course_key=course_key,
@@ -305,89 +738,172 @@ class AiEngine:
             condensed_history=condensed_history
         )
 
-        logger.debug(f"structured_output: {structured_output}")
+        preprocess = timed_call("classification", preprocess, query_context)
 
-        query_embedding = await self._create_embedding(
-            input=structured_output.restated_question  or query,
-            encoding_format="float",
-            dimensions=EMBEDDING_SIZE
-        )
+        if self.options.parallel_query_embedding:
+            structured_output, query_embedding = await asyncio.gather(
+                preprocess,
+                self._embed_query(query, "embedding", query_context)
+            )
+            logger.debug(f"structured_output: {structured_output}")
+            if query_embedding is not None and self._should_reembed(query, structured_output.restated_question):
+                logger.debug("Restated question differs from the query, embedding it")
+                query_embedding = await self._embed_query(
+                    structured_output.restated_question, "reembedding", query_context) or query_embedding
+        else:
+            structured_output = await preprocess
+
+            logger.debug(f"structured_output: {structured_output}")
+
+            query_embedding = await self._embed_query(
+                structured_output.restated_question or query, "embedding", query_context)
+
+        summary = self._get_prompt_segment(
+            SUMMARY_SEGMENT_TEMPLATES[structured_output.classification], course_key, activity_key, tokenizer)
+        summary_segment = summary.text
+        instructions_segment = system_message_template.format(answer_language = get_answer_language(structured_output))
+        condensed_tokens = await self._count_tokens_async([condensed_history_segment], tokenizer)
+
+        token_budget = None
+        if self.options.context_packing:
+            token_budget = (self._context_budget(model_name) - self._template_tokens(tokenizer, instructions_segment)
+                            - summary.tokens - condensed_tokens
+                            - await self._count_tokens_async([query] + [q + a for q, a in history], tokenizer))
+            if self.options.context_max_tokens is not None:
+                token_budget = min(token_budget, self.options.context_max_tokens)
 
-        rag_segment, chunk_metadata = self._get_rag_segment(
+        rag, chunk_metadata = await self._get_rag_segment(
             structured_output=structured_output,
             query_embedding=query_embedding,
+            query_text=f"{query}\n{structured_output.restated_question}",
             course_key=course_key,
-            activity_key=activity_key
+            activity_key=activity_key,
+            tokenizer=tokenizer,
+            query_context=query_context,
+            token_budget=token_budget
         )
 
-        course_summary, lesson_summary = self.ctx_data.get_summary_texts(course_key, activity_key)
-        course_toc = self.ctx_data.get_toc_text(course_key)
-
-        if structured_output.classification == Classification.COURSE:
-            summary_segment = system_message_summary_template_course.format(
-                course_summary=course_summary,
-                toc = course_toc
-            )         
-        if structured_output.classification == Classification.CURRENT_LECTURE:
-            summary_segment =  system_message_summary_template_lesson.format(
-                lesson_summary=lesson_summary
-            )
-
-        if structured_output.classification == Classification.PLATFORM:
-            summary_segment = system_message_summary_template_platform
-        
-        if structured_output.classification == Classification.UNSURE:
-            summary_segment =  system_message_summary_template_unsure.format(
-                course_summary=course_summary,
-                lesson_summary=lesson_summary
-            )
-        system_message = system_message_template.format(answer_language = get_answer_language(structured_output)) + summary_segment + condensed_history_segment + rag_segment
-
-        if query_context:
-            query_context.add_system_message_parts(
-                [
-                    {"name": "system_message_template", "message": system_message_template},
-                    {"name": "summary_segment", "message": summary_segment},
-                    {"name": "condensed_segment", "message": condensed_history_segment},
-                    {"name": "rag_segment", "message": rag_segment}
-                ],
-                self.encoding
-            )
-            query_context.set_chunk_metadata(chunk_metadata)
+        with timed_stage("prompt_assembly", query_context):
+            system_message = instructions_segment + summary_segment + condensed_history_segment + rag.text
+
+            if query_context:
+                query_context.add_system_message_parts(
+                    [
+                        {"name": "system_message_template", "message": instructions_segment,
+                         "tokens": self._template_tokens(tokenizer, instructions_segment)},
+                        {"name": "summary_segment", "message": summary_segment, "tokens": summary.tokens},
+                        {"name": "condensed_segment", "message": condensed_history_segment,
+                         "tokens": condensed_tokens},
+                        {"name": "rag_segment", "message": rag.text, "tokens": rag.tokens}
+                    ],
+                    tokenizer
+                )
+                query_context.set_chunk_metadata(chunk_metadata)
+                query_context.classification = structured_output.classification.value
+                query_context.query_embedding = query_embedding or []
 
         return system_message, structured_output.followup_questions
 
     async def generate_answer(self,*, history: list[tuple[str,str]], query: str,
-                            course_key: str, activity_key: str, condensed_history: str, model_name) -> tuple[AsyncIterator[int], list[str], QueryContext]:
+                            course_key: str, activity_key: str, condensed_history: str, model_name,
+                            use_answer_cache: bool = True) -> tuple[AsyncIterator[int], list[str], QueryContext]:
+        """Answer stream, followup questions and the query context. Answers to first-turn
+        questions may be served from the answer cache unless `use_answer_cache` is False.
+
+        Concurrent identical first-turn questions share one upstream answer stream."""
+        first_turn = not history and not condensed_history
+        if not (first_turn and self.options.coalesce_requests):
+            return await self._generate_answer(history, query, course_key, activity_key,
+                                               condensed_history, model_name, use_answer_cache)
+
+        key = (course_key, activity_key, model_name or CHAT_MODEL, EmbeddingCache.normalize(query), use_answer_cache)
+        flight = self._answer_flights.get(key)
+        if flight is None:
+            async def start_shared_answer() -> tuple[SharedStream[str], list[str], QueryContext]:
+                answer, followup_questions, query_context = await self._generate_answer(
+                    history, query, course_key, activity_key, condensed_history, model_name, use_answer_cache)
+                # the stream is shared until it is finished, so later identical questions subscribe to it too
+                shared = SharedStream(answer, on_done=lambda: self._end_answer_flight(key, flight))
+                return shared, followup_questions, query_context
+
+            flight = asyncio.ensure_future(start_shared_answer())
+            self._answer_flights[key] = flight
+            flight.add_done_callback(lambda f: self._end_answer_flight(key, f, failed_only=True))
+        else:
+            self._single_flight.coalesced += 1
+            logger.debug("Coalesced answer stream")
+        shared, followup_questions, query_context = await wait_shared(flight, self._answer_flight_waiters)
+        return shared.subscribe(), followup_questions, query_context
+
+    def _end_answer_flight(self, key: tuple, flight: asyncio.Future, failed_only: bool = False) -> None:
+        if failed_only and not flight.cancelled() and flight.exception() is None:
+            return
+        if self._answer_flights.get(key) is flight:
+            del self._answer_flights[key]
+
+    async def _generate_answer(self, history: list[tuple[str,str]], query: str, course_key: str, activity_key: str,
+                               condensed_history: str, model_name: str,
+                               use_answer_cache: bool) -> tuple[AsyncIterator[str], list[str], QueryContext]:
         query_context = QueryContext()
+        started = time.perf_counter()
+        first_turn = not history and not condensed_history
 
         if condensed_history:
-            history = [history.pop()]
+            history = [history.pop()] if history else []
             
-        system_message, followup_questions = await self.make_system_message(history, query, course_key, activity_key, condensed_history, query_context)
+        system_message, followup_questions = await timed_call("system_message", self.make_system_message(
+            history, query, course_key, activity_key, condensed_history, query_context, model_name=model_name),
+            query_context)
+        tokenizer = self._get_tokenizer(model_name)
+
+        cache_key = None
+        if first_turn and use_answer_cache and self.answer_cache.enabled and query_context.query_embedding:
+            cache_key = (self.ctx_data.version, course_key, activity_key, query_context.classification,
+                         model_name or CHAT_MODEL)
+            cached = self.answer_cache.get(cache_key, query_context.query_embedding)
+            if cached is not None:
+                async def cached_answer_generator():
+                    yield cached.answer
+
+                return cached_answer_generator(), cached.followup_questions, query_context
         
         messages = create_message(system_message, history, query)
 
-        for item in history:
-            query_context.add_encoding_length("history", item[0] + item[1], self.encoding) 
-        query_context.add_encoding_length("user_query", query, self.encoding)
-
-        response = await self._handle_query_submission(
-            message= messages,
-            max_tokens= 2000, 
-            stream=True,
-            model_name=model_name)
+        # static parts of the system message are already counted, only the history and the query are tokenized
+        if history:
+            query_context.add_token_count("history", await self._count_tokens_async(
+                [item[0] + item[1] for item in history], tokenizer))
+        query_context.add_token_count("user_query", await self._count_tokens_async([query], tokenizer))
+
+        query_context.model, first_chunk, chunks = await timed_call("answer_first_token", self._stream_answer(
+            messages=messages,
+            max_tokens=ANSWER_MAX_TOKENS,
+            model_name=model_name,
+            message_tokens=query_context.get_encoding_length()), query_context)
+        TIME_TO_FIRST_TOKEN_SECONDS.observe(time.perf_counter() - started, model=query_context.model)
     
         async def answer_generator():
-            async for chunk in response:
-                if len(chunk.choices) > 0:
-                    delta = chunk.choices[0].delta
-                    if delta.content:
-                        yield delta.content
-
-        return answer_generator(), followup_questions, query_context
+            answer_chunks = [first_chunk]
+            with timed_stage("answer_stream", query_context):
+                yield first_chunk
+                async for chunk in chunks:
+                    answer_chunks.append(chunk)
+                    yield chunk
+            TOKENS.inc(self._get_tokenizer(query_context.model).count("".join(answer_chunks)),
+                       model=query_context.model, direction="out")
+            # only answers that were streamed completely are cached
+            if cache_key is not None:
+                self.answer_cache.put(cache_key, query_context.query_embedding,
+                                      CachedAnswer("".join(answer_chunks), followup_questions))
+
+        return ClosingStream(answer_generator(), chunks), followup_questions, query_context
     
     async def generate_condensed_history(self, history: list[tuple[str,str]],
+                                          condensed_history: str, query_context: QueryContext = None) -> str:
+        with timed_stage("condensed_history", query_context):
+            return await self._generate_condensed_history(history, condensed_history)
+
+    async def _generate_condensed_history(self, history: list[tuple[str,str]],
                                           condensed_history: str) -> str:
         if len(history) < 2:
             return ""
@@ -414,10 +930,11 @@ class AiEngine:
             history=[],
             query=message)
 
-        response = await self._handle_query_submission(
+        response = await self._with_fallback(None, lambda model: self._handle_query_submission(
             message=messages, 
             max_tokens= 1000, 
-            stream=False)
+            stream=False,
+            model_name=model))
         logger.debug(f"condensed_history: {response}")
 
         return response
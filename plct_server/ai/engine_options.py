@@ -0,0 +1,40 @@
+from pydantic import BaseModel
+
+class AiEngineOptions(BaseModel):
+    """Options of the AI engine. `ConfigOptions` extends this class, so all these
+    options can be set in the configuration file."""
+
+    vector_store: str = "chroma"  # "chroma" or "numpy"
+    retrieval: str = "vector"  # "vector", "lexical" or "hybrid"; lexical and hybrid retrieval need a lexical index in the dataset
+    hybrid_candidates: int = 3  # chunks retrieved by each retriever in hybrid retrieval, as a multiple of chunks used
+    rrf_k: int = 60  # rank constant of reciprocal rank fusion in hybrid retrieval
+    embedding_timeout: float | None = None  # seconds; in hybrid retrieval, slower query embeddings are skipped
+    context_packing: bool = False  # fill a token budget with retrieved chunks instead of using a fixed number of chunks
+    context_budget_fraction: float = 0.25  # fraction of the smallest context size of the model and its fallbacks used by the prompt
+    context_max_tokens: int | None = None  # maximum tokens of packed chunks, regardless of the budget
+    context_candidates: int = 40  # chunks retrieved as candidates for packing
+    context_max_distance: float | None = None  # candidates farther from the query are not packed
+    context_mmr_lambda: float = 0.7  # relevance (1) vs. diversity (0) of packed chunks
+    context_max_similarity: float | None = 0.95  # candidates this similar to a packed chunk are dropped as duplicates
+    history_budget_fraction: float = 0.5  # fraction of the smallest context size of the model and its fallbacks used by history
+    ai_ctx_cache_dir: str | None = None  # local cache for files of a remote AI context dataset
+    chunk_cache_size: int = 2048  # number of chunk texts kept in memory
+    prompt_cache_size: int = 4096  # number of rendered prompt segments kept in memory
+    prewarm_prompt_cache: bool = False  # render prompt segments of all activities at startup
+    parallel_query_embedding: bool = False  # embed the raw query while the query is being classified
+    reembed_policy: str = "if_different"  # "never" or "if_different": when to embed the restated question
+    reembed_min_similarity: float = 0.9  # restated question is embedded if its similarity to the query is lower
+    tokenize_in_thread_min_chars: int = 20_000  # larger texts are tokenized in a worker thread
+    tokenizer_cache_dir: str | None = None  # local tiktoken and Hugging Face tokenizer files, see doc/config.md
+    embedding_cache_size: int = 1024  # number of query embeddings kept in memory
+    embedding_cache_path: str | None = None  # SQLite file with query embeddings shared by workers and restarts
+    embedding_cache_disk_size: int = 100_000  # maximum number of query embeddings in the SQLite file
+    answer_cache_size: int = 0  # number of cached answers to first-turn questions, 0 disables the answer cache
+    answer_cache_ttl: float = 86_400  # seconds an answer stays in the answer cache
+    answer_cache_min_similarity: float = 0.95  # minimum similarity of query embeddings for a cached answer
+    coalesce_requests: bool = True  # share upstream calls between concurrent identical requests
+    provider_max_concurrency: dict[str, int] = {}  # maximum number of concurrent requests per provider
+    admission_max_waiting: int = 100  # maximum number of requests waiting for admission per provider or model
+    admission_timeout: float = 10.0  # seconds a request waits for admission
+    model_fallbacks: dict[str, list[str]] = {}  # fallback models of a model, in order of preference
+    hedge_first_token_timeout: float | None = None  # seconds to wait for the first token before trying a fallback model
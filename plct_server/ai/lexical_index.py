@@ -0,0 +1,111 @@
+import re
+import unicodedata
+from collections import Counter
+from typing import NamedTuple
+
+import numpy as np
+
+from .row_ranges import RowRanges
+
+# Serbian Cyrillic to Latin, with Latin letters folded to ASCII, so that a term
+# matches in both scripts and with or without diacritics (e.g. "петља", "petlja")
+_TRANSLITERATION = str.maketrans({
+    "а": "a", "б": "b", "в": "v", "г": "g", "д": "d", "ђ": "dj", "е": "e", "ж": "z", "з": "z",
+    "и": "i", "ј": "j", "к": "k", "л": "l", "љ": "lj", "м": "m", "н": "n", "њ": "nj", "о": "o",
+    "п": "p", "р": "r", "с": "s", "т": "t", "ћ": "c", "у": "u", "ф": "f", "х": "h", "ц": "c",
+    "ч": "c", "џ": "dz", "ш": "s",
+    "č": "c", "ć": "c", "š": "s", "ž": "z", "đ": "dj",
+})
+
+_WORD = re.compile(r"\w+")
+_IDENTIFIER_PART = re.compile(r"[A-Z]?[a-z]+|[A-Z]+(?![a-z])|\d+")
+
+def normalize(word: str) -> str:
+    """Lowercase, transliterated and ASCII-folded form of a word."""
+    word = unicodedata.normalize("NFC", word).lower().translate(_TRANSLITERATION)
+    return "".join(c for c in unicodedata.normalize("NFKD", word) if not unicodedata.combining(c))
+
+def tokenize(text: str) -> list[str]:
+    """Terms of a text. Code identifiers (snake_case and camelCase) are indexed as a whole
+    and by their parts."""
+    terms = []
+    for word in _WORD.findall(text):
+        term = normalize(word)
+        terms.append(term)
+        if "_" in word or word[1:] != word[1:].lower():
+            terms.extend(part for part in map(normalize, _IDENTIFIER_PART.findall(word)) if part != term)
+    return terms
+
+class LexicalMatch(NamedTuple):
+    id: str
+    score: float
+    metadata: dict[str, str]
+
+class LexicalIndex:
+    """BM25 index over chunk texts.
+
+    Postings are kept in flat arrays: rows (chunks) containing the term with id `t` are
+    `docs[offsets[t]:offsets[t + 1]]`, in ascending order, with term frequencies in `tfs`.
+    Rows are ordered by course and activity, so a course or an activity filter is a row
+    range, and postings in the range are found by binary search."""
+
+    K1 = 1.2
+    B = 0.75
+
+    def __init__(self, vocabulary: list[str], offsets: np.ndarray, docs: np.ndarray, tfs: np.ndarray,
+                 doc_lengths: np.ndarray, ids: list[str], metadatas: list[dict[str, str]]):
+        self.vocabulary = vocabulary
+        self.terms = {term: i for i, term in enumerate(vocabulary)}
+        self.offsets = offsets
+        self.docs = docs
+        self.tfs = tfs
+        self.doc_lengths = doc_lengths
+        self.ids = ids
+        self.metadatas = metadatas
+        self.row_ranges = RowRanges(metadatas)
+        doc_freqs = np.diff(offsets).astype(np.float32)
+        self.idf = np.log1p((len(ids) - doc_freqs + 0.5) / (doc_freqs + 0.5)).astype(np.float32)
+        avg_length = float(doc_lengths.mean()) if len(doc_lengths) else 1.0
+        self.length_norm = (self.K1 * (1 - self.B + self.B * doc_lengths / max(avg_length, 1.0))).astype(np.float32)
+
+    @classmethod
+    def build(cls, texts: list[str], ids: list[str], metadatas: list[dict[str, str]]) -> "LexicalIndex":
+        """Index of texts, given in the order of rows (by course and activity)."""
+        postings: dict[str, list[tuple[int, int]]] = {}
+        doc_lengths = np.zeros(len(texts), dtype=np.int32)
+        for row, text in enumerate(texts):
+            terms = Counter(tokenize(text))
+            doc_lengths[row] = sum(terms.values())
+            for term, tf in terms.items():
+                postings.setdefault(term, []).append((row, tf))
+        vocabulary = sorted(postings)
+        offsets = np.zeros(len(vocabulary) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(postings[term]) for term in vocabulary])
+        docs = np.fromiter((row for term in vocabulary for row, _ in postings[term]),
+                           dtype=np.int32, count=int(offsets[-1]))
+        tfs = np.fromiter((min(tf, np.iinfo(np.uint16).max) for term in vocabulary for _, tf in postings[term]),
+                          dtype=np.uint16, count=int(offsets[-1]))
+        return cls(vocabulary, offsets, docs, tfs, doc_lengths, ids, metadatas)
+
+    def query(self, text: str, where: dict, n_results: int) -> list[LexicalMatch]:
+        rows = self.row_ranges.rows_for_filter(where)
+        if n_results <= 0 or rows.stop <= rows.start:
+            return []
+        term_ids = {self.terms[term] for term in tokenize(text) if term in self.terms}
+        scores = np.zeros(rows.stop - rows.start, dtype=np.float32)
+        for term_id in term_ids:
+            start, stop = self.offsets[term_id], self.offsets[term_id + 1]
+            docs = self.docs[start:stop]
+            lo, hi = np.searchsorted(docs, [rows.start, rows.stop])
+            docs = docs[lo:hi]
+            tfs = self.tfs[start + lo:start + hi].astype(np.float32)
+            scores[docs - rows.start] += self.idf[term_id] * tfs * (self.K1 + 1) / (tfs + self.length_norm[docs])
+        matched = np.flatnonzero(scores)
+        n_results = min(n_results, len(matched))
+        if n_results == 0:
+            return []
+        top = matched[np.argpartition(-scores[matched], n_results - 1)[:n_results]]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return [LexicalMatch(id=self.ids[rows.start + i], score=float(scores[i]),
+                             metadata=dict(self.metadatas[rows.start + i]))
+                for i in top]
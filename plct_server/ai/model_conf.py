@@ -16,6 +16,10 @@ class ModelConfig(BaseModel):
     extra_body : dict = {}
     provider : ModelProvider | None = None  # use default provider if None
     order: int = 0  # for sorting models in the UI
+    tokenizer: str | None = None  # "tiktoken:<encoding>", "hf:<model id>" or "estimate"; derived from the name if None
+    chars_per_token: float = 3.0  # used to estimate token counts if the tokenizer is not available
+    max_concurrency: int | None = None  # maximum number of concurrent requests, unlimited if None
+    tokens_per_minute: int | None = None  # token budget per minute (prompt and maximum completion tokens)
 
 MODEL_CONFIGS_LIST = [
     ModelConfig(
@@ -45,11 +49,13 @@ MODEL_CONFIGS_LIST = [
     ModelConfig(
         name="gpt-5.2",
         provider = ModelProvider.OPENAI,
+        tokenizer="tiktoken:o200k_base",
         type = "chat",
         context_size=128_000
     ),
     ModelConfig(
         name="meta-llama/Llama-3.1-70B-Instruct",
+        tokenizer="hf:meta-llama/Llama-3.1-70B-Instruct",
         provider = ModelProvider.VLLM,
         type = "chat",
         context_size=128_000,
@@ -59,24 +65,28 @@ MODEL_CONFIGS_LIST = [
     ),
     ModelConfig(
         name="nvidia/Llama-3.3-70B-Instruct-FP8",
+        tokenizer="hf:nvidia/Llama-3.3-70B-Instruct-FP8",
         provider = ModelProvider.VLLM,
         type = "chat",
         context_size=98_304
     ),
     ModelConfig(
         name="Qwen/Qwen3-32B",
+        tokenizer="hf:Qwen/Qwen3-32B",
         provider= ModelProvider.VLLM,
         type = "chat",
         context_size=32_768
     ),
     ModelConfig(
         name="Qwen/Qwen3-14B",
+        tokenizer="hf:Qwen/Qwen3-14B",
         provider= ModelProvider.VLLM,
         type = "chat",
         context_size=32_768
     ),
     ModelConfig(
         name="Qwen/Qwen3-8B",
+        tokenizer="hf:Qwen/Qwen3-8B",
         provider = ModelProvider.VLLM,
         type = "chat",
         context_size=32_768
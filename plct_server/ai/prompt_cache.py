@@ -0,0 +1,35 @@
+from typing import Callable, NamedTuple
+
+from .cache import LruCache
+from .tokenizer_registry import Tokenizer
+
+class PromptSegment(NamedTuple):
+    text: str
+    tokens: int
+
+class PromptSegmentCache:
+    """Rendered prompt segments with their token counts, keyed by
+    (course_key, activity_key, template, tokenizer name).
+
+    Segments depend only on the AI context dataset, which is loaded once per process,
+    so the cache lives as long as the process; a changed dataset needs a restart."""
+
+    def __init__(self, maxsize: int):
+        self._cache: LruCache[tuple[str, str, str, str], PromptSegment] = LruCache(maxsize)
+
+    def get(self, course_key: str, activity_key: str, template: str,
+            render: Callable[[], tuple[str, int | None]], tokenizer: Tokenizer) -> PromptSegment:
+        """Cached segment, or a segment rendered by `render`, which returns the text and,
+        if known (e.g. from precomputed counts), its token count for `tokenizer`."""
+        key = (course_key, activity_key, template, tokenizer.name)
+        segment = self._cache.get(key)
+        if segment is None:
+            text, tokens = render()
+            if tokens is None:
+                tokens = tokenizer.count(text)
+            segment = PromptSegment(text, tokens)
+            self._cache.put(key, segment)
+        return segment
+
+    def stats(self) -> dict[str, int]:
+        return self._cache.stats()
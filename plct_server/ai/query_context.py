@@ -1,17 +1,31 @@
 import logging
-from pydantic import BaseModel
-from tiktoken import Encoding
+import time
+from contextlib import contextmanager
+from typing import Awaitable, Iterator, TypeVar
+from pydantic import BaseModel, Field
+
+from ..metrics import STAGE_SECONDS
+from .tokenizer_registry import Tokenizer
 
 
 logger = logging.getLogger(__name__)
 
+T = TypeVar("T")
+
 class QueryError(Exception):
     pass
 
+class QueryTooLargeError(QueryError):
+    """The question does not fit into the context of the model, even without history."""
+
 class QueryContext(BaseModel):
     chunk_metadata : list[dict[str,str]] = []
     system_message : str = ""
     token_size : dict[str,int] = {}
+    model : str = ""
+    classification : str = ""
+    query_embedding : list[float] = Field(default=[], exclude=True)
+    stage_times : dict[str, tuple[float, float]] = {}  # stage name -> (start, end) as Unix timestamps
 
     def set_chunk_metadata(self, chunk_metadata: dict[str,str]):
         self.chunk_metadata = chunk_metadata
@@ -19,10 +33,16 @@ class QueryContext(BaseModel):
     def get_all_chunk_activity_keys(self) -> str:
         return [item["activity_key"] for item in self.chunk_metadata]
             
-    def add_encoding_length(self, name: str, message: str, encoding: Encoding) -> None:
+    def add_encoding_length(self, name: str, message: str, tokenizer: Tokenizer) -> None:
+        self.add_token_count(name, tokenizer.count(message))
+
+    def add_stage_time(self, name: str, start: float, end: float) -> None:
+        self.stage_times[name] = (start, end)
+
+    def add_token_count(self, name: str, count: int) -> None:
         if name not in self.token_size:
             self.token_size[name] = 0
-        self.token_size[name] += len(encoding.encode(message))
+        self.token_size[name] += count
     
     def get_encoding_length(self) -> int:
         return sum(self.token_size.values())
@@ -31,7 +51,27 @@ class QueryContext(BaseModel):
         for name, size in self.token_size.items():
             logger.debug(f"Encoding length for {name}: {size}")
 
-    def add_system_message_parts(self,parts: list[dict[str, str]], encoding: Encoding) -> None:
+    def add_system_message_parts(self,parts: list[dict[str, str | int]], tokenizer: Tokenizer) -> None:
         for part in parts:
-            self.add_encoding_length(part["name"], part["message"], encoding)
-            self.system_message += part["message"]
\ No newline at end of file
+            if "tokens" in part:
+                self.add_token_count(part["name"], part["tokens"])
+            else:
+                self.add_encoding_length(part["name"], part["message"], tokenizer)
+            self.system_message += part["message"]
+
+@contextmanager
+def timed_stage(name: str, query_context: QueryContext | None = None) -> Iterator[None]:
+    """Record the duration of a stage in the stage metrics and in the query context."""
+    start = time.time()
+    start_counter = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start_counter
+        STAGE_SECONDS.observe(elapsed, stage=name)
+        if query_context is not None:
+            query_context.add_stage_time(name, start, start + elapsed)
+
+async def timed_call(name: str, awaitable: Awaitable[T], query_context: QueryContext | None = None) -> T:
+    with timed_stage(name, query_context):
+        return await awaitable
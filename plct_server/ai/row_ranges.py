@@ -0,0 +1,36 @@
+class RowRanges:
+    """Contiguous row ranges of courses and activities in rows ordered by (course_key, activity_key).
+
+    Maps the filters used by the AI engine, in the Chroma `where` syntax (an empty filter,
+    `{"course_key": ...}` and `{"$and": [{"course_key": ...}, {"activity_key": ...}]}`),
+    to row slices."""
+
+    course_rows: dict[str, slice]
+    activity_rows: dict[tuple[str, str], slice]
+
+    def __init__(self, metadatas: list[dict[str, str]]):
+        self.size = len(metadatas)
+        self.course_rows = {}
+        self.activity_rows = {}
+        for row, metadata in enumerate(metadatas):
+            course_key = metadata["course_key"]
+            activity = (course_key, metadata["activity_key"])
+            course_range = self.course_rows.get(course_key)
+            self.course_rows[course_key] = slice(course_range.start if course_range else row, row + 1)
+            activity_range = self.activity_rows.get(activity)
+            self.activity_rows[activity] = slice(activity_range.start if activity_range else row, row + 1)
+
+    def rows_for_filter(self, where: dict) -> slice:
+        if not where:
+            return slice(0, self.size)
+        conditions = where["$and"] if "$and" in where else [where]
+        criteria = {}
+        for condition in conditions:
+            criteria.update(condition)
+        course_key = criteria.get("course_key")
+        activity_key = criteria.get("activity_key")
+        if course_key is None or not set(criteria) <= {"course_key", "activity_key"}:
+            raise ValueError(f"Unsupported filter: {where}")
+        if activity_key is None:
+            return self.course_rows.get(course_key, slice(0, 0))
+        return self.activity_rows.get((course_key, activity_key), slice(0, 0))
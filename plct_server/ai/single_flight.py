@@ -0,0 +1,136 @@
+import asyncio
+import logging
+from typing import AsyncIterator, Awaitable, Callable, Generic, Hashable, TypeVar
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+async def wait_shared(call: asyncio.Future[T], waiters: dict[asyncio.Future, int]) -> T:
+    """Wait for a call shared by several callers, counted in `waiters`. A caller that is
+    cancelled doesn't cancel the call for the other callers, but the call is cancelled
+    when its last caller is."""
+    waiters[call] = waiters.get(call, 0) + 1
+    try:
+        return await asyncio.shield(call)
+    except asyncio.CancelledError:
+        if waiters[call] == 1:
+            call.cancel()
+        raise
+    finally:
+        waiters[call] -= 1
+        if not waiters[call]:
+            del waiters[call]
+
+class SingleFlight(Generic[T]):
+    """Coalesces concurrent calls with the same key into one call.
+
+    The call runs in its own task, so a caller that is cancelled doesn't cancel
+    the call for the other callers; it is cancelled when all its callers are.
+    Results and exceptions are shared by all callers."""
+
+    def __init__(self):
+        self._calls: dict[Hashable, asyncio.Future[T]] = {}
+        self._waiters: dict[asyncio.Future, int] = {}
+        self.coalesced = 0
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[T]]) -> T:
+        call = self._calls.get(key)
+        if call is None:
+            call = asyncio.ensure_future(fn())
+            self._calls[key] = call
+            call.add_done_callback(lambda _: self._calls.pop(key, None))
+        else:
+            self.coalesced += 1
+            logger.debug(f"Coalesced call {key[0] if isinstance(key, tuple) else key}")
+        return await wait_shared(call, self._waiters)
+
+class SharedStream(Generic[T]):
+    """Fans out one async iterator to multiple subscribers.
+
+    Every subscriber gets all items from the start of the stream. The source is
+    consumed by a background task, which is cancelled when all subscribers are gone
+    before the source is exhausted."""
+
+    def __init__(self, source: AsyncIterator[T], on_done: Callable[[], None] = None):
+        self._items: list[T] = []
+        self._done = False
+        self._error: BaseException | None = None
+        self._changed = asyncio.Event()
+        self._subscribers = 0
+        self._on_done = on_done
+        self._task = asyncio.create_task(self._pump(source))
+
+    async def _pump(self, source: AsyncIterator[T]) -> None:
+        try:
+            async for item in source:
+                self._items.append(item)
+                self._notify()
+        except asyncio.CancelledError:
+            self._error = asyncio.CancelledError()
+            raise
+        except Exception as e:
+            self._error = e
+        finally:
+            self._done = True
+            self._notify()
+            if self._on_done:
+                self._on_done()
+            if hasattr(source, "aclose"):
+                # closes the upstream stream right away if the pump is cancelled
+                await source.aclose()
+
+    def _notify(self) -> None:
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    def subscribe(self) -> "Subscription[T]":
+        """A new subscriber, which keeps the stream alive from now until it is exhausted or closed."""
+        return Subscription(self)
+
+    async def _item(self, index: int) -> T:
+        while True:
+            changed = self._changed
+            if index < len(self._items):
+                return self._items[index]
+            if self._done:
+                if self._error is not None:
+                    raise self._error
+                raise StopAsyncIteration
+            await changed.wait()
+
+    def _unsubscribe(self) -> None:
+        self._subscribers -= 1
+        if self._subscribers == 0 and not self._done:
+            logger.debug("All subscribers are gone, cancelling the shared stream")
+            self._task.cancel()
+
+class Subscription(Generic[T]):
+    """Iterator over the items of a shared stream. Unlike an async generator, it counts as a
+    subscriber as soon as it is created, so closing it before the first item still cancels
+    the stream if it was the last subscriber."""
+
+    def __init__(self, stream: SharedStream[T]):
+        self._stream = stream
+        self._index = 0
+        self._closed = False
+        stream._subscribers += 1
+
+    def __aiter__(self) -> AsyncIterator[T]:
+        return self
+
+    async def __anext__(self) -> T:
+        if self._closed:
+            raise StopAsyncIteration
+        try:
+            item = await self._stream._item(self._index)
+        except BaseException:
+            await self.aclose()
+            raise
+        self._index += 1
+        return item
+
+    async def aclose(self) -> None:
+        if not self._closed:
+            self._closed = True
+            self._stream._unsubscribe()
@@ -0,0 +1,166 @@
+"""Tokenizers used to count tokens for the token budget checks of each model.
+
+Tokenizers are specified per model with the `ModelConfig.tokenizer` field:
+    - `tiktoken:<encoding>`, e.g. `tiktoken:o200k_base`
+    - `hf:<model id>`, a Hugging Face `tokenizer.json` file stored in the
+      tokenizer cache folder as `hf/<model id with / replaced by -->/tokenizer.json`
+    - `estimate`, an estimate based on `ModelConfig.chars_per_token`
+
+If the field is not set, the tiktoken encoding of the model is used if tiktoken knows
+the model, and the estimate otherwise. Tokenizers of the configured models are preloaded
+when the AI engine starts, only from local files: tiktoken encodings from the tiktoken
+cache folder, which is never filled from the network by the server. A tokenizer is never
+loaded on the request path; token counts of a model whose tokenizer wasn't preloaded are
+estimated. If a tokenizer can't be loaded, the estimate is used instead, so the server
+never fails to start (or to answer) because of a missing tokenizer file.
+"""
+
+import hashlib
+import logging
+import math
+import os
+import tempfile
+from abc import ABC, abstractmethod
+from typing import Iterable
+
+import tiktoken
+
+from .model_conf import ModelConfig
+
+logger = logging.getLogger(__name__)
+
+_TIKTOKEN_BLOB_URL = "https://openaipublic.blob.core.windows.net/encodings/{}.tiktoken"
+
+# BPE files of the tiktoken encodings, which tiktoken downloads if they are not in its cache
+TIKTOKEN_ENCODING_FILES = {
+    "o200k_base": [_TIKTOKEN_BLOB_URL.format("o200k_base")],
+    "o200k_harmony": [_TIKTOKEN_BLOB_URL.format("o200k_base")],
+    "cl100k_base": [_TIKTOKEN_BLOB_URL.format("cl100k_base")],
+    "p50k_base": [_TIKTOKEN_BLOB_URL.format("p50k_base")],
+    "p50k_edit": [_TIKTOKEN_BLOB_URL.format("p50k_base")],
+    "r50k_base": [_TIKTOKEN_BLOB_URL.format("r50k_base")],
+}
+
+def tiktoken_cache_dir() -> str:
+    """The cache folder of tiktoken, as tiktoken itself chooses it."""
+    if "TIKTOKEN_CACHE_DIR" in os.environ:
+        return os.environ["TIKTOKEN_CACHE_DIR"]
+    if "DATA_GYM_CACHE_DIR" in os.environ:
+        return os.environ["DATA_GYM_CACHE_DIR"]
+    return os.path.join(tempfile.gettempdir(), "data-gym-cache")
+
+def load_cached_encoding(name: str) -> tiktoken.Encoding:
+    """The tiktoken encoding, if its files are in the tiktoken cache folder.
+    Raises FileNotFoundError instead of letting tiktoken download them."""
+    cache_dir = tiktoken_cache_dir()
+    for url in TIKTOKEN_ENCODING_FILES.get(name, []):
+        # tiktoken caches a downloaded file under the SHA-1 hash of its URL
+        path = os.path.join(cache_dir, hashlib.sha1(url.encode()).hexdigest()) if cache_dir else ""
+        if not os.path.isfile(path):
+            raise FileNotFoundError(f"{url} is not in the tiktoken cache folder '{cache_dir}'")
+    return tiktoken.get_encoding(name)
+
+class Tokenizer(ABC):
+    name: str
+
+    @abstractmethod
+    def count(self, text: str) -> int:
+        pass
+
+class TiktokenTokenizer(Tokenizer):
+
+    def __init__(self, encoding: tiktoken.Encoding):
+        self.encoding = encoding
+        self.name = encoding.name
+
+    def count(self, text: str) -> int:
+        return len(self.encoding.encode(text, disallowed_special=()))
+
+class HfTokenizer(Tokenizer):
+
+    def __init__(self, name: str, path: str):
+        from tokenizers import Tokenizer as HfTokenizerImpl
+        self.tokenizer = HfTokenizerImpl.from_file(path)
+        self.name = name
+
+    def count(self, text: str) -> int:
+        return len(self.tokenizer.encode(text, add_special_tokens=False).ids)
+
+class EstimatingTokenizer(Tokenizer):
+    """Cheap estimate from the text length. `chars_per_token` should be calibrated
+    on the course content for the model, erring on the low side."""
+
+    def __init__(self, chars_per_token: float):
+        self.chars_per_token = chars_per_token
+        self.name = f"estimate:{chars_per_token}"
+
+    def count(self, text: str) -> int:
+        return math.ceil(len(text) / self.chars_per_token)
+
+class TokenizerRegistry:
+
+    def __init__(self, cache_dir: str = None):
+        self.cache_dir = cache_dir
+        if cache_dir and "TIKTOKEN_CACHE_DIR" not in os.environ:
+            # tiktoken reads its cache location from the environment when an encoding is loaded
+            os.environ["TIKTOKEN_CACHE_DIR"] = os.path.join(cache_dir, "tiktoken")
+        self._tokenizers: dict[str, Tokenizer] = {}
+
+    def preload(self, model_configs: Iterable[ModelConfig]) -> None:
+        """Load the tokenizers of the models, which may download tiktoken encodings."""
+        for model_config in model_configs:
+            spec = self._spec(model_config)
+            if spec not in self._tokenizers:
+                self._tokenizers[spec] = self._load(spec, model_config)
+
+    def get(self, model_config: ModelConfig) -> Tokenizer:
+        spec = self._spec(model_config)
+        tokenizer = self._tokenizers.get(spec)
+        if tokenizer is None:
+            if spec.startswith("estimate:"):
+                tokenizer = self._load(spec, model_config)
+            else:
+                # loading it here could block the event loop, or even download it, while requests wait
+                logger.warning(f"Tokenizer '{spec}' of model '{model_config.name}' is not preloaded, "
+                               f"estimating token counts instead")
+                tokenizer = EstimatingTokenizer(model_config.chars_per_token)
+            self._tokenizers[spec] = tokenizer
+        return tokenizer
+
+    def _spec(self, model_config: ModelConfig) -> str:
+        spec = model_config.tokenizer or self._default_spec(model_config)
+        if spec == "estimate":
+            spec = f"estimate:{model_config.chars_per_token}"
+        return spec
+
+    def _default_spec(self, model_config: ModelConfig) -> str:
+        try:
+            return f"tiktoken:{tiktoken.encoding_name_for_model(model_config.name)}"
+        except KeyError:
+            return "estimate"
+
+    def _load(self, spec: str, model_config: ModelConfig) -> Tokenizer:
+        kind, _, name = spec.partition(":")
+        try:
+            if kind == "tiktoken":
+                tokenizer = TiktokenTokenizer(load_cached_encoding(name))
+            elif kind == "hf":
+                tokenizer = HfTokenizer(spec, self._hf_tokenizer_path(name))
+            elif kind == "estimate":
+                return EstimatingTokenizer(float(name))
+            else:
+                raise ValueError(f"Unsupported tokenizer: {spec}")
+        except Exception as e:
+            logger.warning(f"Failed to load tokenizer '{spec}' for model '{model_config.name}', "
+                           f"estimating token counts instead: {e}")
+            return EstimatingTokenizer(model_config.chars_per_token)
+        logger.info(f"Loaded tokenizer '{spec}'")
+        return tokenizer
+
+    def _hf_tokenizer_path(self, model_id: str) -> str:
+        if self.cache_dir is None:
+            raise ValueError("Tokenizer cache folder is not configured")
+        path = os.path.join(self.cache_dir, "hf", model_id.replace("/", "--"), "tokenizer.json")
+        if not os.path.isfile(path):
+            raise FileNotFoundError(path)
+        return path
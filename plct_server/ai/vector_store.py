@@ -0,0 +1,208 @@
+import logging
+import math
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+
+import numpy as np
+
+from .context_dataset import ContextDataset
+from .lexical_index import LexicalMatch
+from .row_ranges import RowRanges
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class VectorMatch:
+    id: str
+    distance: float
+    metadata: dict[str, str]
+
+
+def fuse_matches(vector_matches: list[VectorMatch], lexical_matches: list[LexicalMatch],
+                 n_results: int, rrf_k: int = 60) -> list[VectorMatch]:
+    """Best `n_results` chunks by reciprocal rank fusion of vector and lexical matches.
+
+    Chunks found only by lexical retrieval have NaN distance. Lexical scores are added
+    to the metadata of lexical matches as `lexical_score`."""
+    scores: dict[str, float] = {}
+    matches: dict[str, VectorMatch] = {}
+    for rank, match in enumerate(vector_matches):
+        scores[match.id] = 1 / (rrf_k + rank + 1)
+        matches[match.id] = match
+    for rank, match in enumerate(lexical_matches):
+        scores[match.id] = scores.get(match.id, 0.0) + 1 / (rrf_k + rank + 1)
+        fused = matches.setdefault(match.id, VectorMatch(id=match.id, distance=math.nan, metadata=match.metadata))
+        fused.metadata["lexical_score"] = f"{match.score:.4f}"
+    ranked = sorted(scores, key=scores.__getitem__, reverse=True)[:n_results]
+    return [matches[chunk_id] for chunk_id in ranked]
+
+
+class VectorStore(ABC):
+    """Common abstraction for the similarity search over the embeddings of the AI context dataset.
+
+    Filters are given in the Chroma `where` syntax, restricted to what the AI engine uses:
+    an empty filter, `{"course_key": ...}` and `{"$and": [{"course_key": ...}, {"activity_key": ...}]}`.
+    Distances are inner product distances (`1 - dot(a, b)`), as in a Chroma collection with `ip` space.
+
+    Concrete implementations:
+        - ChromaVectorStore: HNSW index in Chroma, in-memory or opened from a prebuilt index.
+        - NumpyVectorStore: exact search over a contiguous float32 matrix.
+    """
+
+    @abstractmethod
+    def query(self, query_embedding: list[float], where: dict, n_results: int) -> list[VectorMatch]:
+        pass
+
+    @abstractmethod
+    def get_embeddings(self, ids: list[str]) -> np.ndarray:
+        """Embeddings of the chunks, as rows of a float32 matrix in the order of `ids`."""
+        pass
+
+    @staticmethod
+    def create(kind: str, ctx_data: ContextDataset, embedding_model: str, embedding_size: int) -> 'VectorStore':
+        if kind == "chroma":
+            return ChromaVectorStore(ctx_data, embedding_model, embedding_size)
+        elif kind == "numpy":
+            return NumpyVectorStore(ctx_data, embedding_model, embedding_size)
+        else:
+            raise ValueError(f"Unsupported vector store: {kind}")
+
+
+class ChromaVectorStore(VectorStore):
+
+    def __init__(self, ctx_data: ContextDataset, embedding_model: str, embedding_size: int):
+        import chromadb
+        from chromadb.config import Settings
+
+        self._chromadb = chromadb
+        self._settings = Settings(anonymized_telemetry=False)
+        self.collection_name = f"{embedding_model}-{embedding_size}"
+        self.collection = self._open_prebuilt(ctx_data, embedding_model, embedding_size)
+        if self.collection is None:
+            self.collection = self._build_in_memory(ctx_data, embedding_model, embedding_size)
+
+    def _open_prebuilt(self, ctx_data: ContextDataset, embedding_model: str, embedding_size: int):
+        index_dir = ctx_data.get_vector_index_dir(embedding_model, embedding_size)
+        if index_dir is None:
+            logger.debug(f"Prebuilt vector index {self.collection_name} not available")
+            return None
+        expected_version = ctx_data.get_chunk_set_hash(embedding_model, embedding_size)
+        try:
+            ch_cli = self._chromadb.PersistentClient(path=index_dir, settings=self._settings)
+            collection = ch_cli.get_collection(self.collection_name)
+        except Exception as e:
+            logger.warning(f"Failed to open prebuilt vector index in {index_dir}: {e}")
+            return None
+        version = (collection.metadata or {}).get("chunk_set_hash")
+        if expected_version is None or version != expected_version:
+            logger.warning(f"Prebuilt vector index in {index_dir} is stale, rebuilding it in memory")
+            return None
+        logger.info(f"Opened prebuilt vector index {self.collection_name} ({collection.count()} embeddings)")
+        return collection
+
+    def _build_in_memory(self, ctx_data: ContextDataset, embedding_model: str, embedding_size: int):
+        ch_cli = self._chromadb.Client(self._settings)
+        collection = ch_cli.create_collection(
+            name=self.collection_name,
+            metadata={"hnsw:space": "ip"})
+
+        logger.debug(f"Loading embeddings {self.collection_name}")
+        embeddings, ids, metadata = ctx_data.get_embeddings_data(embedding_model, embedding_size)
+
+        max_batch_size = ch_cli.get_max_batch_size()
+        total_size = len(embeddings)
+        logger.debug(f"Indexing embeddings {self.collection_name} in batches of {max_batch_size}")
+        for start_idx in range(0, total_size, max_batch_size):
+            end_idx = min(start_idx + max_batch_size, total_size)
+
+            batch_embeddings = embeddings[start_idx:end_idx]
+            batch_ids = ids[start_idx:end_idx]
+            batch_metadata = metadata[start_idx:end_idx]
+
+            logger.debug(f"Finished loading embeddings in batch ({start_idx}-{end_idx})")
+            collection.add(
+                embeddings=batch_embeddings,
+                ids=batch_ids,
+                metadatas=batch_metadata
+            )
+
+        logger.debug(f"Embeddings loaded and indexed {self.collection_name}")
+        return collection
+
+    def query(self, query_embedding: list[float], where: dict, n_results: int) -> list[VectorMatch]:
+        result = self.collection.query(
+            query_embeddings=[query_embedding],
+            where=where or None,
+            n_results=n_results
+        )
+        return [VectorMatch(id=chunk_hash, distance=dist, metadata=metadata)
+                for chunk_hash, dist, metadata
+                in zip(result["ids"][0], result["distances"][0], result["metadatas"][0])]
+
+    def get_embeddings(self, ids: list[str]) -> np.ndarray:
+        result = self.collection.get(ids=ids, include=["embeddings"])
+        rows = dict(zip(result["ids"], result["embeddings"]))
+        return np.asarray([rows[chunk_id] for chunk_id in ids], dtype=np.float32)
+
+
+class NumpyVectorStore(VectorStore):
+    """Exact inner product search over all embeddings.
+
+    Rows are kept ordered by (course_key, activity_key), so every filter used by the
+    AI engine maps to a precomputed contiguous row range and is searched without copying.
+    The embedding matrix is memory-mapped when the dataset allows it, so worker processes
+    on the same node share it through the OS page cache.
+    """
+
+    SCORE_BLOCK_ROWS = 4096
+
+    matrix: np.ndarray
+    ids: list[str]
+    metadatas: list[dict[str, str]]
+    row_ranges: RowRanges
+    rows: dict[str, int]
+
+    def __init__(self, ctx_data: ContextDataset, embedding_model: str, embedding_size: int):
+        logger.debug(f"Loading embeddings {embedding_model}-{embedding_size}")
+        embeddings, ids, metadatas = ctx_data.get_embeddings_data(embedding_model, embedding_size, mmap=True)
+        matrix = embeddings if isinstance(embeddings, np.ndarray) else np.asarray(embeddings, dtype=np.float32)
+        order = sorted(range(len(ids)),
+                       key=lambda i: (metadatas[i]["course_key"], metadatas[i]["activity_key"]))
+        if order != list(range(len(ids))):
+            # datasets in the legacy JSON format are not ordered by course and activity
+            matrix = matrix[order]
+            ids = [ids[i] for i in order]
+            metadatas = [metadatas[i] for i in order]
+        self.matrix = matrix
+        self.ids = ids
+        self.metadatas = metadatas
+        self.row_ranges = RowRanges(metadatas)
+        self.rows = {chunk_id: row for row, chunk_id in enumerate(ids)}
+        logger.debug(f"Embeddings loaded {embedding_model}-{embedding_size}: {self.matrix.shape}")
+
+    def _scores(self, candidates: np.ndarray, query: np.ndarray) -> np.ndarray:
+        if candidates.dtype == np.float32:
+            return candidates @ query
+        # convert float16 rows block by block, so the shared matrix is never copied as a whole
+        scores = np.empty(len(candidates), dtype=np.float32)
+        for start in range(0, len(candidates), self.SCORE_BLOCK_ROWS):
+            block = candidates[start:start + self.SCORE_BLOCK_ROWS]
+            scores[start:start + len(block)] = block.astype(np.float32) @ query
+        return scores
+
+    def query(self, query_embedding: list[float], where: dict, n_results: int) -> list[VectorMatch]:
+        rows = self.row_ranges.rows_for_filter(where)
+        candidates = self.matrix[rows]
+        n_results = min(n_results, len(candidates))
+        if n_results <= 0:
+            return []
+        scores = self._scores(candidates, np.asarray(query_embedding, dtype=np.float32))
+        top = np.argpartition(-scores, n_results - 1)[:n_results]
+        top = top[np.argsort(-scores[top])]
+        return [VectorMatch(id=self.ids[rows.start + i], distance=float(1.0 - scores[i]),
+                            metadata=dict(self.metadatas[rows.start + i]))
+                for i in top]
+
+    def get_embeddings(self, ids: list[str]) -> np.ndarray:
+        return self.matrix[[self.rows[chunk_id] for chunk_id in ids]].astype(np.float32)
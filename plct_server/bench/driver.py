@@ -0,0 +1,131 @@
+"""Sending requests to the chat and RAG endpoints and measuring their latency."""
+
+import os
+import socket
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Iterator, NamedTuple
+
+import httpx
+import uvicorn
+from fastapi import FastAPI
+
+from ..content import server
+from ..endpoints import get_metrics_router, get_rag_router, get_ui_router
+from ..endpoints.ui_api import METADATA_SEPARATOR
+
+CHAT_PATH = "/api/chat"
+RAG_PATH = "/api/rag-system-message"
+
+class Sample(NamedTuple):
+    start: float  # perf_counter() when the request was sent
+    ttft: float | None  # seconds to the first byte of the answer
+    total: float  # seconds to the end of the response
+    error: str | None  # None if the request succeeded
+    request_id: str | None  # X-Request-ID of the response
+
+async def send_chat(client: httpx.AsyncClient, payload: dict) -> Sample:
+    """Send a chat request and read the streamed answer.
+
+    The time to first token is measured to the first byte of the answer, so with
+    leading metadata the metadata line is skipped."""
+    start = time.perf_counter()
+    ttft = None
+    try:
+        async with client.stream("POST", CHAT_PATH, json=payload) as response:
+            leading_metadata = not payload.get("trailingMetadata")
+            received = b""
+            async for chunk in response.aiter_bytes():
+                received += chunk
+                if ttft is None:
+                    answer_start = received.find(b"\n") + 1 if leading_metadata else 0
+                    if (not leading_metadata or answer_start) and len(received) > answer_start:
+                        ttft = time.perf_counter() - start
+            total = time.perf_counter() - start
+            request_id = response.headers.get("X-Request-ID")
+            if response.status_code != 200:
+                return Sample(start, ttft, total, f"HTTP {response.status_code}", request_id)
+            # responses of failed answers are plain messages without the metadata
+            if request_id is None or (not leading_metadata and METADATA_SEPARATOR not in received):
+                return Sample(start, ttft, total, "answer error", request_id)
+            return Sample(start, ttft, total, None, request_id)
+    except httpx.HTTPError as e:
+        return Sample(start, ttft, time.perf_counter() - start, type(e).__name__, None)
+
+async def send_rag(client: httpx.AsyncClient, payload: dict) -> Sample:
+    """Send a RAG system message request; its time to first token is its total latency."""
+    start = time.perf_counter()
+    try:
+        response = await client.post(RAG_PATH, json=payload)
+        total = time.perf_counter() - start
+        request_id = response.headers.get("X-Request-ID")
+        if response.status_code != 200:
+            return Sample(start, None, total, f"HTTP {response.status_code}", request_id)
+        if not response.json().get("message"):
+            return Sample(start, None, total, "empty message", request_id)
+        return Sample(start, total, total, None, request_id)
+    except (httpx.HTTPError, ValueError) as e:
+        return Sample(start, None, time.perf_counter() - start, type(e).__name__, None)
+
+class ServerThread(threading.Thread):
+    """Serves an app with uvicorn in a background thread, on a free local port."""
+
+    def __init__(self, app: FastAPI, host: str = "127.0.0.1"):
+        super().__init__(daemon=True)
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.socket.bind((host, 0))
+        self.url = f"http://{host}:{self.socket.getsockname()[1]}"
+        self.server = uvicorn.Server(uvicorn.Config(app, log_level="warning", access_log=False))
+
+    def run(self) -> None:
+        self.server.run(sockets=[self.socket])
+
+    def __enter__(self) -> "ServerThread":
+        self.start()
+        deadline = time.monotonic() + 30
+        while not self.server.started:
+            if not self.is_alive() or time.monotonic() > deadline:
+                raise RuntimeError(f"Server at {self.url} didn't start")
+            time.sleep(0.05)
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.server.should_exit = True
+        self.join()
+        self.socket.close()
+
+@contextmanager
+def local_server(config_file: str = None, ai_ctx_url: str = None,
+                 provider_url: str = None) -> Iterator[tuple[str, str]]:
+    """Configure the server and serve the chat, RAG and metrics endpoints in a background thread.
+    With `provider_url`, the OpenAI and vLLM providers point to it (e.g. to a mock server).
+    Yields the URL of the server and the API key of the RAG endpoints."""
+    conf = server.load_config(config_file=config_file, ai_ctx_url=ai_ctx_url)
+    # the provider keys are set for the lifetime of the server and restored afterwards
+    key_names = [server.ENV_NAME_OPENAI_API_KEY, server.ENV_NAME_AZURE_API_KEY]
+    saved_keys = {name: os.environ.get(name) for name in key_names}
+    try:
+        if provider_url:
+            conf.openai_url = conf.vllm_url = provider_url
+            os.environ[server.ENV_NAME_OPENAI_API_KEY] = "mock"
+            os.environ.pop(server.ENV_NAME_AZURE_API_KEY, None)
+        conf.api_key = conf.api_key or uuid.uuid4().hex
+        server.init_server_content(conf)
+        server.init_ai_engine(conf)
+        server.init_trace_log(conf)
+        server.init_session_store(conf)
+
+        app = FastAPI(lifespan=server.lifespan)
+        app.include_router(get_ui_router())
+        app.include_router(get_rag_router())
+        app.include_router(get_metrics_router())
+        with ServerThread(app) as plct_server:
+            yield plct_server.url, conf.api_key
+    finally:
+        for name, value in saved_keys.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
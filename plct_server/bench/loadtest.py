@@ -0,0 +1,168 @@
+"""Replay of recorded requests against a server.
+
+Requests are read from a JSON lines file. A line is either a record of the
+request trace log written with `trace_log_payloads: true`, an object with
+`endpoint`, `payload` and optional `start` (Unix timestamp) keys, or a bare
+`ChatInput` / `RagSystemMessageRequest` payload.
+"""
+
+import asyncio
+import json
+import logging
+import re
+import time
+from datetime import datetime, timezone
+from typing import NamedTuple
+
+import httpx
+from pydantic import BaseModel
+
+from .driver import Sample, send_chat, send_rag
+from .stats import LatencySummary, summarize
+
+logger = logging.getLogger(__name__)
+
+ENDPOINT_NAMES = {"chat": "chat", "rag": "rag", "rag_system_message": "rag"}
+
+class ReplayRequest(NamedTuple):
+    start: float | None  # Unix timestamp of the original request
+    endpoint: str  # "chat" or "rag"
+    payload: dict
+
+class EndpointResult(BaseModel):
+    endpoint: str
+    requests: int
+    errors: dict[str, int]
+    error_rate: float
+    ttft: LatencySummary | None
+    total: LatencySummary | None
+
+class StageTiming(BaseModel):
+    """Server-side duration of a stage, from the difference of the server's metrics."""
+    count: int
+    mean: float  # seconds
+
+class LoadTestReport(BaseModel):
+    started: str
+    url: str
+    requests: int
+    duration: float  # seconds
+    speed: float | None
+    rate: float | None
+    max_lag: float  # seconds the latest request was sent behind its schedule
+    endpoints: list[EndpointResult]
+    stages: dict[str, StageTiming]
+
+def read_requests(path: str, limit: int = None) -> list[ReplayRequest]:
+    requests = []
+    with open(path, "r", encoding="utf-8") as file:
+        for line_number, line in enumerate(file, 1):
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            if "payload" in record:
+                endpoint, payload, start = record.get("endpoint"), record["payload"], record.get("start")
+            else:
+                endpoint = "chat" if "question" in record else "rag" if "query" in record else None
+                payload, start = record, None
+            if endpoint not in ENDPOINT_NAMES:
+                raise ValueError(f"{path}:{line_number}: unknown endpoint of the request")
+            requests.append(ReplayRequest(start, ENDPOINT_NAMES[endpoint], payload))
+            if limit and len(requests) >= limit:
+                break
+    return requests
+
+def schedule(requests: list[ReplayRequest], speed: float = 1.0, rate: float = None) -> list[float]:
+    """Seconds from the start of the replay at which the requests are sent: at a fixed `rate`
+    (requests per second), or with the original inter-arrival times divided by `speed`."""
+    if rate:
+        return [i / rate for i in range(len(requests))]
+    if any(request.start is None for request in requests):
+        raise ValueError("Requests without timestamps can only be replayed at a fixed rate")
+    first = min((request.start for request in requests), default=0.0)
+    return [(request.start - first) / speed for request in requests]
+
+_STAGE_METRIC = re.compile(r'^plct_stage_seconds_(sum|count)\{stage="([^"]*)"\} (\S+)$')
+
+def parse_stage_metrics(text: str) -> dict[str, tuple[float, float]]:
+    """Stage name -> (sum, count) of the plct_stage_seconds histogram."""
+    stages: dict[str, list[float]] = {}
+    for line in text.splitlines():
+        match = _STAGE_METRIC.match(line)
+        if match:
+            kind, stage, value = match.groups()
+            stages.setdefault(stage, [0.0, 0.0])[0 if kind == "sum" else 1] = float(value)
+    return {stage: (total, count) for stage, (total, count) in stages.items()}
+
+async def _scrape_stages(client: httpx.AsyncClient) -> dict[str, tuple[float, float]]:
+    try:
+        response = await client.get("/metrics")
+        response.raise_for_status()
+        return parse_stage_metrics(response.text)
+    except httpx.HTTPError as e:
+        logger.warning(f"Server metrics are not available: {e}")
+        return {}
+
+def stage_timings(before: dict[str, tuple[float, float]],
+                  after: dict[str, tuple[float, float]]) -> dict[str, StageTiming]:
+    timings = {}
+    for stage, (total, count) in sorted(after.items()):
+        total_before, count_before = before.get(stage, (0.0, 0.0))
+        if count > count_before:
+            timings[stage] = StageTiming(count=int(count - count_before),
+                                         mean=(total - total_before) / (count - count_before))
+    return timings
+
+def endpoint_result(endpoint: str, samples: list[Sample]) -> EndpointResult:
+    errors: dict[str, int] = {}
+    for sample in samples:
+        if sample.error is not None:
+            errors[sample.error] = errors.get(sample.error, 0) + 1
+    succeeded = [sample for sample in samples if sample.error is None]
+    return EndpointResult(
+        endpoint=endpoint,
+        requests=len(samples),
+        errors=errors,
+        error_rate=sum(errors.values()) / len(samples) if samples else 0.0,
+        ttft=summarize([sample.ttft for sample in succeeded if sample.ttft is not None]),
+        total=summarize([sample.total for sample in succeeded]))
+
+async def run_loadtest(url: str, api_key: str | None, requests: list[ReplayRequest],
+                       speed: float = 1.0, rate: float = None, timeout: float = 120) -> LoadTestReport:
+    started = datetime.now(timezone.utc).isoformat()
+    offsets = schedule(requests, speed, rate)
+    headers = {"X-Auth-Key": api_key} if api_key else {}
+    # connections are not limited, so that requests are sent on schedule
+    limits = httpx.Limits(max_connections=None, max_keepalive_connections=100)
+    async with httpx.AsyncClient(base_url=url, headers=headers, limits=limits, timeout=timeout) as client:
+        stages_before = await _scrape_stages(client)
+        samples: dict[str, list[Sample]] = {}
+        max_lag = 0.0
+
+        async def send(request: ReplayRequest) -> None:
+            send_request = send_chat if request.endpoint == "chat" else send_rag
+            samples.setdefault(request.endpoint, []).append(await send_request(client, request.payload))
+
+        start = time.perf_counter()
+        tasks = []
+        for request, offset in sorted(zip(requests, offsets), key=lambda item: item[1]):
+            delay = start + offset - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            else:
+                max_lag = max(max_lag, -delay)
+            tasks.append(asyncio.create_task(send(request)))
+        await asyncio.gather(*tasks)
+        duration = time.perf_counter() - start
+        stages = stage_timings(stages_before, await _scrape_stages(client))
+
+    return LoadTestReport(
+        started=started,
+        url=url,
+        requests=len(requests),
+        duration=duration,
+        speed=None if rate else speed,
+        rate=rate,
+        max_lag=max_lag,
+        endpoints=[endpoint_result(endpoint, endpoint_samples) for endpoint, endpoint_samples in samples.items()],
+        stages=stages)
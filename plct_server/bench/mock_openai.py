@@ -0,0 +1,129 @@
+"""OpenAI-compatible stand-in for benchmarks.
+
+Serves the endpoints used by the AI engine (models, embeddings and chat
+completions, including the query classification tool call) with configurable
+latency, token rate, streaming chunk sizes and injected errors, so the server
+can be benchmarked offline.
+"""
+
+import asyncio
+import hashlib
+import json
+import random
+import time
+import uuid
+
+import numpy as np
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+from pydantic import BaseModel
+
+class MockOptions(BaseModel):
+    latency: float = 0.3  # seconds before the first token of a completion (or a non-streamed completion)
+    classification_latency: float = 0.3  # seconds to answer a query classification
+    embedding_latency: float = 0.05  # seconds to answer an embedding request
+    tokens_per_second: float = 50.0  # token rate of streamed answers, unlimited if 0
+    chunk_tokens: int = 1  # tokens per streamed chunk
+    answer_tokens: int = 200  # tokens of an answer
+    error_rate: float = 0.0  # fraction of requests that fail
+    error_status: int = 500  # HTTP status of failed requests
+    models: list[str] = []  # models listed at /v1/models, e.g. vLLM models to benchmark
+    context_size: int = 32_768  # max_model_len of the listed models
+    seed: int | None = None  # seed of the error injection
+
+ANSWER_WORDS = ["lorem", "ipsum", "dolor", "sit", "amet", "consectetur", "adipiscing", "elit"]
+
+def mock_embedding(text: str, dimensions: int) -> list[float]:
+    """Deterministic unit vector for a text."""
+    seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "little")
+    vector = np.random.default_rng(seed).standard_normal(dimensions, dtype=np.float32)
+    return (vector / np.linalg.norm(vector)).tolist()
+
+def create_mock_app(options: MockOptions) -> FastAPI:
+    app = FastAPI()
+    rng = random.Random(options.seed)
+    app.state.requests = {"embeddings": 0, "classifications": 0, "completions": 0, "errors": 0}
+
+    def failed() -> JSONResponse | None:
+        if options.error_rate and rng.random() < options.error_rate:
+            app.state.requests["errors"] += 1
+            return JSONResponse({"error": {"message": "Injected error", "type": "server_error"}},
+                                status_code=options.error_status)
+        return None
+
+    @app.get("/v1/models")
+    async def list_models():
+        return {"object": "list",
+                "data": [{"id": name, "object": "model", "created": 0, "owned_by": "mock",
+                          "max_model_len": options.context_size} for name in options.models]}
+
+    @app.post("/v1/embeddings")
+    async def create_embedding(request: Request):
+        body = await request.json()
+        app.state.requests["embeddings"] += 1
+        await asyncio.sleep(options.embedding_latency)
+        if error := failed():
+            return error
+        inputs = body["input"] if isinstance(body["input"], list) else [body["input"]]
+        dimensions = body.get("dimensions") or 1536
+        return {"object": "list", "model": body["model"],
+                "data": [{"object": "embedding", "index": i, "embedding": mock_embedding(text, dimensions)}
+                         for i, text in enumerate(inputs)],
+                "usage": {"prompt_tokens": 0, "total_tokens": 0}}
+
+    @app.post("/v1/chat/completions")
+    async def create_completion(request: Request):
+        body = await request.json()
+        base = {"id": f"chatcmpl-{uuid.uuid4().hex}", "created": int(time.time()), "model": body["model"]}
+        if body.get("tools"):
+            app.state.requests["classifications"] += 1
+            await asyncio.sleep(options.classification_latency)
+            if error := failed():
+                return error
+            question = body["messages"][-1]["content"]
+            arguments = {
+                "restated_question": question,
+                "classify_query": "current_lecture",
+                "classify_language": "en",
+                "possible_conversation_continuation": {
+                    "continuation_1": "Can you give an example?",
+                    "continuation_2": "How is this used in practice?"
+                }
+            }
+            tool_call = {"id": "call_0", "type": "function",
+                         "function": {"name": body["tools"][0]["function"]["name"],
+                                      "arguments": json.dumps(arguments)}}
+            return {**base, "object": "chat.completion",
+                    "choices": [{"index": 0, "finish_reason": "tool_calls",
+                                 "message": {"role": "assistant", "content": None, "tool_calls": [tool_call]}}],
+                    "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0}}
+
+        app.state.requests["completions"] += 1
+        await asyncio.sleep(options.latency)
+        if error := failed():
+            return error
+        words = [ANSWER_WORDS[i % len(ANSWER_WORDS)] + " " for i in range(options.answer_tokens)]
+        if not body.get("stream"):
+            return {**base, "object": "chat.completion",
+                    "choices": [{"index": 0, "finish_reason": "stop",
+                                 "message": {"role": "assistant", "content": "".join(words)}}],
+                    "usage": {"prompt_tokens": 0, "completion_tokens": len(words), "total_tokens": len(words)}}
+
+        async def stream():
+            chunk_tokens = max(options.chunk_tokens, 1)
+            delay = chunk_tokens / options.tokens_per_second if options.tokens_per_second else 0
+            for start in range(0, len(words), chunk_tokens):
+                if start and delay:
+                    await asyncio.sleep(delay)
+                chunk = {**base, "object": "chat.completion.chunk",
+                         "choices": [{"index": 0, "finish_reason": None,
+                                      "delta": {"content": "".join(words[start:start + chunk_tokens])}}]}
+                yield f"data: {json.dumps(chunk)}\n\n"
+            chunk = {**base, "object": "chat.completion.chunk",
+                     "choices": [{"index": 0, "finish_reason": "stop", "delta": {}}]}
+            yield f"data: {json.dumps(chunk)}\n\n"
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(stream(), media_type="text/event-stream")
+
+    return app
@@ -0,0 +1,21 @@
+from typing import Sequence
+
+import numpy as np
+from pydantic import BaseModel
+
+class LatencySummary(BaseModel):
+    """Latency statistics in seconds."""
+    count: int
+    mean: float
+    p50: float
+    p95: float
+    p99: float
+    max: float
+
+def summarize(values: Sequence[float]) -> LatencySummary | None:
+    if not values:
+        return None
+    array = np.asarray(values, dtype=np.float64)
+    p50, p95, p99 = np.percentile(array, [50, 95, 99])
+    return LatencySummary(count=len(array), mean=float(array.mean()), p50=float(p50),
+                          p95=float(p95), p99=float(p99), max=float(array.max()))
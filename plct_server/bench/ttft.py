@@ -0,0 +1,164 @@
+"""Time-to-first-token benchmark of the chat and RAG endpoints.
+
+The server runs in-process against the OpenAI-compatible stand-in from
+`mock_openai`, so the benchmark measures the overhead of the server itself
+(classification, embedding, retrieval, prompt assembly and streaming) under
+concurrency, without a live AI provider.
+"""
+
+import asyncio
+import itertools
+import logging
+import time
+import uuid
+from datetime import datetime, timezone
+from typing import Awaitable, Callable, Iterator
+
+import httpx
+from pydantic import BaseModel
+
+from ..ai import engine
+from ..ai.model_conf import MODEL_CONFIGS_LIST, ModelProvider
+from .driver import Sample, ServerThread, local_server, send_chat, send_rag
+from .mock_openai import MockOptions, create_mock_app
+from .stats import LatencySummary, summarize
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_QUESTIONS = [
+    "What is a variable?",
+    "How does a for loop work?",
+    "Can you explain this example?",
+    "What is the difference between a list and a tuple?",
+    "Why do we use functions?",
+    "How can I read input from the user?",
+    "What does this lesson cover?",
+    "Give me an exercise for practice."
+]
+
+class BenchmarkOptions(BaseModel):
+    endpoints: list[str] = ["chat", "rag"]
+    concurrency: list[int] = [1, 4, 16]
+    requests: int = 50  # measured requests per endpoint and concurrency level
+    warmup: int = 2  # requests per endpoint that are not measured
+    model: str = ""  # chat model, the default model if empty
+    history_turns: int = 0  # question/answer pairs of history sent with each question
+    unique_questions: bool = True  # make every question unique, so caches and coalescing don't apply
+    questions: list[str] = DEFAULT_QUESTIONS
+    course_key: str | None = None  # course and activity of the questions; all activities are used if None
+    activity_key: str | None = None
+
+class LevelResult(BaseModel):
+    endpoint: str
+    concurrency: int
+    requests: int
+    errors: dict[str, int]
+    duration: float  # seconds
+    throughput: float  # successful requests per second
+    ttft: LatencySummary | None
+    total: LatencySummary | None
+
+class BenchmarkReport(BaseModel):
+    started: str
+    mock: MockOptions
+    options: BenchmarkOptions
+    results: list[LevelResult]
+
+def level_result(endpoint: str, concurrency: int, samples: list[Sample], duration: float) -> LevelResult:
+    errors: dict[str, int] = {}
+    for sample in samples:
+        if sample.error is not None:
+            errors[sample.error] = errors.get(sample.error, 0) + 1
+    succeeded = [sample for sample in samples if sample.error is None]
+    return LevelResult(
+        endpoint=endpoint,
+        concurrency=concurrency,
+        requests=len(samples),
+        errors=errors,
+        duration=duration,
+        throughput=len(succeeded) / duration if duration else 0.0,
+        ttft=summarize([sample.ttft for sample in succeeded if sample.ttft is not None]),
+        total=summarize([sample.total for sample in succeeded]))
+
+def _activities(options: BenchmarkOptions) -> list[tuple[str, str]]:
+    if options.course_key and options.activity_key:
+        return [(options.course_key, options.activity_key)]
+    ctx_data = engine.get_ai_engine().ctx_data
+    activities = [(course_key, activity_key)
+                  for course_key, course in ctx_data.course_dict.items()
+                  if options.course_key in (None, course_key)
+                  for activity_key in course.activities]
+    if not activities:
+        raise ValueError("There are no activities in the AI context to ask questions about")
+    return activities
+
+def _payloads(endpoint: str, options: BenchmarkOptions) -> Iterator[dict]:
+    history = [(f"Question {i}?", f"Answer {i}.") for i in range(options.history_turns)]
+    activities = itertools.cycle(_activities(options))
+    questions = itertools.cycle(options.questions)
+    while True:
+        question = next(questions)
+        if options.unique_questions:
+            question = f"{question} ({uuid.uuid4().hex[:8]})"
+        course_key, activity_key = next(activities)
+        if endpoint == "chat":
+            yield {
+                "question": question,
+                "history": [{"q": q, "a": a} for q, a in history],
+                "contextAttributes": {"course_key": course_key, "activity_key": activity_key},
+                "model": options.model,
+                "trailingMetadata": True,
+                "bypassCache": options.unique_questions
+            }
+        else:
+            yield {"query": question, "history": history, "course_key": course_key, "activity_key": activity_key}
+
+async def run_level(send: Callable[[dict], Awaitable[Sample]], payloads: Iterator[dict],
+                    requests: int, concurrency: int) -> tuple[list[Sample], float]:
+    """Send `requests` requests, `concurrency` at a time. Returns the samples and the duration."""
+    samples: list[Sample] = []
+    remaining = iter(range(requests))
+
+    async def worker() -> None:
+        for _ in remaining:
+            samples.append(await send(next(payloads)))
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return samples, time.perf_counter() - start
+
+async def _run(url: str, api_key: str, options: BenchmarkOptions) -> list[LevelResult]:
+    results = []
+    limits = httpx.Limits(max_connections=max(options.concurrency), max_keepalive_connections=max(options.concurrency))
+    async with httpx.AsyncClient(base_url=url, headers={"X-Auth-Key": api_key},
+                                 limits=limits, timeout=120) as client:
+        for endpoint in options.endpoints:
+            send = {"chat": send_chat, "rag": send_rag}[endpoint]
+            payloads = _payloads(endpoint, options)
+            send_payload = lambda payload, send=send: send(client, payload)
+            await run_level(send_payload, payloads, options.warmup, 1)
+            for concurrency in options.concurrency:
+                samples, duration = await run_level(send_payload, payloads, options.requests, concurrency)
+                result = level_result(endpoint, concurrency, samples, duration)
+                logger.info(f"{endpoint} x{concurrency}: {result.throughput:.1f} req/s, "
+                            f"{sum(result.errors.values())} errors")
+                results.append(result)
+    return results
+
+def _served_model(model: str) -> bool:
+    """True if the model is served by the default provider rather than by vLLM."""
+    return any(m.name == model and m.provider != ModelProvider.VLLM for m in MODEL_CONFIGS_LIST)
+
+def run_benchmark(mock_options: MockOptions, options: BenchmarkOptions,
+                  config_file: str = None, ai_ctx_url: str = None) -> BenchmarkReport:
+    """Run the benchmark with the server configured by `config_file` and/or `ai_ctx_url`.
+    The default provider and the vLLM provider both point to the mock server."""
+    started = datetime.now(timezone.utc).isoformat()
+    if options.model and not _served_model(options.model) and options.model not in mock_options.models:
+        mock_options = mock_options.model_copy(update={"models": [*mock_options.models, options.model]})
+
+    with ServerThread(create_mock_app(mock_options)) as mock, \
+            local_server(config_file, ai_ctx_url, provider_url=f"{mock.url}/v1") as (url, api_key):
+        results = asyncio.run(_run(url, api_key, options))
+
+    return BenchmarkReport(started=started, mock=mock_options, options=options, results=results)
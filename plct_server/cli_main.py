@@ -6,8 +6,10 @@ from logging import getLogger
 from fastapi import FastAPI
 from uuid import uuid4
 from .eval.batch_review import batch_prompt_conversations, generate_html_report, CONVERSATION_DIR
-from .endpoints import get_ui_router, get_rag_router
+from .endpoints import get_ui_router, get_rag_router, get_metrics_router
 from .content import server
+from .ai import engine
+from .ioutils import write_str
 
 logger = getLogger(__name__)
 
@@ -33,8 +35,9 @@ def serve(folders: tuple[str], config : str, host: str, port: int, verbose:bool,
         course_urls=folders, config_file=config, verbose=verbose, 
         ai_ctx_url=ai_context, azure_default_ai_endpoint=azure_ai_endpoint)
     
-    app = FastAPI()
+    app = FastAPI(lifespan=server.lifespan)
     app.include_router(get_ui_router())
+    app.include_router(get_metrics_router())
 
     uvicorn.run(app, host=host, port=port) 
 
@@ -59,12 +62,136 @@ async def batch_review_async(ai_context:str, batch_name:str, set_benchmark: bool
         ai_ctx_url = ai_context,
         verbose =  verbose)
       
-    logger.info("Starting batch review of conversations")
-    await batch_prompt_conversations(conversation_dir = conversation_dir, batch_name=batch_name, set_benchmark=set_benchmark, model = model)
+    try:
+        logger.info("Starting batch review of conversations")
+        await batch_prompt_conversations(conversation_dir = conversation_dir, batch_name=batch_name, set_benchmark=set_benchmark, model = model)
 
-    if not (set_benchmark or no_report):
-        logger.info("Generating HTML report")
-        await generate_html_report(batch_name, compare_with_ai)
+        if not (set_benchmark or no_report):
+            logger.info("Generating HTML report")
+            await generate_html_report(batch_name, compare_with_ai)
+    finally:
+        await engine.shutdown()
+
+@click.command()
+@click.option("-c", "--config", help="Configuration file")
+@click.option("-a", "--ai-context", help="Folder with AI context")
+@click.option("-e", "--endpoint", "endpoints", multiple=True, type=click.Choice(["chat", "rag"]),
+              default=["chat", "rag"], help="Endpoint to benchmark (can be repeated)")
+@click.option("-n", "--requests", default=50, help="Requests per endpoint and concurrency level")
+@click.option("-j", "--concurrency", default="1,4,16", help="Comma separated concurrency levels")
+@click.option("-m", "--model", default="", help="Chat model (the default model if not given)")
+@click.option("--history-turns", default=0, help="Question/answer pairs of history sent with each question")
+@click.option("--latency", default=0.3, help="Mock server: seconds to the first token of a completion")
+@click.option("--classification-latency", default=0.3, help="Mock server: seconds to classify a query")
+@click.option("--embedding-latency", default=0.05, help="Mock server: seconds to create an embedding")
+@click.option("--token-rate", default=50.0, help="Mock server: tokens per second of streamed answers")
+@click.option("--chunk-tokens", default=1, help="Mock server: tokens per streamed chunk")
+@click.option("--answer-tokens", default=200, help="Mock server: tokens of an answer")
+@click.option("--error-rate", default=0.0, help="Mock server: fraction of failed requests")
+@click.option("-o", "--output", type=click.Path(dir_okay=False), help="Write the results to a JSON file")
+@click.option("-v", "--verbose", is_flag=True, help="Enable verbose logging")
+def benchmark(config: str, ai_context: str, endpoints: tuple[str], requests: int, concurrency: str, model: str,
+              history_turns: int, latency: float, classification_latency: float, embedding_latency: float,
+              token_rate: float, chunk_tokens: int, answer_tokens: int, error_rate: float,
+              output: str, verbose: bool) -> None:
+    """Benchmark time to first token of the chat and RAG endpoints against a mock OpenAI server."""
+    from rich.console import Console
+    from rich.table import Table
+    from .bench.mock_openai import MockOptions
+    from .bench.ttft import BenchmarkOptions, run_benchmark
+
+    logging.getLogger().setLevel(logging.DEBUG if verbose else logging.INFO)
+    for name in ("plct_server.ai", "httpx"):
+        logging.getLogger(name).setLevel(logging.DEBUG if verbose else logging.WARNING)
+    mock_options = MockOptions(
+        latency=latency, classification_latency=classification_latency, embedding_latency=embedding_latency,
+        tokens_per_second=token_rate, chunk_tokens=chunk_tokens, answer_tokens=answer_tokens,
+        error_rate=error_rate)
+    options = BenchmarkOptions(
+        endpoints=list(endpoints), requests=requests, model=model, history_turns=history_turns,
+        concurrency=[int(c) for c in concurrency.split(",")])
+    report = run_benchmark(mock_options, options, config_file=config, ai_ctx_url=ai_context)
+
+    table = Table("Endpoint", "Concurrency", "Req/s", "Errors", "TTFT p50", "TTFT p95", "TTFT p99",
+                  "Total p50", "Total p95", "Total p99")
+    for result in report.results:
+        ttft, total = result.ttft, result.total
+        table.add_row(result.endpoint, str(result.concurrency), f"{result.throughput:.1f}",
+                      str(sum(result.errors.values())),
+                      *(f"{value:.3f}" if value is not None else "-" for value in (
+                          ttft and ttft.p50, ttft and ttft.p95, ttft and ttft.p99,
+                          total and total.p50, total and total.p95, total and total.p99)))
+    Console().print(table)
+    if output:
+        write_str(output, report.model_dump_json(indent=2))
+        logger.info(f"Results written to {output}")
+
+@click.command()
+@click.argument("requests_file", type=click.Path(exists=True, dir_okay=False))
+@click.option("-u", "--url", help="URL of a running server; an in-process server is started if not given")
+@click.option("-k", "--api-key", envvar="PLCT_API_KEY", help="API key of the RAG endpoints of the running server")
+@click.option("-c", "--config", help="Configuration file of the in-process server")
+@click.option("-a", "--ai-context", help="Folder with AI context of the in-process server")
+@click.option("--mock", is_flag=True, help="Use a mock OpenAI server as the AI provider of the in-process server")
+@click.option("-s", "--speed", default=1.0, help="Replay speed multiplier of the original inter-arrival times")
+@click.option("-r", "--rate", type=float, help="Send requests at a fixed rate (requests per second) instead")
+@click.option("-l", "--limit", type=int, help="Maximum number of requests to replay")
+@click.option("-o", "--output", type=click.Path(dir_okay=False), help="Write the results to a JSON file")
+@click.option("-v", "--verbose", is_flag=True, help="Enable verbose logging")
+def loadtest(requests_file: str, url: str, api_key: str, config: str, ai_context: str, mock: bool,
+             speed: float, rate: float, limit: int, output: str, verbose: bool) -> None:
+    """Replay recorded chat and RAG requests against a server.
+
+    REQUESTS_FILE: JSON lines file of requests, e.g. a request trace log with payloads."""
+    from contextlib import ExitStack
+    from rich.console import Console
+    from rich.table import Table
+    from .bench.driver import ServerThread, local_server
+    from .bench.loadtest import read_requests, run_loadtest
+    from .bench.mock_openai import MockOptions, create_mock_app
+
+    logging.getLogger().setLevel(logging.DEBUG if verbose else logging.INFO)
+    for name in ("plct_server.ai", "httpx"):
+        logging.getLogger(name).setLevel(logging.DEBUG if verbose else logging.WARNING)
+    try:
+        requests = read_requests(requests_file, limit)
+    except ValueError as e:
+        raise click.UsageError(str(e))
+    if not rate and any(request.start is None for request in requests):
+        raise click.UsageError("The requests have no timestamps, use --rate to replay them")
+
+    with ExitStack() as stack:
+        if not url:
+            provider_url = None
+            if mock:
+                provider_url = stack.enter_context(ServerThread(create_mock_app(MockOptions()))).url + "/v1"
+            url, api_key = stack.enter_context(local_server(config, ai_context, provider_url=provider_url))
+        logger.info(f"Replaying {len(requests)} requests against {url}")
+        report = asyncio.run(run_loadtest(url, api_key, requests, speed=speed, rate=rate))
+
+    console = Console()
+    table = Table("Endpoint", "Requests", "Error rate", "TTFT p50", "TTFT p95", "TTFT p99",
+                  "Total p50", "Total p95", "Total p99")
+    for result in report.endpoints:
+        ttft, total = result.ttft, result.total
+        table.add_row(result.endpoint, str(result.requests), f"{result.error_rate:.1%}",
+                      *(f"{value:.3f}" if value is not None else "-" for value in (
+                          ttft and ttft.p50, ttft and ttft.p95, ttft and ttft.p99,
+                          total and total.p50, total and total.p95, total and total.p99)))
+    console.print(table)
+    if report.stages:
+        stage_table = Table("Server stage", "Count", "Mean")
+        for stage, timing in report.stages.items():
+            stage_table.add_row(stage, str(timing.count), f"{timing.mean:.3f}")
+        console.print(stage_table)
+    for result in report.endpoints:
+        for error, count in result.errors.items():
+            logger.warning(f"{result.endpoint}: {count} x {error}")
+    if report.max_lag > 1.0:
+        logger.warning(f"Requests were sent up to {report.max_lag:.1f}s behind schedule")
+    if output:
+        write_str(output, report.model_dump_json(indent=2))
+        logger.info(f"Results written to {output}")
 
 # This is the entry point for the server (see pyproject.toml)
 def cli() -> None:
@@ -72,3 +199,9 @@ def cli() -> None:
 
 def batch_review_cli() -> None:
     batch_review()
+
+def benchmark_cli() -> None:
+    benchmark()
+
+def loadtest_cli() -> None:
+    loadtest()
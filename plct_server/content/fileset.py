@@ -14,6 +14,8 @@ from fastapi.responses import FileResponse
 import httpx
 import yaml
 
+from ..metrics import FILESET_READ_SECONDS, timed
+
 logger = logging.getLogger(__name__)
 
 
@@ -49,6 +51,14 @@ class FileSet(ABC):
     def read_bytes(self, path: str) -> bytes | None:
         pass
 
+    def read_bytes_range(self, path: str, offset: int, length: int) -> bytes | None:
+        """Read `length` bytes starting at `offset`. Implementations should override
+        this method to avoid reading the whole file."""
+        b = self.read_bytes(path)
+        if b is None:
+            return None
+        return b[offset:offset + length]
+
     @abstractmethod
     async def read_str_async(self, path: str) -> str | None:
         pass
@@ -105,6 +115,7 @@ class LocalFileSet(FileSet):
     def local_path(self, path: str) -> str:
         return (Path(self.base_dir)/Path(path)).as_posix()
     
+    @timed(FILESET_READ_SECONDS, fileset="local", operation="read_str")
     def read_str(self, path: str) -> str | None:
         lpath = self.local_path(path)
         if not os.path.isfile(lpath):
@@ -112,13 +123,24 @@ class LocalFileSet(FileSet):
         with open(lpath, encoding="utf8") as f:
             return f.read()
         
+    @timed(FILESET_READ_SECONDS, fileset="local", operation="read_bytes")
     def read_bytes(self, path: str) -> bytes | None:
         lpath = self.local_path(path)
         if not os.path.isfile(lpath):
             return None
         with open(lpath, 'rb') as f:
             return f.read()
+
+    @timed(FILESET_READ_SECONDS, fileset="local", operation="read_bytes_range")
+    def read_bytes_range(self, path: str, offset: int, length: int) -> bytes | None:
+        lpath = self.local_path(path)
+        if not os.path.isfile(lpath):
+            return None
+        with open(lpath, 'rb') as f:
+            f.seek(offset)
+            return f.read(length)
         
+    @timed(FILESET_READ_SECONDS, fileset="local", operation="read_str_async")
     async def read_str_async(self, path: str) -> str | None:
         lpath = self.local_path(path)
         if not os.path.isfile(lpath):
@@ -126,6 +148,7 @@ class LocalFileSet(FileSet):
         async with aiofiles.open(lpath, mode='r', encoding="utf8") as f:
             return await f.read()
         
+    @timed(FILESET_READ_SECONDS, fileset="local", operation="read_bytes_async")
     async def read_bytes_async(self, path: str) -> bytes | None:
         lpath = self.local_path(path)
         if not os.path.isfile(lpath):
@@ -164,6 +187,7 @@ class HttpFileSet(FileSet):
             return self.base_url
         return f"{self.base_url}/{clean_path(path)}"
 
+    @timed(FILESET_READ_SECONDS, fileset="http", operation="read_str")
     def read_str(self, path: str) -> str | None:
         url = self.full_url(path)
         response = HttpFileSet.client.get(url)
@@ -172,6 +196,7 @@ class HttpFileSet(FileSet):
         response.raise_for_status()
         return response.text
     
+    @timed(FILESET_READ_SECONDS, fileset="http", operation="read_bytes")
     def read_bytes(self, path: str) -> bytes | None:
         url = self.full_url(path)
         response = HttpFileSet.client.get(url)
@@ -180,6 +205,20 @@ class HttpFileSet(FileSet):
         response.raise_for_status()
         return response.content
 
+    @timed(FILESET_READ_SECONDS, fileset="http", operation="read_bytes_range")
+    def read_bytes_range(self, path: str, offset: int, length: int) -> bytes | None:
+        url = self.full_url(path)
+        headers = {"range": f"bytes={offset}-{offset + length - 1}"}
+        response = HttpFileSet.client.get(url, headers=headers)
+        if response.status_code == 404:
+            return None
+        response.raise_for_status()
+        if response.status_code == 206:
+            return response.content
+        # the server ignored the range header and returned the whole file
+        return response.content[offset:offset + length]
+
+    @timed(FILESET_READ_SECONDS, fileset="http", operation="read_str_async")
     async def read_str_async(self, path: str) -> str | None:
         url = self.full_url(path)
         response = await HttpFileSet.async_client.get(url)
@@ -188,6 +227,7 @@ class HttpFileSet(FileSet):
         response.raise_for_status()
         return response.text
     
+    @timed(FILESET_READ_SECONDS, fileset="http", operation="read_bytes_async")
     async def read_bytes_async(self, path: str) -> bytes | None:
         url = self.full_url(path)
         response = await HttpFileSet.async_client.get(url)
@@ -4,6 +4,8 @@ import logging
 import yaml
 
 
+from contextlib import asynccontextmanager
+from fastapi import FastAPI
 from pathlib import Path
 from pydantic import field_validator
 from pydantic_settings import BaseSettings, SettingsConfigDict
@@ -12,10 +14,12 @@ from urllib.parse import urljoin, urlparse
 from urllib.request import url2pathname
 from plct_server.ai.client import AiClientFactory
 from plct_server.ai.model_conf import ModelProvider
+from plct_server.ai.engine_options import AiEngineOptions
 from .fileset import FileSet, LocalFileSet
 from ..ioutils import  read_str
 from .course import CourseContent, TocItem, load_course
 from ..ai import engine
+from .. import session_store, trace_log
 
 ENV_NAME_OPENAI_API_KEY = "CHATAI_OPENAI_API_KEY"
 ENV_NAME_AZURE_API_KEY = "CHATAI_AZURE_API_KEY"
@@ -23,7 +27,7 @@ ENV_NAME_VLLM_API_KEY = "CHATAI_VLLM_API_KEY"
 
 logger = logging.getLogger(__name__)
 
-class ConfigOptions(BaseSettings):
+class ConfigOptions(AiEngineOptions, BaseSettings):
     """Options from the configuration file and/or CLI attributes."""
     model_config = SettingsConfigDict(env_prefix='plct_')
 
@@ -44,6 +48,21 @@ class ConfigOptions(BaseSettings):
     api_key: str | None = None
     azure_default_ai_endpoint: str | None = None
     vllm_url: str | None = None
+    openai_url: str | None = None
+    ai_http_max_connections: int = 100
+    ai_http_max_keepalive_connections: int = 20
+    ai_http_keepalive_expiry: float = 30.0
+    ai_http2: bool = False
+    trace_log_path: str | None = None
+    trace_log_sample_rate: float = 1.0
+    trace_log_max_bytes: int = 100_000_000
+    trace_log_backup_count: int = 5
+    trace_log_payloads: bool = False
+    session_store: str | None = None  # "memory" or "sqlite"; chat sessions are disabled if None
+    session_store_path: str | None = None  # SQLite file of the "sqlite" session store
+    session_ttl: float = 3600  # seconds a session is kept after its last turn
+    session_max_sessions: int = 10_000  # maximum number of sessions in the "memory" session store
+    session_max_turns: int = 20  # turns of history kept in a session
 
 class ServerContent:
 
@@ -185,15 +204,42 @@ def init_ai_engine(conf: ConfigOptions) -> None:
         azure_api_key=azure_api_key,
         vllm_api_key=vllm_api_key,
         vllm_url=conf.vllm_url,
-        azure_default_ai_endpoint=conf.azure_default_ai_endpoint
+        openai_url=conf.openai_url,
+        azure_default_ai_endpoint=conf.azure_default_ai_endpoint,
+        max_connections=conf.ai_http_max_connections,
+        max_keepalive_connections=conf.ai_http_max_keepalive_connections,
+        keepalive_expiry=conf.ai_http_keepalive_expiry,
+        http2=conf.ai_http2
     )
 
     if conf.ai_ctx_url:
         logger.info(f"Initializing AI engine with context URL: {conf.ai_ctx_url}")
-        engine.init(ai_ctx_url=conf.ai_ctx_url, client_factory=client_factory)
+        engine_options = AiEngineOptions.model_validate(
+            conf.model_dump(include=set(AiEngineOptions.model_fields)))
+        engine.init(ai_ctx_url=conf.ai_ctx_url, client_factory=client_factory, options=engine_options)
         course_keys = engine.get_ai_engine().ctx_data.course_dict.keys()
         logger.info(f"Courses in AI Context: {', '.join(course_keys)}")
 
+def init_trace_log(conf: ConfigOptions) -> None:
+    """Start writing request traces if a trace log path is configured."""
+    if conf.trace_log_path:
+        trace_log.init(
+            path=conf.trace_log_path.format(pid=os.getpid()),
+            sample_rate=conf.trace_log_sample_rate,
+            max_bytes=conf.trace_log_max_bytes,
+            backup_count=conf.trace_log_backup_count,
+            include_payloads=conf.trace_log_payloads)
+
+def init_session_store(conf: ConfigOptions) -> None:
+    """Start keeping chat sessions if a session store is configured."""
+    if conf.session_store:
+        session_store.init(
+            kind=conf.session_store,
+            ttl=conf.session_ttl,
+            max_sessions=conf.session_max_sessions,
+            path=conf.session_store_path,
+            max_turns=conf.session_max_turns)
+
 def configure(*, course_urls: tuple[str] = None, config_file: str = None, verbose: bool = None,
               ai_ctx_url: str = None, azure_default_ai_endpoint: str = None) -> None:
     """Umbrella method that loads config, initializes server content, and starts the AI engine."""
@@ -201,5 +247,13 @@ def configure(*, course_urls: tuple[str] = None, config_file: str = None, verbos
                        ai_ctx_url=ai_ctx_url, azure_default_ai_endpoint=azure_default_ai_endpoint)
     init_server_content(conf)
     init_ai_engine(conf)
+    init_trace_log(conf)
+    init_session_store(conf)
 
-
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """FastAPI lifespan handler that releases resources (e.g. AI client connections) on shutdown."""
+    yield
+    session_store.shutdown()
+    await engine.shutdown()
+    trace_log.shutdown()
@@ -19,3 +19,7 @@ def get_rag_router() -> APIRouter:
     from .rag_api import router as rag_router
     return rag_router
 
+def get_metrics_router() -> APIRouter:
+    from .metrics_api import router as metrics_router
+    return metrics_router
+
@@ -0,0 +1,45 @@
+import logging
+from typing import Iterable
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+
+from .. import metrics
+from ..ai import engine
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter()
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+def collect_engine_metrics() -> Iterable[str]:
+    if engine.ai_engine is None:
+        return
+    stats = engine.ai_engine.get_cache_stats()
+    cache_results = {}
+    for cache in ("answer", "prompt", "chunk"):
+        cache_results[(cache, "hit")] = stats[cache]["hits"]
+        cache_results[(cache, "miss")] = stats[cache]["misses"]
+    cache_results[("embedding", "hit")] = stats["embedding"]["memory_hits"]
+    cache_results[("embedding", "disk_hit")] = stats["embedding"]["disk_hits"]
+    cache_results[("embedding", "miss")] = stats["embedding"]["misses"]
+    yield from metrics.sample("plct_cache_requests_total", "counter", "Cache lookups by result",
+                              cache_results, ["cache", "result"])
+    yield from metrics.sample("plct_cache_size", "gauge", "Number of cached items",
+                              {(cache,): stats[cache]["size"] for cache in ("answer", "prompt", "chunk", "embedding")},
+                              ["cache"])
+    yield from metrics.sample("plct_coalesced_calls_total", "counter", "Calls that joined an identical call in flight",
+                              {(): stats["coalescing"]["coalesced"]})
+    admission = stats["admission"]
+    for name, type_name, help in (("running", "gauge", "Admitted requests in flight"),
+                                  ("waiting", "gauge", "Requests waiting for admission"),
+                                  ("rejected", "counter", "Requests rejected by admission control")):
+        metric_name = f"plct_admission_{name}" + ("_total" if type_name == "counter" else "")
+        yield from metrics.sample(metric_name, type_name, help,
+                                  {(limiter,): values[name] for limiter, values in admission.items()}, ["limiter"])
+
+metrics.add_collector(collect_engine_metrics)
+
+@router.get("/metrics")
+async def get_metrics() -> PlainTextResponse:
+    return PlainTextResponse(metrics.render(), media_type=PROMETHEUS_CONTENT_TYPE)
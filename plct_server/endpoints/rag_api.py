@@ -1,3 +1,4 @@
+import asyncio
 import logging
 from typing import List
 from fastapi import APIRouter, HTTPException, Response, Security
@@ -6,7 +7,10 @@ from openai import OpenAIError
 from pydantic import BaseModel
 
 from ..content.server import get_server_content
-from ..ai.engine import QueryError, get_ai_engine
+from ..metrics import REQUEST_ERRORS, REQUESTS
+from ..trace_log import start_trace
+from ..ai.admission import OverloadedError
+from ..ai.engine import QueryError, QueryTooLargeError, get_ai_engine
 
 logger = logging.getLogger(__name__)
 
@@ -39,32 +43,67 @@ def get_api_key(api_key_header: str = Security(api_key_header_scheme)) -> str:
 async def rag_system_message(response: Response, input: RagSystemMessageRequest,
                              key: str =  Security(get_api_key)) -> RagSystemMessageResponse:
     response.media_type = "application/json"
+    REQUESTS.inc(endpoint="rag_system_message")
     new_condensed_history = ""
+    trace = start_trace("rag_system_message", input.course_key, input.activity_key, input.model_dump())
+    response.headers["X-Request-ID"] = trace.request_id
     ai_engine = get_ai_engine()
-    try:                  
-        system_message, followup_questions = await ai_engine.make_system_message(
-                history=input.history, 
-                query=input.query, 
-                course_key=input.course_key, 
-                activity_key=input.activity_key, 
-                condensed_history=input.condensed_history)
-        
-        new_condensed_history = await ai_engine.generate_condensed_history(
-            history=input.history, 
-            condensed_history=input.condensed_history)
-        
+    try:
+        history = await ai_engine.compact_history(
+            list(input.history), input.query, input.condensed_history, query_context=trace.query_context)
+    except QueryTooLargeError as e:
+        REQUEST_ERRORS.inc(endpoint="rag_system_message", error=type(e).__name__)
+        trace.finish(e)
+        raise HTTPException(status_code=413, detail="Query too large")
+    # both calls run concurrently, and both are cancelled if one of them fails
+    tasks = [
+        asyncio.create_task(ai_engine.make_system_message(
+            history=history,
+            query=input.query,
+            course_key=input.course_key,
+            activity_key=input.activity_key,
+            condensed_history=input.condensed_history,
+            query_context=trace.query_context)),
+        asyncio.create_task(ai_engine.generate_condensed_history(
+            history=list(input.history),
+            condensed_history=input.condensed_history,
+            query_context=trace.query_context))]
+    try:
+        (system_message, followup_questions), new_condensed_history = await asyncio.gather(*tasks)
+
+    except OverloadedError as e:
+        REQUEST_ERRORS.inc(endpoint="rag_system_message", error=type(e).__name__)
+        trace.finish(e)
+        raise HTTPException(status_code=503, detail="Overloaded",
+                            headers={"Retry-After": str(e.retry_after)})
+
     except QueryError as e:
+        REQUEST_ERRORS.inc(endpoint="rag_system_message", error=type(e).__name__)
+        trace.finish(e)
         logger.error(f"QueryError: {e}")
-        return HTTPException(status_code=500, detail="QueryError")
-    
+        raise HTTPException(status_code=500, detail="QueryError")
+
     except OpenAIError as e:
+        REQUEST_ERRORS.inc(endpoint="rag_system_message", error=type(e).__name__)
+        trace.finish(e)
         logger.error(f"OpenAIError: {e}")
-        return HTTPException(status_code=500, detail="OpenAIError")
-    
+        raise HTTPException(status_code=500, detail="OpenAIError")
+
+    finally:
+        for task in tasks:
+            task.cancel()
+        # waits for the cancelled call and retrieves its exception
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    trace.finish()
     return RagSystemMessageResponse(message=system_message, 
                                     condensed_history=new_condensed_history, 
                                     followup_questions=followup_questions)
 
     
 
-    
\ No newline at end of file
+    
+
+@router.get("/api/cache-stats")
+async def cache_stats(key: str = Security(get_api_key)) -> dict[str, dict]:
+    return get_ai_engine().get_cache_stats()
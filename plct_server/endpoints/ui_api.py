@@ -1,17 +1,25 @@
+import asyncio
 import logging
 import os
 import json
-from typing import AsyncGenerator, List
-from fastapi import APIRouter, Response
+from typing import AsyncGenerator, AsyncIterator, Awaitable, Callable, List, TypeVar
+from fastapi import APIRouter, Request, Response
 from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 from openai import OpenAIError
 
 from ..content.server import get_server_content
-from ..ai.engine import get_ai_engine, QueryError
+from ..metrics import CANCELLED_REQUESTS, IN_FLIGHT_STREAMS, REQUEST_ERRORS, REQUESTS
+from .. import session_store
+from ..session_store import Session
+from ..trace_log import RequestTrace, start_trace
+from ..ai.admission import OverloadedError
+from ..ai.engine import get_ai_engine, QueryError, QueryTooLargeError
 
 logger = logging.getLogger(__name__)
 
+T = TypeVar("T")
+
 router = APIRouter()
 
 
@@ -26,12 +34,39 @@ class ChatInput(BaseModel):
     condensedHistory: str = "" 
     model : str = ""
     contextAttributes: dict[str,str] = {}
+    trailingMetadata: bool = False
+    bypassCache: bool = False
+    sessionId: str = ""  # with a session store, history and condensed history are kept on the server
 
 class ChatModel(BaseModel):
     name: str
     display_name: str
 
-async def stream_response(answer, condensed_history, followup_questions) -> AsyncGenerator[bytes, None]:
+METADATA_SEPARATOR = b'\x1e'
+
+class ClientDisconnected(Exception):
+    """The client disconnected before the answer was complete."""
+
+async def wait_for_disconnect(request: Request) -> None:
+    while (await request.receive())["type"] != "http.disconnect":
+        pass
+
+async def unless_disconnected(awaitable: Awaitable[T], disconnect: asyncio.Task) -> T:
+    """Await `awaitable`; if the client disconnects first, cancel it and raise ClientDisconnected."""
+    task = asyncio.ensure_future(awaitable)
+    try:
+        await asyncio.wait([task, disconnect], return_when=asyncio.FIRST_COMPLETED)
+    except asyncio.CancelledError:
+        task.cancel()
+        raise
+    if not task.done():
+        task.cancel()
+        await asyncio.wait([task])
+        raise ClientDisconnected()
+    return task.result()
+
+async def stream_response(answer, condensed_history, followup_questions,
+                          trace: RequestTrace) -> AsyncGenerator[bytes, None]:
     metadata = {
         "condensed_history": condensed_history,
         "followup_questions": followup_questions
@@ -39,8 +74,79 @@ async def stream_response(answer, condensed_history, followup_questions) -> Asyn
 
     yield json.dumps(metadata).encode('utf-8') + b'\n'
 
-    async for chunk in answer:
-        yield chunk.encode('utf-8')
+    IN_FLIGHT_STREAMS.inc()
+    try:
+        async for chunk in answer:
+            yield chunk.encode('utf-8')
+    except (asyncio.CancelledError, GeneratorExit):
+        # the client disconnected: the response is cancelled, or it is closed after a failed send
+        CANCELLED_REQUESTS.inc(endpoint="chat", stage="stream")
+        trace.finish(ClientDisconnected.__name__)
+        raise
+    except BaseException as e:
+        trace.finish(e)
+        raise
+    finally:
+        IN_FLIGHT_STREAMS.dec()
+        # closing the answer closes the upstream stream if it is not finished
+        await answer.aclose()
+        trace.finish()
+
+async def stream_response_trailing_metadata(answer, condensed_history_task: asyncio.Task | None,
+                                            followup_questions, trace: RequestTrace) -> AsyncGenerator[bytes, None]:
+    """Stream the answer first, followed by the record separator (0x1E) and the metadata
+    as a JSON line. Condensed history is computed while the answer is being streamed,
+    unless it is kept in a session (`condensed_history_task` is None)."""
+    IN_FLIGHT_STREAMS.inc()
+    condensed_history = ""
+    try:
+        async for chunk in answer:
+            yield chunk.encode('utf-8')
+        try:
+            if condensed_history_task is not None:
+                condensed_history = await condensed_history_task
+        except (QueryError, OpenAIError) as e:
+            logger.warning(f"Error while generating condensed history: {e}")
+            REQUEST_ERRORS.inc(endpoint="chat", error=type(e).__name__)
+    except (asyncio.CancelledError, GeneratorExit):
+        CANCELLED_REQUESTS.inc(endpoint="chat", stage="stream")
+        trace.finish(ClientDisconnected.__name__)
+        raise
+    except BaseException as e:
+        trace.finish(e)
+        raise
+    finally:
+        IN_FLIGHT_STREAMS.dec()
+        if condensed_history_task is not None:
+            condensed_history_task.cancel()
+        await answer.aclose()
+        trace.finish()
+
+    metadata = {
+        "condensed_history": condensed_history,
+        "followup_questions": followup_questions
+    }
+    yield METADATA_SEPARATOR + json.dumps(metadata).encode('utf-8') + b'\n'
+
+async def record_answer(answer: AsyncIterator[str], on_answer: Callable[[str], None]) -> AsyncIterator[str]:
+    """Pass the answer through, and call `on_answer` with the whole answer once it is streamed."""
+    chunks = []
+    try:
+        async for chunk in answer:
+            chunks.append(chunk)
+            yield chunk
+    finally:
+        await answer.aclose()
+    on_answer("".join(chunks))
+
+async def condense_session_history(history: list[tuple[str, str]], condensed_history: str) -> str | None:
+    """Condensed history of a session, generated in the background after an answer."""
+    try:
+        return await get_ai_engine().generate_condensed_history(history=history, condensed_history=condensed_history)
+    except (QueryError, OpenAIError) as e:
+        logger.warning(f"Error while generating condensed history of a session: {e}")
+        REQUEST_ERRORS.inc(endpoint="chat", error=type(e).__name__)
+        return None
 
 logger = logging.getLogger(__name__)
 
@@ -57,45 +163,120 @@ async def get_chat() -> Response:
     return Response(status_code=200)
 
 @router.post("/api/chat")
-async def post_question(response: Response, input: ChatInput) -> Response:
+async def post_question(request: Request, response: Response, input: ChatInput) -> Response:
     response.media_type = "text/plain; charset=utf-8"
+    REQUESTS.inc(endpoint="chat")
     logger.debug(f"Chat input: {input}")
     logger.debug(f"Context attributes: {input.contextAttributes}")
     
     course_key = input.contextAttributes.get("course_key")
     activity_key = input.contextAttributes.get("activity_key")
     history = [(item.q, item.a) for item in input.history]
+    condensed_history = input.condensedHistory
+    trace = start_trace("chat", course_key, activity_key, input.model_dump(exclude={"accessKey"}))
+    headers = {"X-Request-ID": trace.request_id}
 
+    session = None
+    if input.sessionId and session_store.enabled():
+        session = await session_store.load(input.sessionId)
+        if session is None:
+            # a new or expired session starts from the history in the request
+            session = Session(history=history, condensed_history=condensed_history)
+        history = list(session.history)
+        condensed_history = session.condensed_history
 
     ai_engine = get_ai_engine()
+    try:
+        # the oldest turns are dropped before any upstream call if the history doesn't fit the model
+        answer_history = await ai_engine.compact_history(
+            history, input.question, condensed_history, input.model, trace.query_context)
+    except QueryTooLargeError as e:
+        REQUEST_ERRORS.inc(endpoint="chat", error=type(e).__name__)
+        trace.finish(e)
+        logger.warning(f"QueryTooLargeError: {e}")
+        return Response("Pitanje je predugačko, skrati ga pa pokušaj ponovo", media_type="text/plain")
+
+    # upstream work is cancelled if the client disconnects before the answer starts streaming
+    disconnect = asyncio.create_task(wait_for_disconnect(request))
+    condensed_history_task = None
+    if session is None:
+        # condensed history doesn't depend on the answer, so it is generated concurrently
+        condensed_history_task = asyncio.create_task(ai_engine.generate_condensed_history(
+            history=list(history), 
+            condensed_history=condensed_history,
+            query_context=trace.query_context))
+    generated_answer = None
+    streaming = False  # the answer and the condensed history task are owned by the response once it streams
     try:           
-        generated_answer, followup_questions, _ = await ai_engine.generate_answer(
-            history=history, 
-            query=input.question, 
-            course_key=course_key, 
-            activity_key=activity_key, 
-            condensed_history=input.condensedHistory,
-            model_name=input.model)  
-        
-        new_condensed_history = await ai_engine.generate_condensed_history(
-            history=history, 
-            condensed_history=input.condensedHistory)
+        generated_answer, followup_questions, trace.answer_context = await unless_disconnected(
+            ai_engine.generate_answer(
+                history=list(answer_history), 
+                query=input.question, 
+                course_key=course_key, 
+                activity_key=activity_key, 
+                condensed_history=condensed_history,
+                model_name=input.model,
+                use_answer_cache=not input.bypassCache),
+            disconnect)
+
+        new_condensed_history = ""
+        if condensed_history_task is not None and not input.trailingMetadata:
+            new_condensed_history = await unless_disconnected(condensed_history_task, disconnect)
+
+        if session is not None:
+            # the session is continued only with an answer that was streamed completely
+            generated_answer = record_answer(generated_answer, lambda answer: session_store.add_turn(
+                input.sessionId, session, input.question, answer, condense_session_history))
+
+        streaming = True
+        if input.trailingMetadata:
+            return StreamingResponse(
+                stream_response_trailing_metadata(
+                    generated_answer,
+                    condensed_history_task,
+                    followup_questions,
+                    trace),
+                media_type="text/plain", headers=headers)
 
         return StreamingResponse(
             stream_response(
                 generated_answer,
                 new_condensed_history,
-                followup_questions),
-            media_type="text/plain")
+                followup_questions,
+                trace),
+            media_type="text/plain", headers=headers)
     
+    except ClientDisconnected as e:
+        CANCELLED_REQUESTS.inc(endpoint="chat", stage="answer")
+        trace.finish(e)
+        logger.debug("Client disconnected before the answer started")
+        return Response(status_code=499)
+    except OverloadedError as e:
+        REQUEST_ERRORS.inc(endpoint="chat", error=type(e).__name__)
+        trace.finish(e)
+        return Response("Server je trenutno preopterećen, malo sačekaj pa pokušaj ponovo",
+                        status_code=503, headers={"Retry-After": str(e.retry_after)},
+                        media_type="text/plain")
     except QueryError as e:
+        REQUEST_ERRORS.inc(endpoint="chat", error=type(e).__name__)
+        trace.finish(e)
         logger.error(f"QueryError: {e}")
         return Response("Ima tehničkih problema sa pristupom OpenAI, malo sačekaj pa pokušaj ponovo",
                          media_type="text/plain")
     except OpenAIError as e:
+        REQUEST_ERRORS.inc(endpoint="chat", error=type(e).__name__)
+        trace.finish(e)
         logger.warn(f"Error while calling OpenAI API: {e}")
         return Response("Ima tehničkih problema sa pristupom OpenAI, malo sačekaj pa pokušaj ponovo",
                          media_type="text/plain")
+    finally:
+        disconnect.cancel()
+        if not streaming:
+            if condensed_history_task is not None:
+                condensed_history_task.cancel()
+            if generated_answer is not None:
+                # closes the upstream answer stream that would otherwise stay open until garbage collected
+                await generated_answer.aclose()
     
 
 class CourseItem(BaseModel):
@@ -47,7 +47,8 @@ async def run_test_case(ai_engine: AiEngine, test_case: Conversation, model : st
         course_key=test_case.course_key,
         activity_key=test_case.activity_key,
         condensed_history = test_case.condensed_history,
-        model_name= test_case.model if test_case.model else model
+        model_name= test_case.model if test_case.model else model,
+        use_answer_cache=False
     )
     
     answer = ""
@@ -628,5 +628,4 @@ ${this.parser.parse(t)}</blockquote>
 ${t}</tr>
 `}tablecell(t){let a=this.parser.parseInline(t.tokens),r=t.header?"th":"td";return(t.align?`<${r} align="${t.align}">`:`<${r}>`)+a+`</${r}>
 `}strong({tokens:t}){return`<strong>${this.parser.parseInline(t)}</strong>`}em({tokens:t}){return`<em>${this.parser.parseInline(t)}</em>`}codespan({text:t}){return`<code>${Nn(t,!0)}</code>`}br(t){return"<br>"}del({tokens:t}){return`<del>${this.parser.parseInline(t)}</del>`}link({href:t,title:a,tokens:r}){let i=this.parser.parseInline(r),u=Ob(t);if(u===null)return i;t=u;let s='<a href="'+t+'"';return a&&(s+=' title="'+Nn(a)+'"'),s+=">"+i+"</a>",s}image({href:t,title:a,text:r,tokens:i}){i&&(r=this.parser.parseInline(i,this.parser.textRenderer));let u=Ob(t);if(u===null)return Nn(r);t=u;let s=`<img src="${t}" alt="${r}"`;return a&&(s+=` title="${Nn(a)}"`),s+=">",s}text(t){return"tokens"in t&&t.tokens?this.parser.parseInline(t.tokens):"escaped"in t&&t.escaped?t.text:Nn(t.text)}},$h=class{strong({text:t}){return t}em({text:t}){return t}codespan({text:t}){return t}del({text:t}){return t}html({text:t}){return t}text({text:t}){return t}link({text:t}){return""+t}image({text:t}){return""+t}br(){return""}checkbox({raw:t}){return t}},Ft=class nh{options;renderer;textRenderer;constructor(a){this.options=a||Va,this.options.renderer=this.options.renderer||new Nu,this.renderer=this.options.renderer,this.renderer.options=this.options,this.renderer.parser=this,this.textRenderer=new $h}static parse(a,r){return new nh(r).parse(a)}static parseInline(a,r){return new nh(r).parseInline(a)}parse(a){let r="";for(let i=0;i<a.length;i++){let u=a[i];if(this.options.extensions?.renderers?.[u.type]){let d=u,h=this.options.extensions.renderers[d.type].call({parser:this},d);if(h!==!1||!["space","hr","heading","code","table","blockquote","list","html","def","paragraph","text"].includes(d.type)){r+=h||"";continue}}let s=u;switch(s.type){case"space":{r+=this.renderer.space(s);break}case"hr":{r+=this.renderer.hr(s);break}case"heading":{r+=this.renderer.heading(s);break}case"code":{r+=this.renderer.code(s);break}case"table":{r+=this.renderer.table(s);break}case"blockquote":{r+=this.renderer.blockquote(s);break}case"list":{r+=this.renderer.list(s);break}case"checkbox":{r+=this.renderer.checkbox(s);break}case"html":{r+=this.renderer.html(s);break}case"def":{r+=this.renderer.def(s);break}case"paragraph":{r+=this.renderer.paragraph(s);break}case"text":{r+=this.renderer.text(s);break}default:{let d='Token with "'+s.type+'" type was not found.';if(this.options.silent)return console.error(d),"";throw new Error(d)}}}return r}parseInline(a,r=this.renderer){let i="";for(let u=0;u<a.length;u++){let s=a[u];if(this.options.extensions?.renderers?.[s.type]){let h=this.options.extensions.renderers[s.type].call({parser:this},s);if(h!==!1||!["escape","html","link","image","strong","em","codespan","br","del","text"].includes(s.type)){i+=h||"";continue}}let d=s;switch(d.type){case"escape":{i+=r.text(d);break}case"html":{i+=r.html(d);break}case"link":{i+=r.link(d);break}case"image":{i+=r.image(d);break}case"checkbox":{i+=r.checkbox(d);break}case"strong":{i+=r.strong(d);break}case"em":{i+=r.em(d);break}case"codespan":{i+=r.codespan(d);break}case"br":{i+=r.br(d);break}case"del":{i+=r.del(d);break}case"text":{i+=r.text(d);break}default:{let h='Token with "'+d.type+'" type was not found.';if(this.options.silent)return console.error(h),"";throw new Error(h)}}}return i}},ai=class{options;block;constructor(t){this.options=t||Va}static passThroughHooks=new Set(["preprocess","postprocess","processAllTokens","emStrongMask"]);static passThroughHooksRespectAsync=new Set(["preprocess","postprocess","processAllTokens"]);preprocess(t){return t}postprocess(t){return t}processAllTokens(t){return t}emStrongMask(t){return t}provideLexer(){return this.block?It.lex:It.lexInline}provideParser(){return this.block?Ft.parse:Ft.parseInline}},$N=class{defaults=Mh();options=this.setOptions;parse=this.parseMarkdown(!0);parseInline=this.parseMarkdown(!1);Parser=Ft;Renderer=Nu;TextRenderer=$h;Lexer=It;Tokenizer=Ru;Hooks=ai;constructor(...t){this.use(...t)}walkTokens(t,a){let r=[];for(let i of t)switch(r=r.concat(a.call(this,i)),i.type){case"table":{let u=i;for(let s of u.header)r=r.concat(this.walkTokens(s.tokens,a));for(let s of u.rows)for(let d of s)r=r.concat(this.walkTokens(d.tokens,a));break}case"list":{let u=i;r=r.concat(this.walkTokens(u.items,a));break}default:{let u=i;this.defaults.extensions?.childTokens?.[u.type]?this.defaults.extensions.childTokens[u.type].forEach(s=>{let d=u[s].flat(1/0);r=r.concat(this.walkTokens(d,a))}):u.tokens&&(r=r.concat(this.walkTokens(u.tokens,a)))}}return r}use(...t){let a=this.defaults.extensions||{renderers:{},childTokens:{}};return t.forEach(r=>{let i={...r};if(i.async=this.defaults.async||i.async||!1,r.extensions&&(r.extensions.forEach(u=>{if(!u.name)throw new Error("extension name required");if("renderer"in u){let s=a.renderers[u.name];s?a.renderers[u.name]=function(...d){let h=u.renderer.apply(this,d);return h===!1&&(h=s.apply(this,d)),h}:a.renderers[u.name]=u.renderer}if("tokenizer"in u){if(!u.level||u.level!=="block"&&u.level!=="inline")throw new Error("extension level must be 'block' or 'inline'");let s=a[u.level];s?s.unshift(u.tokenizer):a[u.level]=[u.tokenizer],u.start&&(u.level==="block"?a.startBlock?a.startBlock.push(u.start):a.startBlock=[u.start]:u.level==="inline"&&(a.startInline?a.startInline.push(u.start):a.startInline=[u.start]))}"childTokens"in u&&u.childTokens&&(a.childTokens[u.name]=u.childTokens)}),i.extensions=a),r.renderer){let u=this.defaults.renderer||new Nu(this.defaults);for(let s in r.renderer){if(!(s in u))throw new Error(`renderer '${s}' does not exist`);if(["options","parser"].includes(s))continue;let d=s,h=r.renderer[d],p=u[d];u[d]=(...v)=>{let g=h.apply(u,v);return g===!1&&(g=p.apply(u,v)),g||""}}i.renderer=u}if(r.tokenizer){let u=this.defaults.tokenizer||new Ru(this.defaults);for(let s in r.tokenizer){if(!(s in u))throw new Error(`tokenizer '${s}' does not exist`);if(["options","rules","lexer"].includes(s))continue;let d=s,h=r.tokenizer[d],p=u[d];u[d]=(...v)=>{let g=h.apply(u,v);return g===!1&&(g=p.apply(u,v)),g}}i.tokenizer=u}if(r.hooks){let u=this.defaults.hooks||new ai;for(let s in r.hooks){if(!(s in u))throw new Error(`hook '${s}' does not exist`);if(["options","block"].includes(s))continue;let d=s,h=r.hooks[d],p=u[d];ai.passThroughHooks.has(s)?u[d]=v=>{if(this.defaults.async&&ai.passThroughHooksRespectAsync.has(s))return(async()=>{let b=await h.call(u,v);return p.call(u,b)})();let g=h.call(u,v);return p.call(u,g)}:u[d]=(...v)=>{if(this.defaults.async)return(async()=>{let b=await h.apply(u,v);return b===!1&&(b=await p.apply(u,v)),b})();let g=h.apply(u,v);return g===!1&&(g=p.apply(u,v)),g}}i.hooks=u}if(r.walkTokens){let u=this.defaults.walkTokens,s=r.walkTokens;i.walkTokens=function(d){let h=[];return h.push(s.call(this,d)),u&&(h=h.concat(u.call(this,d))),h}}this.defaults={...this.defaults,...i}}),this}setOptions(t){return this.defaults={...this.defaults,...t},this}lexer(t,a){return It.lex(t,a??this.defaults)}parser(t,a){return Ft.parse(t,a??this.defaults)}parseMarkdown(t){return(a,r)=>{let i={...r},u={...this.defaults,...i},s=this.onError(!!u.silent,!!u.async);if(this.defaults.async===!0&&i.async===!1)return s(new Error("marked(): The async option was set to true by an extension. Remove async: false from the parse options object to return a Promise."));if(typeof a>"u"||a===null)return s(new Error("marked(): input parameter is undefined or null"));if(typeof a!="string")return s(new Error("marked(): input parameter is of type "+Object.prototype.toString.call(a)+", string expected"));if(u.hooks&&(u.hooks.options=u,u.hooks.block=t),u.async)return(async()=>{let d=u.hooks?await u.hooks.preprocess(a):a,h=await(u.hooks?await u.hooks.provideLexer():t?It.lex:It.lexInline)(d,u),p=u.hooks?await u.hooks.processAllTokens(h):h;u.walkTokens&&await Promise.all(this.walkTokens(p,u.walkTokens));let v=await(u.hooks?await u.hooks.provideParser():t?Ft.parse:Ft.parseInline)(p,u);return u.hooks?await u.hooks.postprocess(v):v})().catch(s);try{u.hooks&&(a=u.hooks.preprocess(a));let d=(u.hooks?u.hooks.provideLexer():t?It.lex:It.lexInline)(a,u);u.hooks&&(d=u.hooks.processAllTokens(d)),u.walkTokens&&this.walkTokens(d,u.walkTokens);let h=(u.hooks?u.hooks.provideParser():t?Ft.parse:Ft.parseInline)(d,u);return u.hooks&&(h=u.hooks.postprocess(h)),h}catch(d){return s(d)}}}onError(t,a){return r=>{if(r.message+=`
-Please report this to https://github.com/markedjs/marked.`,t){let i="<p>An error occurred:</p><pre>"+Nn(r.message+"",!0)+"</pre>";return a?Promise.resolve(i):i}if(a)return Promise.reject(r);throw r}}},Qa=new $N;function Ne(t,a){return Qa.parse(t,a)}Ne.options=Ne.setOptions=function(t){return Qa.setOptions(t),Ne.defaults=Qa.defaults,i1(Ne.defaults),Ne};Ne.getDefaults=Mh;Ne.defaults=Va;Ne.use=function(...t){return Qa.use(...t),Ne.defaults=Qa.defaults,i1(Ne.defaults),Ne};Ne.walkTokens=function(t,a){return Qa.walkTokens(t,a)};Ne.parseInline=Qa.parseInline;Ne.Parser=Ft;Ne.parser=Ft.parse;Ne.Renderer=Nu;Ne.TextRenderer=$h;Ne.Lexer=It;Ne.lexer=It.lex;Ne.Tokenizer=Ru;Ne.Hooks=ai;Ne.parse=Ne;Ne.options;Ne.setOptions;Ne.use;Ne.walkTokens;Ne.parseInline;Ft.parse;It.lex;const y1=T.createContext(null),_b={direction:"incoming",message:"Pitaj u vezi sadržaja kursa",position:"normal",sender:"Čet.kabinet"},wb=["Napravi mi pitanja za test iz ove lekcije.","Napravi mi domaći zadatak za ovu lekciju.","Napravi mi plan casa za ovu lekciju."];function BN(){const[t,a]=T.useState([_b]),[r,i]=T.useState(!1),[u,s]=T.useState("pending"),[d,h]=T.useState([]),[p,v]=T.useState(""),g=T.useContext(y1);g2();const[b,S]=T.useState("-"),[w,E]=T.useState([{course_key:"-",title:"---"}]),[C,H]=T.useState("-"),[k,j]=T.useState([{key:"-",title:"---"}]),[B,J]=T.useState("-"),[D,le]=T.useState([{key:"-",title:"---"}]),[F,me]=T.useState(""),[De,Te]=T.useState([]),[at,Ee]=T.useState(wb);async function dt(){localStorage.setItem("plct_courseKey",b);const ee=await(await fetch("../api/toc-list",{method:"post",body:JSON.stringify({key:b,item_path:[]}),headers:{Accept:"application/json","Content-Type":"application/json"}})).json();if(j(ee),ee.length>0){const se=localStorage.getItem("plct_lessonKey"),x=se&&ee.find(U=>U.key===se);H(x?se:ee[0].key)}}T.useEffect(()=>{b!=="-"&&dt()},[b]);async function tt(){localStorage.setItem("plct_lessonKey",C);const ee=await(await fetch("../api/toc-list",{method:"post",body:JSON.stringify({key:b,item_path:[C]}),headers:{Accept:"application/json","Content-Type":"application/json"}})).json();if(le(ee),ee.length>0){const se=localStorage.getItem("plct_activityKey"),x=se&&ee.find(U=>U.key===se);J(x?se:ee[0].key)}}T.useEffect(()=>{C!=="-"&&tt()},[C]),T.useEffect(()=>{B!=="-"&&(localStorage.setItem("plct_activityKey",B),a([_b]),h([]),v(""),Ee(wb))},[B]),T.useEffect(()=>{console.log("courseKey:",b,"activityKey:",B)},[b,B]);async function Qe(Q,ee=!0){const se={history:ee?d:[],question:Q,accessKey:g?.accessKey??"default",condensedHistory:p,contextAttributes:{activity_key:B,course_key:b},model:F};return await fetch("../api/chat",{method:"POST",body:JSON.stringify(se),headers:{Accept:"application/json","Content-Type":"application/json"}})}async function P(Q){i(!0),Ee([]);const ee=new TextDecoder("utf-8"),se={direction:"outgoing",message:Q,position:"normal",sender:"Ja"};a([...t,se]);const x=await Qe(Q);var U=!1,K="";const Z=x.body.getReader();for(;;){const{done:oe,value:W}=await Z.read();if(oe)break;const ie=ee.decode(W);if(U)K+=ie;else{const it=ie.indexOf(`
-`);if(it!==-1){const Pn=ie.slice(0,it),Vt=JSON.parse(Pn);let Ke=Vt.condensed_history,wt=Vt.followup_questions;Ke!==""&&v(Ke||""),Ee(wt||[]),U=!0,K+=ie.slice(it+1)}else K+=ie}const je={direction:"incoming",message:"<div class='answer-wrapper'>"+Ne.parse(K)+"</div>",position:"normal",sender:"Čet.kabinet"};a([...t,se,je])}h([...d,{q:Q,a:K}]),i(!1)}const V=async Q=>{await P(Q)};return T.useEffect(()=>{async function Q(){const se=await(await fetch("../api/courses",{method:"GET",headers:{Accept:"application/json"}})).json();if(E(se),se.length>0){const Z=localStorage.getItem("plct_courseKey"),oe=Z&&se.find(W=>W.course_key===Z);S(oe?Z:se[0].course_key)}const U=await(await fetch("../api/models",{method:"GET",headers:{Accept:"application/json"}})).json();if(Te(U),U.length>0){const Z=localStorage.getItem("plct_model"),oe=Z&&U.find(W=>W.name===Z);me(oe?Z:U[0].name)}(await fetch("../api/chat",{method:"GET"})).status===200?s("ok"):s("fail")}Q()},[]),u==="ok"?ae.jsxs("div",{children:[ae.jsx("h2",{children:"Izaberi kurs i lekciju, pa postavi pitanje"}),ae.jsx("p",{children:"Pitanja koje postaviš i dati odgovori ostaju sačuvani u bazi radi unapređivanja rešenja. U pitanjima nemoj unositi lične niti bilo koje druge osetljive podatke."}),ae.jsx("select",{className:"form-select",value:b,onChange:Q=>S(Q.target.value),children:w.map((Q,ee)=>ae.jsx("option",{value:Q.course_key,children:Q.title},ee))}),ae.jsx("br",{}),ae.jsx("select",{className:"form-select",value:C,onChange:Q=>H(Q.target.value),children:k.map((Q,ee)=>ae.jsx("option",{value:Q.key,children:Q.title},ee))}),ae.jsx("br",{}),ae.jsx("select",{className:"form-select",value:B,onChange:Q=>J(Q.target.value),children:D.map((Q,ee)=>ae.jsx("option",{value:Q.key,children:Q.title},ee))}),ae.jsx("br",{}),ae.jsx("select",{className:"form-select",value:F,onChange:Q=>{me(Q.target.value),localStorage.setItem("plct_model",Q.target.value)},children:De.map((Q,ee)=>ae.jsx("option",{value:Q.name,children:Q.display_name},ee))}),ae.jsx("br",{}),ae.jsx(wR,{responsive:!0,children:ae.jsxs(rR,{children:[ae.jsx(Fl,{typingIndicator:r&&ae.jsx(XR,{}),children:t.map((Q,ee)=>ae.jsx(ya,{model:Q},ee))}),ae.jsx($u,{placeholder:r?"Sačekaj odgovor na postavljeno pitanje":"Ovde unesi pitanje",attachButton:!1,onSend:P,disabled:r,autoFocus:!0,activateAfterChange:!0})]})}),ae.jsx("br",{}),ae.jsx("div",{className:"follow-up-questions",children:at.map((Q,ee)=>ae.jsx("p",{onClick:()=>V(Q),children:Q},ee))})]}):u==="fail"?ae.jsx("div",{children:ae.jsx("h1",{children:"Pristup ovom delu aplikacije nije omogućen"})}):ae.jsx("div",{children:ae.jsx("h1",{children:"Sačekaj..."})})}function YN(){const a=new URLSearchParams(window.location.search).get("ak"),[r,i]=L2(["BackendApiKey"]);a&&i("BackendApiKey",a);const[u]=T.useState({accessKey:a??r.BackendApiKey});return ae.jsx(y1.Provider,{value:u,children:ae.jsx(e_,{children:ae.jsxs(BE,{children:[ae.jsx(Hf,{path:"/",element:ae.jsx(t_,{})},0),ae.jsx(Hf,{path:"/chat",element:ae.jsx(BN,{})},1)]})})})}const qN=q2.createRoot(document.getElementById("root"));qN.render(ae.jsx(M.StrictMode,{children:ae.jsx(j2,{children:ae.jsx(d2,{basename:"/app",children:ae.jsx(YN,{})})})}));
+Please report this to https://github.com/markedjs/marked.`,t){let i="<p>An error occurred:</p><pre>"+Nn(r.message+"",!0)+"</pre>";return a?Promise.resolve(i):i}if(a)return Promise.reject(r);throw r}}},Qa=new $N;function Ne(t,a){return Qa.parse(t,a)}Ne.options=Ne.setOptions=function(t){return Qa.setOptions(t),Ne.defaults=Qa.defaults,i1(Ne.defaults),Ne};Ne.getDefaults=Mh;Ne.defaults=Va;Ne.use=function(...t){return Qa.use(...t),Ne.defaults=Qa.defaults,i1(Ne.defaults),Ne};Ne.walkTokens=function(t,a){return Qa.walkTokens(t,a)};Ne.parseInline=Qa.parseInline;Ne.Parser=Ft;Ne.parser=Ft.parse;Ne.Renderer=Nu;Ne.TextRenderer=$h;Ne.Lexer=It;Ne.lexer=It.lex;Ne.Tokenizer=Ru;Ne.Hooks=ai;Ne.parse=Ne;Ne.options;Ne.setOptions;Ne.use;Ne.walkTokens;Ne.parseInline;Ft.parse;It.lex;const y1=T.createContext(null),_b={direction:"incoming",message:"Pitaj u vezi sadržaja kursa",position:"normal",sender:"Čet.kabinet"},wb=["Napravi mi pitanja za test iz ove lekcije.","Napravi mi domaći zadatak za ovu lekciju.","Napravi mi plan casa za ovu lekciju."];function BN(){const[t,a]=T.useState([_b]),[r,i]=T.useState(!1),[u,s]=T.useState("pending"),[d,h]=T.useState([]),[p,v]=T.useState(""),g=T.useContext(y1);g2();const[b,S]=T.useState("-"),[w,E]=T.useState([{course_key:"-",title:"---"}]),[C,H]=T.useState("-"),[k,j]=T.useState([{key:"-",title:"---"}]),[B,J]=T.useState("-"),[D,le]=T.useState([{key:"-",title:"---"}]),[F,me]=T.useState(""),[De,Te]=T.useState([]),[at,Ee]=T.useState(wb);async function dt(){localStorage.setItem("plct_courseKey",b);const ee=await(await fetch("../api/toc-list",{method:"post",body:JSON.stringify({key:b,item_path:[]}),headers:{Accept:"application/json","Content-Type":"application/json"}})).json();if(j(ee),ee.length>0){const se=localStorage.getItem("plct_lessonKey"),x=se&&ee.find(U=>U.key===se);H(x?se:ee[0].key)}}T.useEffect(()=>{b!=="-"&&dt()},[b]);async function tt(){localStorage.setItem("plct_lessonKey",C);const ee=await(await fetch("../api/toc-list",{method:"post",body:JSON.stringify({key:b,item_path:[C]}),headers:{Accept:"application/json","Content-Type":"application/json"}})).json();if(le(ee),ee.length>0){const se=localStorage.getItem("plct_activityKey"),x=se&&ee.find(U=>U.key===se);J(x?se:ee[0].key)}}T.useEffect(()=>{C!=="-"&&tt()},[C]),T.useEffect(()=>{B!=="-"&&(localStorage.setItem("plct_activityKey",B),a([_b]),h([]),v(""),Ee(wb))},[B]),T.useEffect(()=>{console.log("courseKey:",b,"activityKey:",B)},[b,B]);async function Qe(Q,ee=!0){const se={history:ee?d:[],question:Q,accessKey:g?.accessKey??"default",condensedHistory:p,contextAttributes:{activity_key:B,course_key:b},model:F,trailingMetadata:!0};return await fetch("../api/chat",{method:"POST",body:JSON.stringify(se),headers:{Accept:"application/json","Content-Type":"application/json"}})}async function P(Q){i(!0),Ee([]);const ee=new TextDecoder("utf-8"),se={direction:"outgoing",message:Q,position:"normal",sender:"Ja"};a([...t,se]);const x=await Qe(Q);var U="",K="";const Z=x.body.getReader();for(;;){const{done:oe,value:W}=await Z.read();if(oe)break;U+=ee.decode(W,{stream:!0});const it=U.indexOf("\u001e");K=it===-1?U:U.slice(0,it);const je={direction:"incoming",message:"<div class='answer-wrapper'>"+Ne.parse(K)+"</div>",position:"normal",sender:"Čet.kabinet"};a([...t,se,je])}const it=U.indexOf("\u001e");if(it!==-1){const Vt=JSON.parse(U.slice(it+1));let Ke=Vt.condensed_history,wt=Vt.followup_questions;Ke!==""&&v(Ke||""),Ee(wt||[])}h([...d,{q:Q,a:K}]),i(!1)}const V=async Q=>{await P(Q)};return T.useEffect(()=>{async function Q(){const se=await(await fetch("../api/courses",{method:"GET",headers:{Accept:"application/json"}})).json();if(E(se),se.length>0){const Z=localStorage.getItem("plct_courseKey"),oe=Z&&se.find(W=>W.course_key===Z);S(oe?Z:se[0].course_key)}const U=await(await fetch("../api/models",{method:"GET",headers:{Accept:"application/json"}})).json();if(Te(U),U.length>0){const Z=localStorage.getItem("plct_model"),oe=Z&&U.find(W=>W.name===Z);me(oe?Z:U[0].name)}(await fetch("../api/chat",{method:"GET"})).status===200?s("ok"):s("fail")}Q()},[]),u==="ok"?ae.jsxs("div",{children:[ae.jsx("h2",{children:"Izaberi kurs i lekciju, pa postavi pitanje"}),ae.jsx("p",{children:"Pitanja koje postaviš i dati odgovori ostaju sačuvani u bazi radi unapređivanja rešenja. U pitanjima nemoj unositi lične niti bilo koje druge osetljive podatke."}),ae.jsx("select",{className:"form-select",value:b,onChange:Q=>S(Q.target.value),children:w.map((Q,ee)=>ae.jsx("option",{value:Q.course_key,children:Q.title},ee))}),ae.jsx("br",{}),ae.jsx("select",{className:"form-select",value:C,onChange:Q=>H(Q.target.value),children:k.map((Q,ee)=>ae.jsx("option",{value:Q.key,children:Q.title},ee))}),ae.jsx("br",{}),ae.jsx("select",{className:"form-select",value:B,onChange:Q=>J(Q.target.value),children:D.map((Q,ee)=>ae.jsx("option",{value:Q.key,children:Q.title},ee))}),ae.jsx("br",{}),ae.jsx("select",{className:"form-select",value:F,onChange:Q=>{me(Q.target.value),localStorage.setItem("plct_model",Q.target.value)},children:De.map((Q,ee)=>ae.jsx("option",{value:Q.name,children:Q.display_name},ee))}),ae.jsx("br",{}),ae.jsx(wR,{responsive:!0,children:ae.jsxs(rR,{children:[ae.jsx(Fl,{typingIndicator:r&&ae.jsx(XR,{}),children:t.map((Q,ee)=>ae.jsx(ya,{model:Q},ee))}),ae.jsx($u,{placeholder:r?"Sačekaj odgovor na postavljeno pitanje":"Ovde unesi pitanje",attachButton:!1,onSend:P,disabled:r,autoFocus:!0,activateAfterChange:!0})]})}),ae.jsx("br",{}),ae.jsx("div",{className:"follow-up-questions",children:at.map((Q,ee)=>ae.jsx("p",{onClick:()=>V(Q),children:Q},ee))})]}):u==="fail"?ae.jsx("div",{children:ae.jsx("h1",{children:"Pristup ovom delu aplikacije nije omogućen"})}):ae.jsx("div",{children:ae.jsx("h1",{children:"Sačekaj..."})})}function YN(){const a=new URLSearchParams(window.location.search).get("ak"),[r,i]=L2(["BackendApiKey"]);a&&i("BackendApiKey",a);const[u]=T.useState({accessKey:a??r.BackendApiKey});return ae.jsx(y1.Provider,{value:u,children:ae.jsx(e_,{children:ae.jsxs(BE,{children:[ae.jsx(Hf,{path:"/",element:ae.jsx(t_,{})},0),ae.jsx(Hf,{path:"/chat",element:ae.jsx(BN,{})},1)]})})})}const qN=q2.createRoot(document.getElementById("root"));qN.render(ae.jsx(M.StrictMode,{children:ae.jsx(j2,{children:ae.jsx(d2,{basename:"/app",children:ae.jsx(YN,{})})})}));
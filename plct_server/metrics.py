@@ -0,0 +1,175 @@
+"""Process metrics in the Prometheus text exposition format.
+
+Metrics are kept per process; with several worker processes, each worker
+reports its own values (scrape the workers separately or aggregate by instance).
+"""
+
+import functools
+import inspect
+import math
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import Callable, Iterable
+
+LabelValues = tuple[str, ...]
+
+_registry: list["Metric"] = []
+_collectors: list[Callable[[], Iterable[str]]] = []
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_labels(names: Iterable[str], values: Iterable[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+class Metric(ABC):
+    type_name: str
+
+    def __init__(self, name: str, help: str, labels: Iterable[str] = ()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def _key(self, labels: dict[str, str]) -> LabelValues:
+        if set(labels) != set(self.label_names):
+            raise ValueError(f"Metric {self.name} expects labels {self.label_names}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.label_names)
+
+    @abstractmethod
+    def _samples(self) -> Iterable[str]:
+        pass
+
+    def render(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} {self.type_name}"
+        with self._lock:
+            yield from self._samples()
+
+class Counter(Metric):
+    type_name = "counter"
+
+    def __init__(self, name: str, help: str, labels: Iterable[str] = ()):
+        super().__init__(name, help, labels)
+        self._values: dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def _samples(self) -> Iterable[str]:
+        for key, value in self._values.items():
+            yield f"{self.name}{_format_labels(self.label_names, key)} {_format_value(value)}"
+
+class Gauge(Counter):
+    type_name = "gauge"
+
+    def dec(self, amount: float = 1, **labels: str) -> None:
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+class Histogram(Metric):
+    type_name = "histogram"
+
+    DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+    def __init__(self, name: str, help: str, labels: Iterable[str] = (),
+                 buckets: Iterable[float] = DEFAULT_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        self._counts: dict[LabelValues, list[int]] = {}
+        self._sums: dict[LabelValues, float] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            counts = self._counts.get(key)
+            if counts is None:
+                counts = self._counts[key] = [0] * len(self.buckets)
+                self._sums[key] = 0.0
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            self._sums[key] += value
+
+    def _samples(self) -> Iterable[str]:
+        for key, counts in self._counts.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                yield f"{self.name}_bucket{_format_labels(self.label_names, key, le)} {cumulative}"
+            yield f"{self.name}_sum{_format_labels(self.label_names, key)} {_format_value(self._sums[key])}"
+            yield f"{self.name}_count{_format_labels(self.label_names, key)} {cumulative}"
+
+def add_collector(collector: Callable[[], Iterable[str]]) -> None:
+    """Add a function that returns lines of metrics computed when they are scraped."""
+    _collectors.append(collector)
+
+def sample(name: str, type_name: str, help: str, values: dict[LabelValues, float],
+           label_names: Iterable[str] = ()) -> Iterable[str]:
+    """Lines of a metric computed by a collector."""
+    label_names = tuple(label_names)
+    yield f"# HELP {name} {help}"
+    yield f"# TYPE {name} {type_name}"
+    for key, value in values.items():
+        yield f"{name}{_format_labels(label_names, key)} {_format_value(value)}"
+
+def render() -> str:
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    for collector in _collectors:
+        lines.extend(collector())
+    return "\n".join(lines) + "\n"
+
+def timed(histogram: Histogram, **labels: str) -> Callable:
+    """Decorator that observes the duration of calls of a function or a coroutine function."""
+    def decorator(fn: Callable) -> Callable:
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return await fn(*args, **kwargs)
+                finally:
+                    histogram.observe(time.perf_counter() - start, **labels)
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                histogram.observe(time.perf_counter() - start, **labels)
+        return wrapper
+    return decorator
+
+REQUESTS = Counter("plct_requests_total", "Requests to the AI endpoints", ["endpoint"])
+REQUEST_ERRORS = Counter("plct_request_errors_total", "Failed requests to the AI endpoints", ["endpoint", "error"])
+CANCELLED_REQUESTS = Counter("plct_cancelled_requests_total",
+                             "Requests whose client disconnected before the answer was complete", ["endpoint", "stage"])
+STAGE_SECONDS = Histogram("plct_stage_seconds", "Duration of the stages of AI requests", ["stage"])
+TIME_TO_FIRST_TOKEN_SECONDS = Histogram("plct_time_to_first_token_seconds",
+                                        "Time from the start of an answer to its first token", ["model"])
+TOKENS = Counter("plct_tokens_total", "Tokens sent to (in) and received from (out) the models", ["model", "direction"])
+IN_FLIGHT_STREAMS = Gauge("plct_in_flight_streams", "Answer streams being sent to clients")
+IN_FLIGHT_STREAMS.set(0)
+FILESET_READ_SECONDS = Histogram("plct_fileset_read_seconds", "Duration of file reads", ["fileset", "operation"])
@@ -1,7 +1,8 @@
 from fastapi import FastAPI
-from .endpoints import get_rag_router
-from .content.server import configure
+from .endpoints import get_rag_router, get_metrics_router
+from .content.server import configure, lifespan
 
 configure()
-app = FastAPI()
-app.include_router(get_rag_router())
\ No newline at end of file
+app = FastAPI(lifespan=lifespan)
+app.include_router(get_rag_router())
+app.include_router(get_metrics_router())
\ No newline at end of file
@@ -0,0 +1,174 @@
+"""Server-side conversation sessions of the chat.
+
+A chat client may send a session id instead of the whole history and condensed
+history with every question. The history of a session is kept in a session store,
+and its condensed history is updated in the background after each answer.
+"""
+
+import asyncio
+import logging
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import Awaitable, Callable
+
+from pydantic import BaseModel
+
+from .ai.cache import LruCache
+
+logger = logging.getLogger(__name__)
+
+class Session(BaseModel):
+    history: list[tuple[str, str]] = []  # (question, answer) turns, oldest first
+    condensed_history: str = ""
+
+class SessionStore(ABC):
+    """Sessions by session id. A session expires `ttl` seconds after its last update."""
+
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+
+    @abstractmethod
+    def get(self, session_id: str) -> Session | None:
+        pass
+
+    @abstractmethod
+    def put(self, session_id: str, session: Session) -> None:
+        pass
+
+    async def get_async(self, session_id: str) -> Session | None:
+        return self.get(session_id)
+
+    async def put_async(self, session_id: str, session: Session) -> None:
+        self.put(session_id, session)
+
+    def close(self) -> None:
+        pass
+
+    @staticmethod
+    def create(kind: str, ttl: float, max_sessions: int, path: str | None) -> "SessionStore":
+        if kind == "memory":
+            return MemorySessionStore(ttl, max_sessions)
+        elif kind == "sqlite":
+            if not path:
+                raise ValueError("Path of the SQLite session store is not set")
+            return SqliteSessionStore(ttl, path)
+        else:
+            raise ValueError(f"Unsupported session store: {kind}")
+
+class MemorySessionStore(SessionStore):
+    """Sessions of this process; the least recently used are evicted above `max_sessions`."""
+
+    def __init__(self, ttl: float, max_sessions: int):
+        super().__init__(ttl)
+        self._sessions: LruCache[str, tuple[float, Session]] = LruCache(max_sessions)
+
+    def get(self, session_id: str) -> Session | None:
+        item = self._sessions.get(session_id)
+        if item is None or item[0] < time.monotonic():
+            return None
+        return item[1]
+
+    def put(self, session_id: str, session: Session) -> None:
+        self._sessions.put(session_id, (time.monotonic() + self.ttl, session))
+
+class SqliteSessionStore(SessionStore):
+    """Sessions in a SQLite database, shared by all worker processes that use the same file.
+    The async methods query the database in worker threads, so that a slow or locked
+    database doesn't block the event loop."""
+
+    PRUNE_INTERVAL = 256  # number of writes between deletions of expired sessions
+
+    def __init__(self, ttl: float, path: str):
+        super().__init__(ttl)
+        self._writes = 0
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, timeout=5.0)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute("""CREATE TABLE IF NOT EXISTS sessions (
+                                id TEXT PRIMARY KEY, session TEXT NOT NULL, updated REAL NOT NULL)""")
+        self._db.execute("CREATE INDEX IF NOT EXISTS sessions_updated ON sessions (updated)")
+        self._db.commit()
+        logger.info(f"Opened session store database {path}")
+
+    def get(self, session_id: str) -> Session | None:
+        with self._lock:
+            row = self._db.execute("SELECT session FROM sessions WHERE id = ? AND updated >= ?",
+                                   (session_id, time.time() - self.ttl)).fetchone()
+        return Session.model_validate_json(row[0]) if row is not None else None
+
+    def put(self, session_id: str, session: Session) -> None:
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO sessions (id, session, updated) VALUES (?, ?, ?)",
+                             (session_id, session.model_dump_json(), time.time()))
+            self._writes += 1
+            if self._writes % self.PRUNE_INTERVAL == 0:
+                self._db.execute("DELETE FROM sessions WHERE updated < ?", (time.time() - self.ttl,))
+            self._db.commit()
+
+    async def get_async(self, session_id: str) -> Session | None:
+        return await asyncio.to_thread(self.get, session_id)
+
+    async def put_async(self, session_id: str, session: Session) -> None:
+        await asyncio.to_thread(self.put, session_id, session)
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+_store: SessionStore | None = None
+_max_turns: int = 20
+_updates: dict[str, asyncio.Task] = {}  # condensed history updates in progress, by session id
+
+def init(kind: str, ttl: float = 3600, max_sessions: int = 10_000, path: str | None = None,
+         max_turns: int = 20) -> None:
+    global _store, _max_turns
+    shutdown()
+    _store = SessionStore.create(kind, ttl, max_sessions, path)
+    _max_turns = max_turns
+    logger.info(f"Keeping chat sessions in a {kind} session store (TTL {ttl}s)")
+
+def shutdown() -> None:
+    """Cancel condensed history updates in progress and close the session store."""
+    global _store
+    for task in _updates.values():
+        task.cancel()
+    _updates.clear()
+    if _store is not None:
+        _store.close()
+        _store = None
+
+def enabled() -> bool:
+    return _store is not None
+
+async def load(session_id: str) -> Session | None:
+    """The session, after its condensed history update in progress in this process is done.
+    None if the session doesn't exist or has expired."""
+    update = _updates.get(session_id)
+    if update is not None:
+        await asyncio.wait([update])
+    return await _store.get_async(session_id)
+
+def add_turn(session_id: str, session: Session, question: str, answer: str,
+             condense: Callable[[list[tuple[str, str]], str], Awaitable[str | None]]) -> None:
+    """Add a question and its answer to the session, and update its condensed history in the
+    background with `condense(history, condensed_history)`, which returns None if it fails.
+    The session is stored in the background too; `load` waits until it is updated.
+
+    As in a request with the whole history, the condensed history is made from the turns
+    before the latest one, which is sent to the model as it is."""
+    history = (session.history + [(question, answer)])[-_max_turns:]
+
+    async def update() -> None:
+        await _store.put_async(session_id, Session(history=history, condensed_history=session.condensed_history))
+        condensed_history = await condense(list(session.history), session.condensed_history)
+        current = await _store.get_async(session_id)
+        # the session may have been continued meanwhile (e.g. by another worker)
+        if condensed_history is not None and current is not None and current.history == history:
+            await _store.put_async(session_id, current.model_copy(update={"condensed_history": condensed_history}))
+
+    task = asyncio.create_task(update())
+    _updates[session_id] = task
+    task.add_done_callback(lambda t: _updates.pop(session_id) if _updates.get(session_id) is t else None)
@@ -0,0 +1,127 @@
+"""Structured per-request trace log for offline latency analysis.
+
+Each traced request is written as one JSON line. Records are serialized and
+written by a background thread, so writing a trace never blocks a response.
+The log is rotated by size and requests can be sampled.
+"""
+
+import json
+import logging
+import queue
+import random
+import time
+import uuid
+from logging.handlers import QueueListener, RotatingFileHandler
+from typing import Any
+
+from .ai.query_context import QueryContext
+
+logger = logging.getLogger(__name__)
+
+class _JsonLineFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        return json.dumps(record.msg, ensure_ascii=False, default=str)
+
+class TraceLog:
+    """JSON lines file of request traces, rotated when it grows over `max_bytes`."""
+
+    def __init__(self, path: str, sample_rate: float = 1.0, max_bytes: int = 100_000_000,
+                 backup_count: int = 5, include_payloads: bool = False):
+        self.path = path
+        self.sample_rate = sample_rate
+        self.include_payloads = include_payloads
+        self._handler = RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backup_count,
+                                            encoding="utf-8", delay=True)
+        self._handler.setFormatter(_JsonLineFormatter())
+        self._queue: queue.SimpleQueue[logging.LogRecord] = queue.SimpleQueue()
+        self._listener = QueueListener(self._queue, self._handler)
+        self._listener.start()
+
+    def sampled(self) -> bool:
+        return self.sample_rate >= 1.0 or random.random() < self.sample_rate
+
+    def write(self, record: dict[str, Any]) -> None:
+        """Queue a record for writing. Serialization happens in the writer thread."""
+        self._queue.put(logging.makeLogRecord({"msg": record}))
+
+    def close(self) -> None:
+        self._listener.stop()
+        self._handler.close()
+
+class RequestTrace:
+    """Trace of one request, written to the trace log when the request is finished.
+
+    `query_context` collects the stages run by the endpoint. The query context of
+    a generated answer is set as `answer_context`; its stages are merged in."""
+
+    def __init__(self, endpoint: str, course_key: str | None, activity_key: str | None,
+                 payload: dict[str, Any] | None = None):
+        self.request_id = uuid.uuid4().hex
+        self.endpoint = endpoint
+        self.course_key = course_key
+        self.activity_key = activity_key
+        self.payload = payload
+        self.start = time.time()
+        self.query_context = QueryContext()
+        self.answer_context: QueryContext | None = None
+        self.error: str | None = None
+        self._finished = False
+
+    def record(self, end: float) -> dict[str, Any]:
+        ctx = self.answer_context or self.query_context
+        stage_times = {**ctx.stage_times, **self.query_context.stage_times}
+        record = {
+            "request_id": self.request_id,
+            "endpoint": self.endpoint,
+            "course_key": self.course_key,
+            "activity_key": self.activity_key,
+            "start": self.start,
+            "end": end,
+            "classification": ctx.classification,
+            "model": ctx.model,
+            "token_size": dict(ctx.token_size),
+            "chunks": [{"id": chunk.get("chunk_id"),
+                        "distance": float(chunk["distance"]) if "distance" in chunk else None,
+                        "lexical_score": float(chunk["lexical_score"]) if "lexical_score" in chunk else None}
+                       for chunk in ctx.chunk_metadata],
+            "stages": {name: {"start": start, "end": stage_end}
+                       for name, (start, stage_end) in stage_times.items()},
+            "error": self.error
+        }
+        if self.payload is not None:
+            record["payload"] = self.payload
+        return record
+
+    def finish(self, error: BaseException | str | None = None) -> None:
+        """Write the trace to the trace log (once), if the request is sampled."""
+        if self._finished:
+            return
+        self._finished = True
+        if error is not None:
+            self.error = error if isinstance(error, str) else type(error).__name__
+        if _trace_log is not None and _trace_log.sampled():
+            _trace_log.write(self.record(time.time()))
+
+_trace_log: TraceLog | None = None
+
+def init(path: str, sample_rate: float = 1.0, max_bytes: int = 100_000_000,
+         backup_count: int = 5, include_payloads: bool = False) -> None:
+    global _trace_log
+    shutdown()
+    logger.info(f"Writing request traces to {path} (sample rate {sample_rate})")
+    _trace_log = TraceLog(path, sample_rate, max_bytes, backup_count, include_payloads)
+
+def shutdown() -> None:
+    """Flush and close the trace log."""
+    global _trace_log
+    if _trace_log is not None:
+        _trace_log.close()
+        _trace_log = None
+
+def start_trace(endpoint: str, course_key: str | None, activity_key: str | None,
+                payload: dict[str, Any] | None = None) -> RequestTrace:
+    """Start the trace of a request. The payload is kept only if the trace log is
+    configured to include payloads."""
+    if _trace_log is None or not _trace_log.include_payloads:
+        payload = None
+    return RequestTrace(endpoint, course_key, activity_key, payload)
@@ -1,8 +1,9 @@
 from fastapi import FastAPI
-from .endpoints import get_ui_router, get_rag_router
-from .content.server import configure
+from .endpoints import get_ui_router, get_rag_router, get_metrics_router
+from .content.server import configure, lifespan
 
 configure()
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 app.include_router(get_ui_router())
 app.include_router(get_rag_router())
+app.include_router(get_metrics_router())
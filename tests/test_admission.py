@@ -0,0 +1,68 @@
+import asyncio
+
+import pytest
+
+from plct_server.ai.admission import AdmissionController, AdmissionLimiter, OverloadedError
+
+def test_waiting_request_runs_after_release():
+    async def run():
+        limiter = AdmissionLimiter("test", max_concurrency=1, tokens_per_minute=None,
+                                   max_waiting=1, timeout=1.0)
+        await limiter.acquire()
+        waiter = asyncio.create_task(limiter.acquire())
+        await asyncio.sleep(0.01)
+        queued = (limiter.running, limiter.waiting)
+        limiter.release()
+        await waiter
+        return queued, (limiter.running, limiter.waiting)
+
+    assert asyncio.run(run()) == ((1, 1), (1, 0))
+
+def test_full_queue_rejects():
+    async def run():
+        limiter = AdmissionLimiter("test", max_concurrency=1, tokens_per_minute=None,
+                                   max_waiting=0, timeout=5.0)
+        await limiter.acquire()
+        with pytest.raises(OverloadedError) as error:
+            await limiter.acquire()
+        return error.value.retry_after, limiter.rejected
+
+    assert asyncio.run(run()) == (5, 1)
+
+def test_timeout_rejects():
+    async def run():
+        limiter = AdmissionLimiter("test", max_concurrency=1, tokens_per_minute=None,
+                                   max_waiting=1, timeout=0.05)
+        await limiter.acquire()
+        with pytest.raises(OverloadedError):
+            await limiter.acquire()
+        return limiter.waiting, limiter.rejected
+
+    assert asyncio.run(run()) == (0, 1)
+
+def test_token_budget():
+    async def run():
+        limiter = AdmissionLimiter("test", max_concurrency=None, tokens_per_minute=600,
+                                   max_waiting=1, timeout=0.05)
+        await limiter.acquire(500)
+        # 100 tokens are left and the budget refills at 10 tokens per second
+        with pytest.raises(OverloadedError) as error:
+            await limiter.acquire(200)
+        await limiter.acquire(50)
+        return error.value.retry_after
+
+    assert asyncio.run(run()) == 10
+
+def test_controller_releases_all_limiters():
+    async def run():
+        controller = AdmissionController(max_waiting=0, timeout=1.0, provider_max_concurrency={"openai": 1})
+        release = await controller.acquire("openai", "gpt", max_concurrency=2)
+        with pytest.raises(OverloadedError):
+            await controller.acquire("openai", "gpt", max_concurrency=2)
+        release()
+        release = await controller.acquire("openai", "gpt", max_concurrency=2)
+        return controller.stats()
+
+    stats = asyncio.run(run())
+    assert stats["provider openai"]["running"] == 1
+    assert stats["model gpt"]["running"] == 1
@@ -0,0 +1,69 @@
+import pytest
+
+from plct_server.ai import answer_cache
+from plct_server.ai.answer_cache import AnswerCache, CachedAnswer
+from plct_server.ai.cache import LruCache
+
+KEY = ("v1", "course", "activity", "classification", "model")
+
+def test_lru_evicts_least_recently_used():
+    cache = LruCache(2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == 1
+    cache.put("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+    assert cache.stats() == {"hits": 3, "misses": 1, "size": 2}
+
+def test_lru_disabled():
+    cache = LruCache(0)
+    cache.put("a", 1)
+    assert cache.get("a") is None
+    assert len(cache) == 0
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+@pytest.fixture
+def clock(monkeypatch) -> Clock:
+    clock = Clock()
+    monkeypatch.setattr(answer_cache.time, "monotonic", clock)
+    return clock
+
+def test_answer_cache_similarity_threshold(clock):
+    cache = AnswerCache(maxsize=10, ttl=60, min_similarity=0.9)
+    cache.put(KEY, [1.0, 0.0], CachedAnswer("answer", ["followup"]))
+    assert cache.get(KEY, [0.95, 0.3122]) == CachedAnswer("answer", ["followup"])
+    assert cache.get(KEY, [0.6, 0.8]) is None
+    assert cache.get(("v2",) + KEY[1:], [1.0, 0.0]) is None
+    assert cache.stats() == {"hits": 1, "misses": 2, "size": 1}
+
+def test_answer_cache_ttl(clock):
+    cache = AnswerCache(maxsize=10, ttl=60, min_similarity=0.9)
+    cache.put(KEY, [1.0, 0.0], CachedAnswer("old", []))
+    clock.now += 30
+    cache.put(KEY, [0.0, 1.0], CachedAnswer("new", []))
+    clock.now += 31
+    assert cache.get(KEY, [1.0, 0.0]) is None
+    assert cache.get(KEY, [0.0, 1.0]) == CachedAnswer("new", [])
+    assert cache.stats()["size"] == 1
+    clock.now += 30
+    assert cache.get(KEY, [0.0, 1.0]) is None
+    assert cache.stats()["size"] == 0
+
+def test_answer_cache_evicts_oldest(clock):
+    cache = AnswerCache(maxsize=2, ttl=60, min_similarity=0.9)
+    other_key = KEY[:-1] + ("other model",)
+    cache.put(KEY, [1.0, 0.0], CachedAnswer("first", []))
+    cache.put(other_key, [1.0, 0.0], CachedAnswer("second", []))
+    cache.put(KEY, [0.0, 1.0], CachedAnswer("third", []))
+    assert cache.get(KEY, [1.0, 0.0]) is None
+    assert cache.get(other_key, [1.0, 0.0]) == CachedAnswer("second", [])
+    assert cache.get(KEY, [0.0, 1.0]) == CachedAnswer("third", [])
+    assert cache.stats()["size"] == 2
@@ -0,0 +1,36 @@
+import numpy as np
+
+from plct_server.ai.context_packing import mmr_order, pack
+
+EMBEDDINGS = np.array([
+    [1.0, 0.0, 0.0],
+    [1.0, 0.0, 0.0],
+    [0.0, 1.0, 0.0],
+    [0.0, 0.0, 1.0],
+])
+
+RELEVANCE = np.array([0.9, 0.85, 0.6, 0.3])
+
+def test_mmr_with_lambda_one_orders_by_relevance():
+    assert mmr_order(EMBEDDINGS, RELEVANCE, 1.0) == [0, 1, 2, 3]
+
+def test_mmr_penalizes_similar_candidates():
+    # the duplicate of the first candidate drops behind the dissimilar ones
+    assert mmr_order(EMBEDDINGS, RELEVANCE, 0.5) == [0, 2, 3, 1]
+
+def test_mmr_drops_duplicates():
+    assert mmr_order(EMBEDDINGS, RELEVANCE, 1.0, max_similarity=0.95) == [0, 2, 3]
+
+def test_pack_stays_within_budget():
+    assert pack([40, 30, 20], 100) == [0, 1, 2]
+    assert pack([40, 30, 20], 90) == [0, 1, 2]
+    assert pack([40, 30, 20], 89) == [0, 1]
+
+def test_pack_skips_chunks_that_do_not_fit():
+    assert pack([50, 80, 30, 10], 90) == [0, 2, 3]
+    assert pack([120], 100) == []
+
+def test_pack_counts_separators_between_chunks():
+    # 40 + (2 + 30) + (2 + 20) = 94
+    assert pack([40, 30, 20], 94, separator_tokens=2) == [0, 1, 2]
+    assert pack([40, 30, 20], 93, separator_tokens=2) == [0, 1]
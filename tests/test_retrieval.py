@@ -0,0 +1,82 @@
+import math
+
+import pytest
+
+from plct_server.ai.lexical_index import LexicalIndex, LexicalMatch, normalize, tokenize
+from plct_server.ai.row_ranges import RowRanges
+from plct_server.ai.vector_store import VectorMatch, fuse_matches
+
+METADATAS = [
+    {"course_key": "c1", "activity_key": "a1"},
+    {"course_key": "c1", "activity_key": "a1"},
+    {"course_key": "c1", "activity_key": "a2"},
+    {"course_key": "c2", "activity_key": "a1"},
+]
+
+TEXTS = [
+    "petlja for ponavlja naredbe",
+    "promenljiva cuva vrednost",
+    "petlja petlja while",
+    "funkcija get_user_name vraca ime",
+]
+
+IDS = ["r0", "r1", "r2", "r3"]
+
+@pytest.fixture
+def index() -> LexicalIndex:
+    return LexicalIndex.build(TEXTS, IDS, METADATAS)
+
+def test_normalize_folds_scripts_and_diacritics():
+    assert normalize("Петља") == normalize("petlja") == "petlja"
+    assert normalize("čćšžđ") == "ccszdj"
+
+def test_tokenize_splits_identifiers():
+    assert tokenize("get_user_name") == ["get_user_name", "get", "user", "name"]
+    assert tokenize("getUserName") == ["getusername", "get", "user", "name"]
+    assert tokenize("obična reč") == ["obicna", "rec"]
+
+def test_bm25_ranks_by_term_frequency(index):
+    matches = index.query("петља", {}, 10)
+    assert [match.id for match in matches] == ["r2", "r0"]
+    assert matches[0].score > matches[1].score > 0
+
+def test_bm25_prefers_rare_terms(index):
+    # "petlja" is in two rows, "vrednost" in one
+    matches = index.query("petlja vrednost", {}, 10)
+    assert matches[0].id == "r1"
+
+def test_query_filters_and_limits(index):
+    assert [m.id for m in index.query("petlja", {"course_key": "c1"}, 1)] == ["r2"]
+    where = {"$and": [{"course_key": "c1"}, {"activity_key": "a1"}]}
+    assert [m.id for m in index.query("petlja", where, 10)] == ["r0"]
+    assert index.query("user", {"course_key": "c1"}, 10) == []
+    assert [m.id for m in index.query("user", {"course_key": "c2"}, 10)] == ["r3"]
+    assert index.query("nepoznato", {}, 10) == []
+    assert index.query("petlja", {}, 0) == []
+
+def test_row_ranges():
+    ranges = RowRanges(METADATAS)
+    assert ranges.rows_for_filter({}) == slice(0, 4)
+    assert ranges.rows_for_filter({"course_key": "c1"}) == slice(0, 3)
+    assert ranges.rows_for_filter({"$and": [{"course_key": "c1"}, {"activity_key": "a2"}]}) == slice(2, 3)
+    assert ranges.rows_for_filter({"course_key": "missing"}) == slice(0, 0)
+    with pytest.raises(ValueError):
+        ranges.rows_for_filter({"activity_key": "a1"})
+
+def test_fuse_matches_by_reciprocal_rank():
+    vector_matches = [VectorMatch(id=chunk_id, distance=0.1 * i, metadata={})
+                      for i, chunk_id in enumerate(["a", "b", "c"])]
+    lexical_matches = [LexicalMatch(id="c", score=5.0, metadata={}),
+                       LexicalMatch(id="d", score=2.5, metadata={})]
+    fused = fuse_matches(vector_matches, lexical_matches, n_results=4)
+    # "c" is found by both retrievals, "d" only lexically, behind "b" (same rank, one list)
+    assert [match.id for match in fused] == ["c", "a", "b", "d"]
+    assert fused[0].distance == pytest.approx(0.2)
+    assert fused[0].metadata["lexical_score"] == "5.0000"
+    assert math.isnan(fused[3].distance)
+    assert fused[3].metadata["lexical_score"] == "2.5000"
+    assert "lexical_score" not in fused[1].metadata
+
+def test_fuse_matches_limits_results():
+    vector_matches = [VectorMatch(id=str(i), distance=0.0, metadata={}) for i in range(5)]
+    assert [match.id for match in fuse_matches(vector_matches, [], n_results=2)] == ["0", "1"]
@@ -0,0 +1,107 @@
+import asyncio
+
+import pytest
+
+from plct_server.ai.single_flight import SharedStream, SingleFlight, wait_shared
+
+async def numbers(n: int, delay: float = 0.0, closed: list | None = None):
+    try:
+        for i in range(n):
+            await asyncio.sleep(delay)
+            yield i
+    finally:
+        if closed is not None:
+            closed.append(True)
+
+async def collect(iterator) -> list:
+    return [item async for item in iterator]
+
+def test_subscribers_get_all_items():
+    async def run():
+        shared = SharedStream(numbers(5, 0.001))
+        first = shared.subscribe()
+        await anext(first)
+        # a late subscriber gets the items it missed
+        second = shared.subscribe()
+        return [0] + await collect(first), await collect(second)
+
+    assert asyncio.run(run()) == ([0, 1, 2, 3, 4], [0, 1, 2, 3, 4])
+
+def test_source_error_is_raised_to_subscribers():
+    async def failing():
+        yield 1
+        raise ValueError("upstream failed")
+
+    async def run():
+        shared = SharedStream(failing())
+        await collect(shared.subscribe())
+
+    with pytest.raises(ValueError):
+        asyncio.run(run())
+
+def test_closing_unstarted_subscription_cancels_pump():
+    async def run():
+        closed = []
+        shared = SharedStream(numbers(1000, 0.01, closed))
+        subscription = shared.subscribe()
+        await asyncio.sleep(0.02)
+        await subscription.aclose()
+        await asyncio.sleep(0.01)
+        return shared._task.cancelled(), closed
+
+    assert asyncio.run(run()) == (True, [True])
+
+def test_pump_runs_while_a_subscriber_is_left():
+    async def run():
+        shared = SharedStream(numbers(5, 0.001))
+        first = shared.subscribe()
+        second = shared.subscribe()
+        await first.aclose()
+        return await collect(second), shared._task.cancelled()
+
+    assert asyncio.run(run()) == ([0, 1, 2, 3, 4], False)
+
+def test_cancelled_subscriber_unsubscribes():
+    async def run():
+        shared = SharedStream(numbers(1000, 0.01))
+        reader = asyncio.create_task(collect(shared.subscribe()))
+        await asyncio.sleep(0.03)
+        reader.cancel()
+        await asyncio.gather(reader, return_exceptions=True)
+        await asyncio.sleep(0.01)
+        return shared._task.cancelled()
+
+    assert asyncio.run(run())
+
+def test_single_flight_coalesces_calls():
+    calls = []
+
+    async def fetch():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return "result"
+
+    async def run():
+        flight = SingleFlight()
+        results = await asyncio.gather(*(flight.do("key", fetch) for _ in range(3)))
+        return results, flight.coalesced
+
+    assert asyncio.run(run()) == (["result"] * 3, 2)
+    assert len(calls) == 1
+
+def test_shared_call_is_cancelled_with_its_last_waiter():
+    async def run():
+        call = asyncio.ensure_future(asyncio.sleep(10))
+        waiters = {}
+        first = asyncio.create_task(wait_shared(call, waiters))
+        second = asyncio.create_task(wait_shared(call, waiters))
+        await asyncio.sleep(0)
+        first.cancel()
+        await asyncio.gather(first, return_exceptions=True)
+        cancelled_early = call.cancelled()
+        second.cancel()
+        await asyncio.gather(second, return_exceptions=True)
+        await asyncio.sleep(0)
+        return cancelled_early, call.cancelled(), waiters
+
+    assert asyncio.run(run()) == (False, True, {})